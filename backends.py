@@ -0,0 +1,24 @@
+######################################################################################
+# backends.py
+# Purpose:   Pick the GPIO and VLC implementations used by the players.
+#
+#            On the Raspberry Pi these are the real RPi.GPIO and python-vlc modules.  Setting
+#            the environment variable SIMPSONSTV_BACKEND=sim swaps in the stand-ins from
+#            simulation.py, so the players and bench.py can run on a normal Linux box:
+#
+#                from backends import GPIO, vlc
+###########################################################################################
+
+import os
+
+BACKEND = os.environ.get('SIMPSONSTV_BACKEND', 'hardware')
+
+if (BACKEND == 'sim'):
+    from simulation import SimulatedGPIO, SimulatedVlc
+    GPIO = SimulatedGPIO()
+    vlc = SimulatedVlc(speed=float(os.environ.get('SIMPSONSTV_SIM_SPEED', '1')))
+elif (BACKEND == 'hardware'):
+    import RPi.GPIO as GPIO
+    import vlc
+else:
+    raise ImportError(f"Unknown SIMPSONSTV_BACKEND '{BACKEND}' (expected 'hardware' or 'sim')")
@@ -0,0 +1,874 @@
+#!/usr/bin/env python3
+######################################################################################
+# bench.py
+# Purpose:   Benchmarks that run on a normal Linux box (no Raspberry Pi needed).
+#
+#            python3 bench.py channel-switch [--files 50000] [--channels 50]
+#                Builds a synthetic video library and compares finding the first video of
+#                the next channel with a linear scan of the playlist against the channel
+#                offset table in VideoSelector.
+#
+#            python3 bench.py library-load [--sizes 1000,10000,50000] [--channels 50]
+#                Time to build the library on first run (full scan), to load the saved index
+#                and to build the VideoSelector playlist, for each library size.
+#
+#            python3 bench.py catalog [--files 50000] [--channels 50]
+#                Resident memory (RSS) of player-alt.py's playlist: every path as a string plus
+#                one VLC Media per video in the media list (the old way) against the compact
+#                VideoSelector catalog plus the window of media around the current video.  Each
+#                is measured in a new process, after loading the library index.
+#
+#            python3 bench.py watch [--files 500] [--settle 3] [--poll-interval 5]
+#                Copies a burst of videos into a library watched by watcher.py, with inotify and
+#                with polling, and reports how many rebuilds it caused and how long after the
+#                last file the new videos were picked up.
+#
+#            python3 bench.py osd
+#                Time to show a channel and title: "clear" and print (the old way) against the
+#                console and framebuffer OSDs in osd.py (the framebuffer is a file here).
+#
+#            The scenarios below run player.py or player-alt.py (--player) against the simulated
+#            GPIO and VLC from simulation.py (SIMPSONSTV_BACKEND=sim) on a small synthetic library:
+#
+#            python3 bench.py idle-cpu [--player player] [--seconds 10]
+#                CPU used by the whole process while a video plays and no buttons are touched.
+#            python3 bench.py latency [--player player] [--button left] [--presses 20]
+#                Replays a trace of button taps and measures the time from each release to the
+#                first command the player sends to VLC.  (Both players deliberately wait 1.5
+#                seconds after the right button so the channel/video name can be read.)
+#            python3 bench.py startup [--player player] [--files 5000]
+#                Time from process start to the first frame, with no library index yet (first
+#                run) and with the saved index, each measured in a new process.
+#            python3 bench.py scrub [--player player] [--hold 6000]
+#                Holds the left button to rewind through a video whose keyframe index comes from
+#                a synthetic Matroska file, a synthetic MP4 file and no index at all (an empty
+#                file), and reports the number of seeks, how many landed on keyframes, the time
+#                from each seek to VLC reporting the new position against the frame interval,
+#                and how far the rewind went.  The simulated VLC takes longer to seek the further
+#                the target is from the keyframe before it.
+#            python3 bench.py governor [--player player] [--phase 5]
+#                Plays a library with a normal and a lighter copy of every video through a cool
+#                phase, a hot phase (the simulated Pi is throttled: it can't decode the normal
+#                copy without losing pictures and sysfs reports 82 C at a reduced frequency, from
+#                files standing in for sysfs) and a cool phase again, with a fixed rendition and
+#                with the rendition governor (sampling faster than on the Pi), and reports the
+#                pictures lost in each phase and the governor's decisions.  The telemetry in the
+#                trace is then replayed through the policy to check it makes the same decisions.
+#            python3 bench.py burst [--presses 5] [--interval 150] [--open-time 600] [--stop-time 250]
+#                Taps the right button quickly in player-alt.py (with OSD_SECONDS = 0, so every
+#                press could load a video), then the left button twice, with the simulated VLC
+#                taking a while to close and open each video.  Compares calling VLC straight from
+#                the button handlers with the command queue (commands.py): the videos loaded, the
+#                pauses sent to VLC, whether it landed on the right video and the time from the
+#                last press to that video's first frame.
+#            python3 bench.py recovery [--player player] [--files 6] [--loops 3]
+#                Plays a channel of short videos round and round with one video the simulated VLC
+#                can't decode, one whose picture freezes and one that leaves VLC unable to play
+#                anything more, and reports what the playback supervisor (supervisor.py) did: the
+#                failures, the time from each failure being noticed to the next picture (against
+#                the 1 second target), the VLC restarts, the videos blocklisted and whether any
+#                was played again after being blocklisted.  With --all-errors VLC reports an error
+#                for every video instead (e.g. a broken video output): it should be restarted
+#                rather than every video being blocklisted.
+#            python3 bench.py soak [--player player] [--hours 4] [--speed 600] [--video-minutes 22]
+#                                  [--check]
+#                Plays on a sped up simulated clock and reports the resident memory (RSS), the
+#                number of live VLC Media objects, open files and threads over the run.  With
+#                --check it fails (exit status 1) unless they stay flat once warmed up, e.g.
+#                thousands of videos in a few minutes:
+#                    python3 bench.py soak --hours 200 --video-minutes 5 --speed 6000 --check
+###########################################################################################
+
+import argparse
+import collections
+import contextlib
+import importlib.util
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time as time_ # Don't override time
+
+os.environ['SIMPSONSTV_BACKEND'] = 'sim' # Before anything imports backends.py
+
+from library import LibraryIndex, VideoSelector, default_index_path
+from commands import CommandQueue
+from governor import DROP_SAMPLES, RenditionGovernor, RenditionPolicy, read_telemetry, replay
+from osd import ConsoleOSD, FramebufferOSD
+from scrub import default_keyframes_path
+from simulation import replay_trace, tap_trace
+
+PLAYERS = ('player', 'player-alt')
+BUTTON_GPIOS = {'left': 26, 'right': 25}
+
+# Create an on-disk library of empty video files spread over "channels" channels
+def make_library(root, files, channels, extension='.mkv'):
+    for channel in range(channels):
+        channelPath = os.path.join(root, f"Channel {channel:03d}")
+        os.makedirs(channelPath, exist_ok=True)
+        for episode in range(channel, files, channels):
+            open(os.path.join(channelPath, f"Episode {episode:06d}{extension}"), 'w').close()
+
+# Run func() repeatedly for about "duration" seconds and return the mean time per call
+def time_call(func, duration=1.0):
+    calls = 0
+    start = time_.perf_counter()
+    elapsed = 0
+    while (elapsed < duration):
+        func()
+        calls += 1
+        elapsed = time_.perf_counter() - start
+    return elapsed / calls
+
+def format_time(seconds):
+    if (seconds >= 1e-3):
+        return f"{seconds * 1e3:.3f} ms"
+    return f"{seconds * 1e6:.3f} us"
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+# Resident memory of this process in KB
+def get_rss():
+    with open('/proc/self/status', 'r') as file:
+        for line in file:
+            if (line.startswith('VmRSS:')):
+                return int(line.split()[1])
+    return 0
+
+# The players print to (and clear) the LCD console; keep that out of the benchmark output
+@contextlib.contextmanager
+def console_silenced():
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = (os.dup(1), os.dup(2))
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in (devnull, *saved):
+            os.close(fd)
+
+# Load one of the player scripts and start it playing the library in videoRoot with the
+# simulated backends.  Returns the player's module.
+def start_player(name, videoRoot):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name + '.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    player = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(player)
+    player.OSD_DEVICE = '' # Never draw on this machine's screen
+    if (name == 'player'):
+        player.Root_Path = videoRoot
+        player.Directories = sorted(entry for entry in os.listdir(videoRoot)
+                                    if not entry.startswith('.') and os.path.isdir(os.path.join(videoRoot, entry)))
+        player.initialize()
+        threading.Thread(target=player.Input.run, name='input-engine', daemon=True).start()
+    else:
+        player.start(videoRoot)
+    return player
+
+# Stop the player's background threads before its temporary library is removed, so none of them
+# writes to (or complains about) files that are gone
+def stop_player(name, player):
+    player.Supervisor.stop()
+    player.Governor.stop()
+    if (player.Watcher is not None):
+        player.Watcher.stop()
+    if (name == 'player'):
+        player.Input.stop()
+    else:
+        player.Commands.stop()
+    player.Journal.close()
+
+# A temporary videos root for the player scenarios.  The players keep their own files (index,
+# journal, log...) next to the videos root, so it gets a directory of its own.
+@contextlib.contextmanager
+def player_library(files, channels, extension='.mkv'):
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as root:
+        videoRoot = os.path.join(root, 'videos') + os.sep
+        make_library(videoRoot, files, channels, extension)
+        yield videoRoot
+
+# The VLC media player a player script plays its videos with
+def media_player(name, player):
+    if (name == 'player'):
+        return player.player
+    return player.VlcMediaListPlayer.get_media_player()
+
+# Just enough of a Matroska file for its keyframe index: an EBML header and a Segment with a
+# SeekHead, Info, Tracks (one video track), one empty Cluster and the Cues after it, with a
+# keyframe every keyframeInterval milliseconds
+def write_mkv(path, duration, keyframeInterval, frameRate):
+    def element(elementId, body):
+        return elementId.to_bytes((elementId.bit_length() + 7) // 8, 'big') + b'\x01' + len(body).to_bytes(7, 'big') + body
+    def uint(elementId, value, size=None):
+        return element(elementId, value.to_bytes(size or max(1, (value.bit_length() + 7) // 8), 'big'))
+
+    info = element(0x1549A966, uint(0x2AD7B1, 1_000_000)) # TimecodeScale: milliseconds
+    tracks = element(0x1654AE6B, element(0xAE, uint(0xD7, 1) + uint(0x83, 1) # Track 1, video
+                                               + uint(0x23E383, round(1e9 / frameRate)))) # DefaultDuration (ns)
+    cluster = element(0x1F43B675, uint(0xE7, 0))
+    def seek_head(positions):
+        return element(0x114D9B74, b''.join(element(0x4DBB, uint(0x53AB, elementId) + uint(0x53AC, position, 8))
+                                            for elementId, position in positions))
+    headSize = len(seek_head([(0x1549A966, 0), (0x1654AE6B, 0), (0x1C53BB6B, 0)]))
+    clusterPosition = headSize + len(info) + len(tracks)
+    cues = element(0x1C53BB6B, b''.join(
+        element(0xBB, uint(0xB3, time) + element(0xB7, uint(0xF7, 1) + uint(0xF1, clusterPosition)))
+        for time in range(0, duration, keyframeInterval)))
+    head = seek_head([(0x1549A966, headSize), (0x1654AE6B, headSize + len(info)),
+                      (0x1C53BB6B, clusterPosition + len(cluster))])
+    with open(path, 'wb') as file:
+        file.write(element(0x1A45DFA3, element(0x4282, b'matroska'))
+                   + element(0x18538067, head + info + tracks + cluster + cues))
+
+# Just enough of an MP4 file for its keyframe index: the moov box (after the media data) with one
+# video track whose sync sample table has a keyframe every keyframeInterval milliseconds
+def write_mp4(path, duration, keyframeInterval, frameRate):
+    def box(boxType, body):
+        return struct.pack('>I4s', 8 + len(body), boxType) + body
+    timescale = frameRate * 1_000
+    frames = duration * frameRate // 1_000
+    sync = range(1, frames + 1, keyframeInterval * frameRate // 1_000) # Sample numbers start at 1
+    stbl = box(b'stbl', box(b'stts', struct.pack('>III', 0, 1, frames) + struct.pack('>I', 1_000))
+                        + box(b'stss', struct.pack(f'>II{len(sync)}I', 0, len(sync), *sync)))
+    mdia = box(b'mdia', box(b'mdhd', struct.pack('>IIIIIHH', 0, 0, 0, timescale, frames * 1_000, 0, 0))
+                        + box(b'hdlr', struct.pack('>II4s12x', 0, 0, b'vide') + b'\0')
+                        + box(b'minf', stbl))
+    with open(path, 'wb') as file:
+        file.write(box(b'ftyp', b'isom\0\0\0\0isom') + box(b'mdat', b'') + box(b'moov', box(b'trak', mdia)))
+
+def bench_channel_switch(args):
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as indexDir:
+        make_library(root, args.files, args.channels)
+        videoRoot = root + os.sep
+        library = LibraryIndex(videoRoot, '.mkv', os.path.join(indexDir, 'library.json')).load()
+        selector = VideoSelector(videoRoot, '.mkv', library)
+        channels = selector.get_channels()
+        videos = list(selector.get_videos()) # The old VideoSelector kept a list of paths
+        print(f"Library: {len(videos)} videos in {len(channels)} channels")
+
+        # The approach used before the channel table: scan the playlist for the first path
+        # that starts with the channel's directory
+        channelIndex = [0]
+        def linear_next_channel():
+            channelIndex[0] = (channelIndex[0] + 1) % len(channels)
+            channelPath = os.path.join(videoRoot, channels[channelIndex[0]])
+            for videoIndex in range(len(videos)):
+                if (videos[videoIndex].startswith(channelPath)):
+                    return videoIndex
+            return -1
+
+        lastVideo = len(videos) - 1
+        linear = time_call(linear_next_channel)
+        table = time_call(selector.next_channel)
+        lookup = time_call(lambda: selector.channel_of(lastVideo))
+        print(f"next channel (linear scan):    {format_time(linear)}")
+        print(f"next channel (channel table):  {format_time(table)}")
+        print(f"channel of video (bisect):     {format_time(lookup)}")
+        print(f"speed-up: {linear / table:.0f}x")
+
+def bench_library_load(args):
+    for size in (int(size) for size in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as indexDir:
+            make_library(root, size, min(args.channels, size))
+            videoRoot = root + os.sep
+            indexPath = os.path.join(indexDir, 'library.json')
+
+            start = time_.perf_counter()
+            LibraryIndex(videoRoot, '.mkv', indexPath).load()
+            cold = time_.perf_counter() - start
+            start = time_.perf_counter()
+            library = LibraryIndex(videoRoot, '.mkv', indexPath).load()
+            warm = time_.perf_counter() - start
+            start = time_.perf_counter()
+            VideoSelector(videoRoot, '.mkv', library)
+            selector = time_.perf_counter() - start
+            print(f"{size:>8} videos: scan {format_time(cold):>12}   index {format_time(warm):>12}   "
+                  f"playlist {format_time(selector):>12}")
+
+# Runs in a new process started by bench_catalog(): load the library index, build player-alt's
+# playlist the given way and print the RSS (KB) before and after and the number of VLC Media created
+def report_playlist_memory(mode, videoRoot):
+    import gc
+    from backends import vlc
+
+    library = LibraryIndex(videoRoot, '.mkv').load()
+    instance = vlc.Instance()
+    gc.collect()
+    before = get_rss()
+    if (mode == 'paths'):
+        # What player-alt.py used to build: the path and the file to play of every video, all
+        # of them handed to VLC's media list
+        paths, playable = [], []
+        for channel in library.get_channels():
+            for file in library.get_videos(channel):
+                paths.append(os.path.join(videoRoot, channel, file))
+                playable.append(library.get_playable_path(channel, file))
+        mediaList = instance.media_list_new(playable)
+    else:
+        selector = VideoSelector(videoRoot, '.mkv', library)
+        window = min(2 * 10 + 1, len(selector)) # player-alt.py's PLAYLIST_WINDOW either side
+        mediaList = instance.media_list_new([selector.get_playable_video(index) for index in range(window)])
+    gc.collect()
+    print(before, get_rss(), vlc.createdMedia)
+
+def bench_catalog(args):
+    scriptDirectory = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as root:
+        videoRoot = os.path.join(root, 'videos') + os.sep
+        make_library(videoRoot, args.files, args.channels)
+        LibraryIndex(videoRoot, '.mkv').load() # Save the index for the measuring processes
+        print(f"Library: {args.files} videos in {args.channels} channels")
+        for mode, name in (('paths', 'path list + Media per video'), ('catalog', 'catalog + window')):
+            code = f"import bench; bench.report_playlist_memory({mode!r}, {videoRoot!r})"
+            result = subprocess.run([sys.executable, '-c', code], cwd=scriptDirectory, capture_output=True, text=True)
+            try:
+                before, after, media = (int(value) for value in result.stdout.split()[-3:])
+            except ValueError:
+                print(f"{name}: failed\n{result.stderr}")
+                continue
+            print(f"{name:>28}: RSS {after / 1_024:6.1f} MB (+{(after - before) / 1_024:.1f} MB)   {media} VLC Media")
+    print("(The simulated Media are small Python objects; a real libvlc Media costs more.)")
+
+def bench_watch(args):
+    import watcher
+
+    for mode in ('inotify', 'polling'):
+        with tempfile.TemporaryDirectory() as root:
+            videoRoot = os.path.join(root, 'videos') + os.sep
+            make_library(videoRoot, 20, 2)
+            library = LibraryIndex(videoRoot, '.mkv').load()
+            rebuilds = []
+            if (mode == 'polling'):
+                def missing_inotify():
+                    raise OSError("inotify disabled by bench.py")
+                realInotify, watcher.Inotify = watcher.Inotify, missing_inotify
+            try:
+                libraryWatcher = watcher.LibraryWatcher(library, lambda: rebuilds.append(time_.monotonic()),
+                                                        settle=args.settle, pollInterval=args.poll_interval).start()
+            finally:
+                if (mode == 'polling'):
+                    watcher.Inotify = realInotify
+            time_.sleep(0.5)
+            # A bulk copy into two channels and a new one: each file is created, written in a few
+            # chunks and closed
+            os.makedirs(os.path.join(videoRoot, "Channel 002"))
+            for index in range(args.files):
+                with open(os.path.join(videoRoot, f"Channel {index % 3:03d}", f"New {index:06d}.mkv"), 'wb') as file:
+                    for chunk in range(4):
+                        file.write(b'\0' * 65_536)
+            copied = time_.monotonic()
+            deadline = copied + args.settle + 2 * args.poll_interval + 5
+            while (not rebuilds and time_.monotonic() < deadline):
+                time_.sleep(0.05)
+            time_.sleep(args.settle) # Catch any extra rebuilds
+            libraryWatcher.stop()
+            videos = sum(len(library.get_videos(channel)) for channel in library.get_channels())
+            pickedUp = f"{(rebuilds[0] - copied):.1f} s after the last file" if rebuilds else "never"
+            print(f"{libraryWatcher.mode:>8}: {args.files} files copied, {len(rebuilds)} rebuild(s), "
+                  f"picked up {pickedUp}, {videos} videos in the index")
+
+def bench_osd(args):
+    lines = ["Channel: The Simpsons", "S01E01 - Simpsons Roasting on an Open Fire"]
+    def clear_and_print():
+        os.system("clear")
+        print("")
+        print("")
+        print("")
+        for line in lines:
+            print("  " + line)
+    with tempfile.NamedTemporaryFile() as file, console_silenced():
+        console = ConsoleOSD()
+        framebuffer = FramebufferOSD(file.name, args.width, args.height, args.bits_per_pixel)
+        results = [
+            ('os.system("clear") + print', time_call(clear_and_print)),
+            ('ConsoleOSD.show()', time_call(lambda: console.show(lines))),
+            (f'FramebufferOSD.show() {args.width}x{args.height}x{args.bits_per_pixel}',
+             time_call(lambda: framebuffer.show(lines))),
+        ]
+        framebuffer.close()
+    for name, seconds in results:
+        print(f"{name:<40} {format_time(seconds)}")
+
+def bench_idle_cpu(args):
+    from backends import vlc
+
+    with player_library(args.files, args.channels) as videoRoot:
+        with console_silenced():
+            player = start_player(args.player, videoRoot)
+            time_.sleep(1) # Let the first video start
+            start, startCpu = time_.monotonic(), time_.process_time()
+            time_.sleep(args.seconds)
+            elapsed, cpu = time_.monotonic() - start, time_.process_time() - startCpu
+            playing = vlc.commands[-1][1] if vlc.commands else None
+            stop_player(args.player, player)
+    print(f"{args.player}: {cpu / elapsed * 100:.2f}% CPU over {elapsed:.1f} s idle (last VLC command: {playing})")
+
+def bench_latency(args):
+    from backends import GPIO, vlc
+
+    pin = BUTTON_GPIOS[args.button]
+    steps = tap_trace(pin, args.presses, interval=args.interval, hold=args.hold)
+    releases = []
+    def on_step(at, pin, level):
+        if (level):
+            releases.append(time_.monotonic())
+
+    with player_library(args.files, args.channels) as videoRoot:
+        with console_silenced():
+            player = start_player(args.player, videoRoot)
+            time_.sleep(1) # Let the first video start
+            vlc.commands.clear()
+            replay_trace(GPIO, steps, on_step)
+            time_.sleep(args.interval / 1_000)
+            commands = list(vlc.commands)
+            stop_player(args.player, player)
+
+    latencies = []
+    for index, release in enumerate(releases):
+        nextRelease = releases[index + 1] if index + 1 < len(releases) else float('inf')
+        for at, command, argument in commands:
+            if (release <= at < nextRelease):
+                latencies.append((at - release) * 1_000)
+                break
+    print(f"{args.player}, {args.button} button: {len(latencies)}/{len(releases)} presses acted on")
+    if (latencies):
+        print(f"release to VLC command: mean {sum(latencies) / len(latencies):.1f} ms   "
+              f"p95 {percentile(latencies, 0.95):.1f} ms   max {max(latencies):.1f} ms")
+
+# Runs in a new process started by bench_startup(): start a player and print the milliseconds
+# from process start to its first frame
+def report_startup(name, videoRoot):
+    with console_silenced():
+        player = start_player(name, videoRoot)
+        deadline = time_.monotonic() + 30
+        while (not player.Latency.samples and time_.monotonic() < deadline):
+            time_.sleep(0.01)
+        samples = list(player.Latency.samples)
+        while (not os.path.exists(default_index_path(videoRoot)) and time_.monotonic() < deadline):
+            time_.sleep(0.01) # Let the background scan save the index for the next run
+        stop_player(name, player)
+    print(samples[0][1] if samples else -1)
+
+def bench_startup(args):
+    scriptDirectory = os.path.dirname(os.path.abspath(__file__))
+    with player_library(args.files, args.channels) as videoRoot:
+        for run in ('no index', 'saved index', 'resume'):
+            if (run == 'resume'):
+                # Pretend the journal saved part way through the last video of the last channel
+                with open(os.path.join(os.path.dirname(os.path.normpath(videoRoot)), 'resume.journal'), 'a') as file:
+                    channel = sorted(os.listdir(videoRoot))[-1]
+                    episode = os.path.join(videoRoot, channel, sorted(os.listdir(os.path.join(videoRoot, channel)))[-1])
+                    file.write(f'{{"c":"{channel}","e":"{episode}","p":60000}}\n')
+            code = f"import bench; bench.report_startup({args.player!r}, {videoRoot!r})"
+            result = subprocess.run([sys.executable, '-c', code], cwd=scriptDirectory, capture_output=True, text=True)
+            lines = result.stdout.split()
+            milliseconds = float(lines[-1]) if lines else -1
+            print(f"{args.player}, {run:>11}: first frame {milliseconds:7.0f} ms after process start"
+                  if milliseconds >= 0 else f"{args.player}, {run:>11}: no first frame\n{result.stderr}")
+
+def bench_scrub(args):
+    from backends import GPIO, vlc
+
+    writers = {'mkv': write_mkv, 'mp4': write_mp4, 'none': None}
+    for container, write in writers.items():
+        extension = '.mp4' if container == 'mp4' else '.mkv'
+        with player_library(args.files, args.channels, extension) as videoRoot:
+            for directory, subdirectories, files in os.walk(videoRoot):
+                for name in files:
+                    if (write is not None):
+                        write(os.path.join(directory, name), vlc.duration, vlc.keyframeInterval, vlc.frameRate)
+            with console_silenced():
+                player = start_player(args.player, videoRoot)
+                mediaPlayer = media_player(args.player, player)
+                keyframes = default_keyframes_path(videoRoot)
+                deadline = time_.monotonic() + 10
+                while (not (os.path.isdir(keyframes) and os.listdir(keyframes)) and time_.monotonic() < deadline):
+                    time_.sleep(0.05) # Let the playing video's keyframes be indexed
+                mediaPlayer.set_time(vlc.duration * 2 // 3 + 3_700) # Between keyframes
+                time_.sleep(1.5) # Let the seek finish
+                start = mediaPlayer.get_time()
+                del player.Scrub.samples[:]
+                vlc.commands.clear()
+                replay_trace(GPIO, tap_trace(BUTTON_GPIOS['left'], 1, hold=args.hold, start=100))
+                time_.sleep(1.5)
+                end = mediaPlayer.get_time()
+                samples = list(player.Scrub.samples)
+                targets = [argument for at, command, argument in vlc.commands if command == 'set_time']
+                stop_player(args.player, player)
+
+        onKeyframes = sum(1 for target in targets if target % vlc.keyframeInterval == 0)
+        print(f"{args.player}, {container:>4} index: {len(targets)} seeks, {onKeyframes} on keyframes, "
+              f"rewound {(start - end) / 1_000:.0f} s in {args.hold / 1_000:.1f} s")
+        if (samples):
+            print(f"  seek to new position: mean {sum(samples) / len(samples):.1f} ms   "
+                  f"p95 {percentile(samples, 0.95):.1f} ms   max {max(samples):.1f} ms   "
+                  f"(frame interval {1_000 / vlc.frameRate:.1f} ms)")
+
+# A library of (empty) videos, each with a normal Pi friendly copy and a lighter "240p" copy, with
+# their simulated bitrates.  The copies' sizes put them in that order.
+def make_rendition_library(videoRoot, files, channels, bitrate, lightBitrate):
+    from backends import vlc
+
+    make_library(videoRoot, files, channels)
+    for channel in os.listdir(videoRoot):
+        channelPath = os.path.join(videoRoot, channel)
+        os.makedirs(os.path.join(channelPath, '.pi'))
+        for file in os.listdir(channelPath):
+            if (file.endswith('.mkv')):
+                stem = os.path.join(channelPath, '.pi', os.path.splitext(file)[0])
+                for path, kbps in ((stem + '.mp4', bitrate), (stem + '.240p.mp4', lightBitrate)):
+                    with open(path, 'wb') as file:
+                        file.write(b'\0' * kbps)
+                    vlc.bitrates[path] = kbps
+
+def bench_governor(args):
+    from backends import vlc
+
+    # (name, seconds, decode capacity in kbit/s, temperature in C, CPU frequency in MHz)
+    phases = [('cool', args.phase, None, 55, 1_000), ('hot', 2 * args.phase, 800, 82, 600),
+              ('cool again', 3 * args.phase, None, 60, 1_000)]
+    hooks = {'player': ('currentRenditions', 'renditionChanged'), 'player-alt': ('current_renditions', 'switch_rendition')}
+    for governed in (False, True):
+        # The governor's policy sped up to suit the phases, or one that never decides anything
+        def make_policy():
+            return RenditionPolicy(upTime=1.5 * args.phase, reboundTime=3 * args.phase, minFrames=6,
+                                   dropSamples=DROP_SAMPLES if governed else 1_000_000)
+
+        with player_library(0, args.channels) as videoRoot:
+            make_rendition_library(videoRoot, args.files, args.channels, vlc.bitrate, 500)
+            sysfs = os.path.dirname(os.path.normpath(videoRoot))
+            thermalPath = os.path.join(sysfs, 'temp')
+            for name in ('scaling_cur_freq', 'cpuinfo_max_freq'):
+                with open(os.path.join(sysfs, name), 'w') as file:
+                    file.write('1000000\n')
+            with console_silenced():
+                player = start_player(args.player, videoRoot)
+                player.Governor.stop()
+                renditions, onSwitch = (getattr(player, name) for name in hooks[args.player])
+                player.Governor = RenditionGovernor(media_player(args.player, player), renditions, onSwitch,
+                                                    policy=make_policy(),
+                                                    interval=0.5, tracer=player.Trace, thermalPath=thermalPath,
+                                                    cpufreqPath=sysfs)
+                starts = []
+                for name, seconds, capacity, temperature, frequency in phases:
+                    vlc.decodeCapacity = capacity
+                    with open(thermalPath, 'w') as file:
+                        file.write(f"{temperature * 1_000}\n")
+                    with open(os.path.join(sysfs, 'scaling_cur_freq'), 'w') as file:
+                        file.write(f"{frequency * 1_000}\n")
+                    if (not starts):
+                        player.Governor.start()
+                    starts.append(time_.monotonic())
+                    time_.sleep(seconds)
+                player.Governor.stop()
+                decisions = list(player.Governor.decisions)
+                lines = player.Trace.lines()
+                stop_player(args.player, player)
+            vlc.decodeCapacity = None
+
+        samples = read_telemetry(lines)
+        lost = [0] * len(phases)
+        frames = [0] * len(phases)
+        for previous, sample in zip(samples, samples[1:]):
+            phase = sum(1 for start in starts if start <= previous.time) - 1
+            if (sample.media == previous.media and sample.lost >= previous.lost
+                    and phase == sum(1 for start in starts if start <= sample.time) - 1):
+                lost[phase] += sample.lost - previous.lost
+                frames[phase] += sample.lost - previous.lost + sample.displayed - previous.displayed
+        print(f"{args.player}, {'rendition governor' if governed else 'fixed rendition'}:")
+        print("  pictures lost: " + "   ".join(f"{name} {lost[index] / max(1, frames[index]):5.1%}"
+                                              for index, (name, *rest) in enumerate(phases)))
+        for decision in decisions:
+            print(f"  {decision.time - starts[0]:5.1f} s: {decision.direction} to rendition {decision.rendition} "
+                  f"({decision.reason})")
+        replayed = replay(samples, make_policy())
+        same = [(d.direction, d.rendition) for d in replayed] == [(d.direction, d.rendition) for d in decisions]
+        print(f"  replaying the trace's {len(samples)} samples: {len(replayed)} decisions, "
+              f"{'the same' if same else 'DIFFERENT'}")
+
+# Open file descriptors and threads of this process
+# Runs each command straight away on the thread that posts it, the way player-alt.py called VLC
+# from the button callbacks before it had a command queue: for comparison.  Commands posted by a
+# running command (e.g. from VLC events the simulator delivers straight away) run after it.
+class DirectCommands(CommandQueue):
+    def __init__(self, queue):
+        super().__init__()
+        self._handlers = queue._handlers
+        self._local = threading.local()
+
+    def post(self, name, amount=1):
+        self._run_now(name, amount)
+
+    def call(self, callback, *args):
+        self._run_now(None, (callback, args))
+
+    call_next = call
+
+    def _run_now(self, name, amount):
+        self.posted += 1
+        deferred = getattr(self._local, 'deferred', None)
+        if (deferred is not None):
+            deferred.append((name, amount))
+            return
+        self._local.deferred = [(name, amount)]
+        try:
+            while (self._local.deferred):
+                name, amount = self._local.deferred.pop(0)
+                self._execute(name, amount, time_.monotonic())
+        finally:
+            self._local.deferred = None
+
+def bench_burst(args):
+    from backends import GPIO, vlc
+
+    vlc.openTime = args.open_time
+    vlc.stopTime = args.stop_time
+    right, left = BUTTON_GPIOS['right'], BUTTON_GPIOS['left']
+    steps = tap_trace(right, args.presses, interval=args.interval, hold=args.interval // 3, start=100)
+    last = steps[-1][0]
+    steps += tap_trace(left, 2, interval=args.interval, hold=args.interval // 3, start=last + args.interval)
+    for mode in ('direct', 'queued'):
+        with player_library(args.files, args.channels) as videoRoot:
+            with console_silenced():
+                player = start_player('player-alt', videoRoot)
+                player.OSD_SECONDS = 0 # Switch videos straight away, so every press could load one
+                if (mode == 'direct'):
+                    player.Commands.stop()
+                    player.Commands = DirectCommands(player.Commands)
+                frames = []
+                player.VlcMediaListPlayer.get_media_player().event_manager().event_attach(
+                    vlc.EventType.MediaPlayerVout, lambda event: frames.append(time_.monotonic()))
+                deadline = time_.monotonic() + 10
+                while (player.Videos is None or not frames) and time_.monotonic() < deadline:
+                    time_.sleep(0.05) # Let the playlist load and the first video start
+                first = player.get_current_video_index()
+                vlc.commands.clear()
+                start = time_.monotonic()
+                replay_trace(GPIO, steps)
+                time_.sleep((args.open_time + args.stop_time) * 3 / 1_000)
+                player.Commands.wait_idle(10)
+                landed = player.get_current_video_index()
+                commands = list(vlc.commands)
+                queue = player.Commands
+                stop_player('player-alt', player)
+
+        loads = sum(1 for at, command, argument in commands if command == 'play_item_at_index')
+        pauses = sum(1 for at, command, argument in commands if command == 'pause')
+        expected = (first + args.presses) % len(player.Videos)
+        # From when the last right press was released (presses made while the player is busy are
+        # delivered late, like RPi.GPIO's callbacks)
+        lastRelease = start + max(at for at, pin, level in steps if pin == right) / 1_000
+        lastFrame = max((at for at in frames if at > lastRelease), default=None)
+        print(f"{mode:>6}: {args.presses} right presses loaded {loads} videos, 2 left presses paused {pauses} times, "
+              f"landed {'on' if landed == expected else 'off'} the video {args.presses} on "
+              f"({queue.merged} presses merged, {queue.cancelled} cancelled)")
+        if (lastFrame is not None):
+            print(f"        last release to the last video's first frame: {(lastFrame - lastRelease) * 1_000:.0f} ms")
+
+def bench_recovery(args):
+    from backends import vlc
+
+    vlc.duration = args.video_ms
+    vlc.stallAfter = args.video_ms // 3
+    with player_library(args.files, 1) as videoRoot:
+        channelPath = os.path.join(videoRoot, 'Channel 000')
+        episodes = sorted(os.path.join(channelPath, name) for name in os.listdir(channelPath))
+        if (args.all_errors):
+            vlc.faults = {episode: 'error' for episode in episodes}
+        else:
+            vlc.faults = {episodes[1]: 'error', episodes[3]: 'stall', episodes[-2]: 'wedge'}
+        blockedAt = {}
+        with console_silenced():
+            player = start_player(args.player, videoRoot)
+            player.Supervisor.stallTime = args.video_ms / 1_000 * 2 / 3 # Frozen well before it would end
+            failed = player.Blocked.failed
+            def record_blocked(path, reason):
+                blocked = failed(path, reason)
+                if (blocked):
+                    blockedAt.setdefault(path, time_.monotonic())
+                return blocked
+            player.Blocked.failed = record_blocked
+            time_.sleep(args.loops * args.files * (args.video_ms + vlc.openTime) / 1_000 + 2)
+            supervisor, blocklisted = player.Supervisor, len(player.Blocked)
+            stop_player(args.player, player)
+        commands = list(vlc.commands)
+
+    actions = collections.Counter(action for path, reason, action in supervisor.failures)
+    reasons = collections.Counter(reason for path, reason, action in supervisor.failures)
+    latencies = [latency for reason, latency in supervisor.recoveries]
+    replayed = sum(1 for at, command, argument in commands
+                   if command == 'play' and argument in blockedAt and at > blockedAt[argument])
+    faults = ("VLC reports an error for every one" if args.all_errors
+              else "one can't be decoded, one freezes, one stops VLC playing anything")
+    print(f"{args.player}: {args.loops} times round {args.files} videos of {args.video_ms} ms ({faults})")
+    print(f"  {len(supervisor.failures)} failures ({', '.join(f'{count} {reason}' for reason, count in sorted(reasons.items()))}): "
+          f"{actions['skip']} skipped, {actions['restart']} VLC restarts")
+    if (latencies):
+        print(f"  failure to next picture: mean {sum(latencies) / len(latencies):.0f} ms, "
+              f"max {max(latencies):.0f} ms (target 1000 ms) over {len(latencies)} recoveries")
+    print(f"  {blocklisted} videos blocklisted, played {replayed} times after being blocklisted")
+
+def get_handles():
+    return len(os.listdir('/proc/self/fd')), threading.active_count()
+
+def bench_soak(args):
+    from backends import vlc
+
+    seconds = args.hours * 3_600 / args.speed
+    if (args.video_minutes is not None):
+        vlc.duration = int(args.video_minutes * 60_000)
+    samples = []
+    played = []
+    # The simulated VLC's log of commands isn't used here: keep it short so filling it up (it is
+    # bounded) doesn't look like the player's memory growing
+    vlc.commands = collections.deque(maxlen=100)
+    with player_library(args.files, args.channels) as videoRoot:
+        with console_silenced():
+            vlc.clock.set_speed(args.speed)
+            player = start_player(args.player, videoRoot)
+            media_player(args.player, player).event_manager().event_attach(
+                vlc.EventType.MediaPlayerPlaying, lambda event: played.append(1))
+            start = time_.monotonic()
+            while (time_.monotonic() - start < seconds):
+                samples.append((time_.monotonic() - start, get_rss(), vlc.liveMedia, *get_handles()))
+                time_.sleep(min(1, seconds / 40))
+            stop_player(args.player, player)
+
+    print(f"{args.player}: {args.hours} simulated hours in {seconds:.0f} s, {len(played)} videos started, "
+          f"{vlc.createdMedia} Media created")
+    for index in sorted(set((0, len(samples) // 4, len(samples) // 2, len(samples) - 1))):
+        at, rss, liveMedia, files, threads = samples[index]
+        print(f"  {at:6.0f} s: RSS {rss / 1_024:6.1f} MB   live Media {liveMedia:5d}   open files {files:3d}   "
+              f"threads {threads:3d}")
+    print(f"  peak RSS {max(sample[1] for sample in samples) / 1_024:.1f} MB   "
+          f"peak live Media {max(sample[2] for sample in samples)}")
+    if (not args.check):
+        return
+
+    # Flat: after the first quarter (warming up: caches filling, threads starting...) the live
+    # Media, open files and threads never go above what they were by then, and RSS grows by no
+    # more than --max-rss-growth
+    warm = samples[:max(1, len(samples) // 4)]
+    rest = samples[len(warm):] or samples[-1:]
+    failures = []
+    for index, name in ((2, 'live Media'), (3, 'open files'), (4, 'threads')):
+        before, after = max(sample[index] for sample in warm), max(sample[index] for sample in rest)
+        if (after > before):
+            failures.append(f"{name} grew from {before} to {after}")
+    growth = (rest[-1][1] - warm[-1][1]) / 1_024
+    if (growth > args.max_rss_growth):
+        failures.append(f"RSS grew by {growth:.1f} MB")
+    if (len(played) < args.min_transitions):
+        failures.append(f"only {len(played)} videos started")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if (failures):
+        sys.exit(1)
+    print(f"PASS: live Media, open files and threads flat, RSS grew by {growth:.1f} MB")
+
+def add_player_arguments(command, files=60, channels=3):
+    command.add_argument('--player', choices=PLAYERS, default='player')
+    command.add_argument('--files', type=int, default=files, help='videos in the synthetic library')
+    command.add_argument('--channels', type=int, default=channels)
+
+def main():
+    parser = argparse.ArgumentParser(description='Simpsons TV benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('channel-switch', help='channel switching on a synthetic library')
+    command.add_argument('--files', type=int, default=50_000)
+    command.add_argument('--channels', type=int, default=50)
+    command.set_defaults(func=bench_channel_switch)
+
+    command = commands.add_parser('library-load', help='library load time versus library size')
+    command.add_argument('--sizes', default='1000,10000,50000', help='comma separated numbers of videos')
+    command.add_argument('--channels', type=int, default=50)
+    command.set_defaults(func=bench_library_load)
+
+    command = commands.add_parser('catalog', help="memory used by player-alt's playlist")
+    command.add_argument('--files', type=int, default=50_000)
+    command.add_argument('--channels', type=int, default=50)
+    command.set_defaults(func=bench_catalog)
+
+    command = commands.add_parser('watch', help='picking up a bulk copy of new videos')
+    command.add_argument('--files', type=int, default=500)
+    command.add_argument('--settle', type=float, default=3, help='seconds without changes before a rebuild')
+    command.add_argument('--poll-interval', type=float, default=5, help='seconds between checks when polling')
+    command.set_defaults(func=bench_watch)
+
+    command = commands.add_parser('osd', help='time to show a channel and title')
+    command.add_argument('--width', type=int, default=480)
+    command.add_argument('--height', type=int, default=320)
+    command.add_argument('--bits-per-pixel', type=int, default=16, choices=(16, 24, 32))
+    command.set_defaults(func=bench_osd)
+
+    command = commands.add_parser('idle-cpu', help='CPU used while playing with no input')
+    add_player_arguments(command)
+    command.add_argument('--seconds', type=float, default=10)
+    command.set_defaults(func=bench_idle_cpu)
+
+    command = commands.add_parser('latency', help='button release to player action latency')
+    add_player_arguments(command)
+    command.add_argument('--button', choices=sorted(BUTTON_GPIOS), default='left')
+    command.add_argument('--presses', type=int, default=20)
+    command.add_argument('--interval', type=int, default=1_000, help='milliseconds between presses')
+    command.add_argument('--hold', type=int, default=200, help='milliseconds each press is held')
+    command.set_defaults(func=bench_latency)
+
+    command = commands.add_parser('startup', help='time from process start to the first frame')
+    add_player_arguments(command, files=5_000, channels=20)
+    command.set_defaults(func=bench_startup)
+
+    command = commands.add_parser('scrub', help='rewinding with and without a keyframe index')
+    add_player_arguments(command, files=6, channels=2)
+    command.add_argument('--hold', type=int, default=6_000, help='milliseconds the left button is held')
+    command.set_defaults(func=bench_scrub)
+
+    command = commands.add_parser('governor', help='switching renditions while the Pi is throttled')
+    add_player_arguments(command, files=6, channels=2)
+    command.add_argument('--phase', type=float, default=5, help='seconds of the first (cool) phase')
+    command.set_defaults(func=bench_governor)
+
+    command = commands.add_parser('burst', help="rapid presses in player-alt with and without merging")
+    command.add_argument('--files', type=int, default=60, help='videos in the synthetic library')
+    command.add_argument('--channels', type=int, default=3)
+    command.add_argument('--presses', type=int, default=5)
+    command.add_argument('--interval', type=int, default=150, help='milliseconds between presses')
+    command.add_argument('--open-time', type=int, default=600, help='milliseconds for VLC to start a video')
+    command.add_argument('--stop-time', type=int, default=250, help='milliseconds for VLC to close a video')
+    command.set_defaults(func=bench_burst)
+
+    command = commands.add_parser('recovery', help='recovering from videos and a VLC that fail')
+    add_player_arguments(command, files=6, channels=1)
+    command.add_argument('--loops', type=int, default=3, help='times round the channel')
+    command.add_argument('--video-ms', type=int, default=1_500, help='length of every simulated video')
+    command.add_argument('--all-errors', action='store_true', help='VLC reports an error for every video')
+    command.set_defaults(func=bench_recovery)
+
+    command = commands.add_parser('soak', help='memory and VLC Media objects over a long run')
+    add_player_arguments(command)
+    command.add_argument('--hours', type=float, default=4, help='simulated hours to play')
+    command.add_argument('--speed', type=float, default=600, help='simulated clock speed-up')
+    command.add_argument('--video-minutes', type=float, help='length of every simulated video (default 22)')
+    command.add_argument('--check', action='store_true',
+                         help='exit with status 1 unless memory and handle counts stay flat')
+    command.add_argument('--max-rss-growth', type=float, default=2, help='MB of RSS growth allowed with --check')
+    command.add_argument('--min-transitions', type=int, default=0, help='videos that must start with --check')
+    command.set_defaults(func=bench_soak)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+######################################################################################
+# broadcast.py
+# Purpose:   "Live broadcast" channel mode.
+#
+#            Each channel is treated as a continuous stream of its episodes, looping forever and
+#            anchored to the wall clock.  Tuning in to a channel finds the episode (and the offset
+#            into it) that would be airing right now with a bisect over the running total of the
+#            episode durations, just like switching channels on a real TV.
+#
+#            Episode durations are probed once by a small pool of background workers and saved
+#            in ~/simpsonstv/durations.json keyed by path and modification time, so they are
+#            only probed again when a file changes.  Episodes that haven't been probed yet count
+#            as the average duration of the channel until their real duration is known.
+###########################################################################################
+
+import bisect
+import itertools
+import json
+import logging
+import os
+import threading
+import time as time_ # Don't override time
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import vlc
+from library import write_file_atomic
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DURATION = 22 * 60 * 1_000 # milliseconds, used until a channel has any probed episode
+PROBE_TIMEOUT = 10_000 # milliseconds
+PROBE_WORKERS = 2
+
+# Default location of the duration cache: next to the videos root
+def default_cache_path(videoRoot):
+    return os.path.join(os.path.dirname(os.path.normpath(videoRoot)), 'durations.json')
+
+# Duration of a video in milliseconds, as reported by VLC's preparser, or None
+def probe_duration(instance, path):
+    media = instance.media_new_path(path)
+    try:
+        parsed = threading.Event()
+        media.event_manager().event_attach(vlc.EventType.MediaParsedChanged, lambda event: parsed.set())
+        media.parse_with_options(vlc.MediaParseFlag.local, PROBE_TIMEOUT)
+        parsed.wait(PROBE_TIMEOUT / 1_000 + 1)
+        duration = media.get_duration()
+    finally:
+        media.release()
+    return duration if duration > 0 else None
+
+
+class DurationCache:
+    def __init__(self, instance, cachePath, workers=PROBE_WORKERS):
+        self._instance = instance
+        self._cachePath = cachePath
+        self._durations = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='duration-probe')
+        self._dirty = False
+        self.version = 0 # Incremented whenever a new duration becomes known
+
+    def load(self):
+        try:
+            with open(self._cachePath, 'r') as file:
+                self._durations = {path: tuple(entry) for path, entry in json.load(file).items()}
+        except (OSError, ValueError):
+            self._durations = {}
+        return self
+
+    # Probe with a new VLC instance after VLC was restarted
+    def set_instance(self, instance):
+        self._instance = instance
+
+    # Duration of path in milliseconds, or None if it hasn't been probed (or has changed)
+    def get(self, path, mtime):
+        entry = self._durations.get(path)
+        if (entry is not None and entry[0] == mtime):
+            return entry[1]
+        return None
+
+    # Queue background probes for every (path, mtime) entry without a known duration
+    def probe_in_background(self, entries):
+        with self._lock:
+            for path, mtime in entries:
+                if (path in self._pending or self.get(path, mtime) is not None):
+                    continue
+                self._pending.add(path)
+                self._executor.submit(self._probe, path, mtime)
+
+    def _probe(self, path, mtime):
+        try:
+            duration = probe_duration(self._instance, path)
+        except Exception as e:
+            log.warning("Unable to probe the duration of '%s': %s", path, e)
+            duration = None
+        with self._lock:
+            self._pending.discard(path)
+            if (duration is not None):
+                self._durations[path] = (mtime, duration)
+                self.version += 1
+                self._dirty = True
+            save = self._dirty and not self._pending
+        if (save):
+            self.save() # Save once a batch of probes has finished
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self._durations, separators=(',', ':')).encode('utf-8')
+            self._dirty = False
+        try:
+            write_file_atomic(self._cachePath, data)
+        except OSError as e:
+            log.warning("Unable to save the duration cache '%s': %s", self._cachePath, e)
+
+
+class BroadcastSchedule:
+    def __init__(self, durations, epoch=0):
+        self._durations = durations
+        self._epoch = epoch # Wall clock time (seconds) when every channel started its first episode
+        self._timelines = {}
+
+    # Find what is airing on a channel now.  entries is the channel's episodes in order as
+    # (path, mtime) tuples.  Returns (episode index, offset into the episode in milliseconds).
+    def tune(self, channel, entries, now=None):
+        if (len(entries) <= 0):
+            return 0, 0
+        startTimes = self._timeline(channel, entries)
+        if (now is None):
+            now = time_.time()
+        position = int((now - self._epoch) * 1_000) % startTimes[-1]
+        index = bisect.bisect_right(startTimes, position) - 1
+        return index, position - startTimes[index]
+
+    # Start time of every episode in the channel's loop plus the loop's total length.  Cached
+    # until the channel's episodes change or new durations are probed.
+    def _timeline(self, channel, entries):
+        key = (len(entries), entries[0], entries[-1], self._durations.version)
+        cached = self._timelines.get(channel)
+        if (cached is not None and cached[0] == key):
+            return cached[1]
+
+        durations = [self._durations.get(path, mtime) for path, mtime in entries]
+        known = [duration for duration in durations if duration is not None]
+        if (len(known) < len(durations)):
+            self._durations.probe_in_background(entries)
+        estimate = sum(known) // len(known) if known else DEFAULT_DURATION
+        startTimes = [0]
+        startTimes.extend(itertools.accumulate(duration or estimate for duration in durations))
+        self._timelines[channel] = (key, startTimes)
+        return startTimes
@@ -0,0 +1,173 @@
+######################################################################################
+# commands.py
+# Purpose:   Run every player command on one thread, one at a time, and merge bursts of button
+#            presses into one command.
+#
+#            The buttons, timers, the rendition governor and VLC's events post commands to a
+#            CommandQueue instead of calling VLC themselves, so VLC is only ever driven from the
+#            queue's thread.  A command posted while the same command is still waiting at the end
+#            of the queue (behind nothing but LATEST commands, which don't depend on the order of
+#            the presses) is merged with it, depending on how the command was registered:
+#
+#            SUM     the amounts add up: five taps of "next" are one "next 5", and the jumps of a
+#                    rewind that fell behind are one longer jump
+#            TOGGLE  the two cancel out: pausing and resuming again is nothing
+#            LATEST  only the most recent matters (e.g. moving the playlist window)
+#
+#            A command that starts a video calls loading(), and the queue then waits (up to
+#            LOAD_TIMEOUT seconds) for the player to call loaded() when the video is playing
+#            before running the next command.  Presses made in the meantime pile up and merge,
+#            so however fast the buttons are pressed only one more video is loaded.
+###########################################################################################
+
+import collections
+import logging
+import threading
+import time as time_ # Don't override time
+
+log = logging.getLogger(__name__)
+
+LOAD_TIMEOUT = 3.0 # seconds to wait for a video to start playing before carrying on anyway
+
+SUM = 'sum'
+TOGGLE = 'toggle'
+LATEST = 'latest'
+
+
+class CommandQueue:
+    def __init__(self, tracer=None, loadTimeout=LOAD_TIMEOUT):
+        self._tracer = tracer
+        self._loadTimeout = loadTimeout
+        self._handlers = {} # name -> (handler, merge)
+        self._pending = collections.deque() # [name, amount, time.monotonic() when posted]
+        self._condition = threading.Condition()
+        self._loaded = threading.Event()
+        self._loaded.set()
+        self._loading = False
+        self._busy = False
+        self._stopped = False
+        self._thread = None
+        self.posted = 0
+        self.merged = 0 # Commands merged into one already waiting
+        self.cancelled = 0 # Toggles that cancelled out (two for each pair)
+        self.executed = 0
+
+    # handler(amount) runs the command called name.  merge is SUM, TOGGLE, LATEST or None (never
+    # merged).
+    def register(self, name, handler, merge=None):
+        self._handlers[name] = (handler, merge)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='player-commands', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._pending.clear()
+            self._condition.notify_all()
+        self._loaded.set()
+        if (self._thread is not None and self._thread is not threading.current_thread()):
+            self._thread.join()
+
+    # Queue the command called name.  Safe to call from any thread.
+    def post(self, name, amount=1):
+        merge = self._handlers[name][1]
+        with self._condition:
+            if (self._stopped):
+                return
+            self.posted += 1
+            index = self._waiting(name) if merge is not None else None
+            if (index is not None):
+                if (merge == SUM):
+                    self._pending[index][1] += amount
+                    self.merged += 1
+                elif (merge == LATEST):
+                    self._pending[index][1] = amount
+                    self.merged += 1
+                else:
+                    del self._pending[index]
+                    self.cancelled += 2
+                return
+            self._pending.append([name, amount, time_.monotonic()])
+            self._condition.notify_all()
+
+    # Queue callback(*args), never merged with anything.  Safe to call from any thread.
+    def call(self, callback, *args):
+        with self._condition:
+            if (self._stopped):
+                return
+            self.posted += 1
+            self._pending.append([None, (callback, args), time_.monotonic()])
+            self._condition.notify_all()
+
+    # Run callback(*args) before anything already waiting, e.g. to finish starting a video before
+    # the commands that waited for it.  Safe to call from any thread.
+    def call_next(self, callback, *args):
+        with self._condition:
+            if (self._stopped):
+                return
+            self.posted += 1
+            self._pending.appendleft([None, (callback, args), time_.monotonic()])
+            self._condition.notify_all()
+
+    # Called by a command as it starts a video: the next command waits until loaded()
+    def loading(self):
+        if (threading.current_thread() is self._thread):
+            self._loaded.clear()
+            self._loading = True
+
+    # The player started playing a video.  Safe to call from any thread (e.g. VLC's events).
+    def loaded(self):
+        self._loaded.set()
+
+    # Wait until every command posted so far has run.  Returns False on timeout.
+    def wait_idle(self, timeout=None):
+        with self._condition:
+            return self._condition.wait_for(lambda: self._stopped or not (self._pending or self._busy), timeout)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._pending)
+
+    # Index in the queue of the command called name if it is waiting at the end, behind nothing
+    # but LATEST commands, otherwise None.  Call with the condition held.
+    def _waiting(self, name):
+        for index in range(len(self._pending) - 1, -1, -1):
+            waiting = self._pending[index][0]
+            if (waiting == name):
+                return index
+            if (waiting is None or self._handlers[waiting][1] != LATEST):
+                return None
+        return None
+
+    def _run(self):
+        while (True):
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+                self._condition.wait_for(lambda: self._stopped or self._pending)
+                if (self._stopped):
+                    return
+                name, amount, posted = self._pending.popleft()
+                self._busy = True
+            self._execute(name, amount, posted)
+            if (self._loading):
+                self._loading = False
+                if (not self._loaded.wait(self._loadTimeout)):
+                    log.warning("No video playing %.1f seconds after '%s': carrying on", self._loadTimeout, name)
+
+    def _execute(self, name, amount, posted):
+        self.executed += 1
+        if (name is None):
+            callback, args = amount
+            name, amount = callback.__name__, None
+        else:
+            callback, args = self._handlers[name][0], (amount,)
+        if (self._tracer is not None):
+            self._tracer.trace('command', name=name, amount=amount, queued=round((time_.monotonic() - posted) * 1_000, 1))
+        try:
+            callback(*args)
+        except Exception:
+            log.exception("Player command '%s' failed", name)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+######################################################################################
+# governor.py
+# Purpose:   Switch to a lighter copy of the playing video when the Pi can't keep up (e.g. when
+#            the Zero 2 W throttles as it heats up) and back again once it can.
+#
+#            RenditionGovernor samples, every SAMPLE_INTERVAL seconds, VLC's count of displayed
+#            and lost pictures for the playing video, the CPU frequency and the SoC temperature
+#            (from sysfs).  Each sample goes to RenditionPolicy, which decides on the rendition:
+#            0 is the file normally played, 1 the next lighter copy and so on (see
+#            LibraryIndex.get_renditions()).
+#
+#            - Down a rendition once more than DROP_THRESHOLD of the pictures were lost in
+#              DROP_SAMPLES samples in a row.
+#            - Back up a rendition once there has been headroom (next to no pictures lost and the
+#              SoC below HEADROOM_TEMPERATURE) for UP_TIME seconds.  Having to go down again soon
+#              after going up doubles that time (up to MAX_UP_TIME), so a Pi that is only just
+#              keeping up doesn't flip between renditions.
+#
+#            The player is told of each decision and switches to the new rendition at the current
+#            position.  Decisions are logged, and every sample and decision is recorded in the
+#            trace (metrics.py), so a trace can be replayed through the policy to try other
+#            settings without the Pi:
+#                python3 governor.py ~/simpsonstv/trace.jsonl [--drop-threshold 0.05] ...
+###########################################################################################
+
+import argparse
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time as time_ # Don't override time
+
+from metrics import media_stats
+
+log = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 5.0 # seconds between samples
+DROP_THRESHOLD = 0.05 # fraction of pictures lost in a sample that counts as stuttering
+DROP_SAMPLES = 2 # stuttering samples in a row before going down a rendition
+HEADROOM_DROPS = 0.01 # fraction of pictures lost in a sample that still counts as headroom
+HEADROOM_TEMPERATURE = 70.0 # degrees C: hotter than this is no headroom (the Pi throttles at 80)
+UP_TIME = 60.0 # seconds of headroom before going back up a rendition
+MAX_UP_TIME = 960.0
+REBOUND_TIME = 120.0 # going down within this many seconds of going up doubles UP_TIME
+MIN_FRAMES = 24 # pictures a sample needs to be judged (fewer while paused or starting)
+
+THERMAL_PATH = '/sys/class/thermal/thermal_zone0/temp' # millidegrees C
+CPUFREQ_PATH = '/sys/devices/system/cpu/cpu0/cpufreq' # scaling_cur_freq and cpuinfo_max_freq, kHz
+
+# One sample: time (time.monotonic() seconds), the playing media's MRL, VLC's running counts of
+# displayed and lost pictures for it, the CPU frequency and maximum frequency (kHz) and SoC
+# temperature (degrees C), each None if unknown, and the number of renditions of the video
+Telemetry = collections.namedtuple('Telemetry', 'time media displayed lost frequency maxFrequency temperature renditions')
+
+# A change of rendition: time, the new rendition, 'down' or 'up' and why
+Decision = collections.namedtuple('Decision', 'time rendition direction reason')
+
+def read_sysfs_int(path):
+    try:
+        with open(path, 'r') as file:
+            return int(file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+class RenditionPolicy:
+    def __init__(self, dropThreshold=DROP_THRESHOLD, dropSamples=DROP_SAMPLES, headroomDrops=HEADROOM_DROPS,
+                 headroomTemperature=HEADROOM_TEMPERATURE, upTime=UP_TIME, maxUpTime=MAX_UP_TIME,
+                 reboundTime=REBOUND_TIME, minFrames=MIN_FRAMES):
+        self._dropThreshold = dropThreshold
+        self._dropSamples = dropSamples
+        self._headroomDrops = headroomDrops
+        self._headroomTemperature = headroomTemperature
+        self._maxUpTime = maxUpTime
+        self._reboundTime = reboundTime
+        self._minFrames = minFrames
+        self._previous = None
+        self._stutters = 0
+        self._headroomSince = None
+        self._lastUp = None
+        self.upTime = upTime # Current headroom needed before going up, in seconds
+        self.rendition = 0
+
+    # Judge a Telemetry sample against the previous one.  Returns a Decision if the rendition
+    # should change, otherwise None.
+    def update(self, sample):
+        previous = self._previous
+        self._previous = sample
+        if (previous is None or sample.media != previous.media or sample.displayed < previous.displayed
+                or sample.lost < previous.lost):
+            return None # A new video (or the first sample): its counts start again
+        lost = sample.lost - previous.lost
+        frames = sample.displayed - previous.displayed + lost
+        if (frames < self._minFrames):
+            self._headroomSince = None
+            return None # Paused or barely playing: nothing to judge
+        dropRate = lost / frames
+        reason = self._describe(sample, dropRate)
+
+        if (dropRate > self._dropThreshold):
+            self._stutters += 1
+        else:
+            self._stutters = 0
+        if (self._stutters >= self._dropSamples and self.rendition < sample.renditions - 1):
+            if (self._lastUp is not None and sample.time - self._lastUp < self._reboundTime):
+                self.upTime = min(self.upTime * 2, self._maxUpTime) # Went up too soon
+            self.rendition += 1
+            self._stutters = 0
+            self._headroomSince = None
+            return Decision(sample.time, self.rendition, 'down', reason)
+
+        hot = sample.temperature is not None and sample.temperature >= self._headroomTemperature
+        if (dropRate > self._headroomDrops or hot):
+            self._headroomSince = None
+        elif (self._headroomSince is None):
+            self._headroomSince = previous.time
+        elif (self.rendition > 0 and sample.time - self._headroomSince >= self.upTime):
+            self.rendition -= 1
+            self._lastUp = sample.time
+            self._headroomSince = None
+            return Decision(sample.time, self.rendition, 'up', reason)
+        return None
+
+    @staticmethod
+    def _describe(sample, dropRate):
+        reason = f"{dropRate:.1%} of pictures lost"
+        if (sample.temperature is not None):
+            reason += f", {sample.temperature:.1f} C"
+        if (sample.frequency is not None):
+            reason += f", {sample.frequency // 1_000} MHz"
+            if (sample.maxFrequency is not None):
+                reason += f" of {sample.maxFrequency // 1_000}"
+        return reason
+
+
+class RenditionGovernor:
+    # player is the VLC media player to sample.  renditions() returns the paths of the
+    # renditions of the playing video (see LibraryIndex.get_renditions()) and onSwitch() is called
+    # with the new rendition after each decision, on the governor's thread.
+    def __init__(self, player, renditions, onSwitch=None, policy=None, interval=SAMPLE_INTERVAL, tracer=None,
+                 thermalPath=THERMAL_PATH, cpufreqPath=CPUFREQ_PATH):
+        self._player = player
+        self._thermalPath = thermalPath
+        self._cpufreqPath = cpufreqPath
+        self._renditions = renditions
+        self._onSwitch = onSwitch
+        self._policy = policy or RenditionPolicy()
+        self._interval = interval
+        self._tracer = tracer
+        self._stopped = threading.Event()
+        self._thread = None
+        self.decisions = []
+
+    # Sample a new VLC media player after VLC was restarted
+    def attach(self, player):
+        self._player = player
+
+    # The rendition currently chosen (0 is the file normally played)
+    def get_rendition(self):
+        return self._policy.rendition
+
+    # The path to play from a video's renditions (heaviest first) at the current rendition
+    def choose(self, renditions):
+        return renditions[min(self._policy.rendition, len(renditions) - 1)]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='rendition-governor', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if (self._thread is not None):
+            self._thread.join()
+
+    def _run(self):
+        while (not self._stopped.wait(self._interval)):
+            try:
+                sample = self.sample()
+                if (sample is not None):
+                    self.update(sample)
+            except Exception:
+                log.exception("Unable to sample the playback telemetry")
+
+    # Telemetry of the playing video now, or None if nothing is playing
+    def sample(self):
+        media = self._player.get_media()
+        if (media is None):
+            return None
+        try:
+            stats = media_stats(media)
+            mrl = media.get_mrl()
+        finally:
+            media.release() # get_media() returns a new reference
+        if (stats is None):
+            return None
+        temperature = read_sysfs_int(self._thermalPath)
+        return Telemetry(time_.monotonic(), mrl, stats['displayed'], stats['lost'],
+                         read_sysfs_int(os.path.join(self._cpufreqPath, 'scaling_cur_freq')),
+                         read_sysfs_int(os.path.join(self._cpufreqPath, 'cpuinfo_max_freq')),
+                         temperature / 1_000 if temperature is not None else None,
+                         len(self._renditions() or [None]))
+
+    # Record a sample, act on the policy's decision and return it
+    def update(self, sample):
+        if (self._tracer is not None):
+            fields = sample._asdict()
+            del fields['time'] # The trace has its own timestamps
+            self._tracer.trace('telemetry', **fields)
+        decision = self._policy.update(sample)
+        if (decision is None):
+            return None
+        self.decisions.append(decision)
+        log.info("Rendition %s to %d: %s", decision.direction, decision.rendition, decision.reason)
+        if (self._tracer is not None):
+            self._tracer.trace('rendition', rendition=decision.rendition, direction=decision.direction,
+                               reason=decision.reason)
+        if (self._onSwitch is not None):
+            self._onSwitch(decision.rendition)
+        return decision
+
+
+# The Telemetry samples in a trace (JSON lines from metrics.py), in order
+def read_telemetry(lines):
+    samples = []
+    for line in lines:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if (event.get('event') == 'telemetry'):
+            samples.append(Telemetry(event['t'] / 1_000, *(event.get(field) for field in Telemetry._fields[1:])))
+    return samples
+
+# Decisions a policy makes on a recorded series of samples
+def replay(samples, policy=None):
+    policy = policy or RenditionPolicy()
+    return [decision for decision in map(policy.update, samples) if decision is not None]
+
+
+# Replay the telemetry in a trace dump through the policy, optionally with other settings
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded telemetry through the rendition policy')
+    parser.add_argument('trace', nargs='?', default=os.path.expanduser('~/simpsonstv/trace.jsonl'))
+    parser.add_argument('--drop-threshold', type=float, default=DROP_THRESHOLD)
+    parser.add_argument('--drop-samples', type=int, default=DROP_SAMPLES)
+    parser.add_argument('--headroom-temperature', type=float, default=HEADROOM_TEMPERATURE)
+    parser.add_argument('--up-time', type=float, default=UP_TIME)
+    args = parser.parse_args()
+
+    with open(args.trace, 'r') as file:
+        samples = read_telemetry(file)
+    policy = RenditionPolicy(dropThreshold=args.drop_threshold, dropSamples=args.drop_samples,
+                             headroomTemperature=args.headroom_temperature, upTime=args.up_time)
+    decisions = replay(samples, policy)
+    start = samples[0].time if samples else 0
+    for decision in decisions:
+        print(f"{decision.time - start:8.1f} s  {decision.direction:>4} to rendition {decision.rendition}: {decision.reason}")
+    print(f"{len(samples)} samples, {len(decisions)} decisions", file=sys.stderr)
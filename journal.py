@@ -0,0 +1,214 @@
+######################################################################################
+# journal.py
+# Purpose:   Remember what was playing across a shutdown or a pulled plug, without wearing out
+#            the SD card.
+#
+#            The resume state (current channel, episode and position plus the last position of
+#            every part-watched episode) is kept in memory.  A background thread samples the
+#            player every FLUSH_INTERVAL seconds and, only if something changed, appends one
+#            short JSON line to ~/simpsonstv/resume.journal.  That is a few KB per hour instead
+#            of rewriting a file every second.  Once the journal grows past COMPACT_LINES lines
+#            the whole state is written to ~/simpsonstv/resume.json (fsync + atomic rename) and
+#            the journal is started again.  The state is also flushed and compacted on shutdown.
+#
+#            At startup the snapshot is loaded and the journal replayed on top of it; a line
+#            torn by a power cut is simply ignored.  "python3 journal.py" checks that a flushed
+#            journal reloads to the same state.
+###########################################################################################
+
+import json
+import logging
+import os
+import threading
+
+from library import write_file_atomic
+
+log = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 120 # seconds
+COMPACT_LINES = 500
+MIN_POSITION = 10_000 # milliseconds; episodes watched for less than this start from the beginning
+
+# Default location of the resume files: next to the videos root
+def default_journal_path(videoRoot):
+    return os.path.join(os.path.dirname(os.path.normpath(videoRoot)), 'resume')
+
+
+class ResumeJournal:
+    def __init__(self, path, flushInterval=FLUSH_INTERVAL, compactLines=COMPACT_LINES):
+        self._snapshotPath = path + '.json'
+        self._journalPath = path + '.journal'
+        self._flushInterval = flushInterval
+        self._compactLines = compactLines
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._sampler = None
+        self._journalLines = 0
+        self._records = []
+        self._dirty = False
+        self.channel = None
+        self.episode = None
+        self.position = 0
+        self.positions = {}
+
+    # Load the snapshot and replay the journal on top of it
+    def load(self):
+        try:
+            with open(self._snapshotPath, 'r') as file:
+                snapshot = json.load(file)
+            self.channel = snapshot.get('channel')
+            self.episode = snapshot.get('episode')
+            self.position = snapshot.get('position', 0)
+            self.positions = snapshot.get('positions', {})
+        except (OSError, ValueError):
+            pass
+        try:
+            with open(self._journalPath, 'r') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break # Torn write from a power cut - nothing valid can follow it
+                    self._apply(record)
+                    self._journalLines += 1
+        except OSError:
+            pass
+        return self
+
+    def _apply(self, record):
+        if ('finished' in record):
+            self.positions.pop(record['finished'], None)
+            if (record['finished'] == self.episode):
+                self.position = 0 # Start it from the beginning if nothing else plays before a power cut
+            return
+        self.channel = record['c']
+        self.episode = record['e']
+        self.position = record['p']
+        if (self.position >= MIN_POSITION):
+            self.positions[self.episode] = self.position
+        else:
+            self.positions.pop(self.episode, None)
+
+    # Last position (milliseconds) of a part-watched episode, or 0
+    def get_position(self, episode):
+        with self._lock:
+            return self.positions.get(episode, 0)
+
+    # Record what is playing now.  Only kept in memory until the next flush.
+    def update(self, channel, episode, position):
+        with self._lock:
+            if ((channel, episode, position) == (self.channel, self.episode, self.position)):
+                return
+            self._pending(dict(c=channel, e=episode, p=position))
+
+    # An episode played to the end: forget its position
+    def finished(self, episode):
+        with self._lock:
+            if (episode in self.positions or (episode == self.episode and self.position > 0)):
+                self._pending(dict(finished=episode))
+
+    def _pending(self, record):
+        self._apply(record)
+        if (not self._dirty):
+            self._records = []
+        self._records.append(record)
+        self._dirty = True
+
+    # Append the changes since the last flush to the journal (compacting it if it's too long)
+    def flush(self):
+        with self._lock:
+            if (not self._dirty):
+                return
+            # Only the latest position and the latest "finished" of each episode matter, kept in
+            # order so the last position record (the current episode) is still written last
+            latest = {}
+            for record in self._records:
+                key = ('finished', record['finished']) if 'finished' in record else ('e', record['e'])
+                latest.pop(key, None)
+                latest[key] = record
+            records = list(latest.values())
+            self._dirty = False
+            self._records = []
+            if (self._journalLines + len(records) > self._compactLines):
+                self._compact()
+                return
+            data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+            try:
+                with open(self._journalPath, 'a') as file:
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+                self._journalLines += len(records)
+            except OSError as e:
+                log.warning("Unable to write the resume journal '%s': %s", self._journalPath, e)
+
+    # Write the whole state to the snapshot and start a new, empty journal
+    def compact(self):
+        with self._lock:
+            self._dirty = False
+            self._records = []
+            self._compact()
+
+    def _compact(self):
+        snapshot = dict(channel=self.channel, episode=self.episode, position=self.position, positions=self.positions)
+        try:
+            write_file_atomic(self._snapshotPath, json.dumps(snapshot, separators=(',', ':')).encode('utf-8'))
+            write_file_atomic(self._journalPath, b'')
+            self._journalLines = 0
+        except OSError as e:
+            log.warning("Unable to compact the resume journal '%s': %s", self._journalPath, e)
+
+    # Sample the player every flushInterval seconds on a background thread.  sampler() returns
+    # (channel, episode, position) or None when nothing is playing.
+    def start(self, sampler):
+        self._sampler = sampler
+        self._thread = threading.Thread(target=self._run, name='resume-journal', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while (not self._stop.wait(self._flushInterval)):
+            self._sample()
+            self.flush()
+
+    def _sample(self):
+        try:
+            state = self._sampler() if self._sampler else None
+        except Exception as e:
+            log.warning("Unable to sample the player for the resume journal: %s", e)
+            state = None
+        if (state is not None):
+            self.update(*state)
+
+    # Take a last sample and save everything (shutdown)
+    def close(self):
+        self._stop.set()
+        if (self._thread is not None and self._thread is not threading.current_thread()):
+            self._thread.join()
+        self._sample()
+        self.compact()
+
+
+# Check that a flushed journal reloads to the same state
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'resume')
+        journal = ResumeJournal(path)
+        journal.update('Channel', 'b', 60_000)
+        journal.update('Channel', 'a', 30_000)
+        journal.finished('a') # Played to the end: a is still the current episode, from the beginning
+        journal.flush()
+        reloaded = ResumeJournal(path).load()
+        assert (reloaded.episode, reloaded.position) == ('a', 0), (reloaded.episode, reloaded.position)
+        assert reloaded.positions == {'b': 60_000}, reloaded.positions
+
+        journal.update('Channel', 'c', 20_000)
+        journal.update('Channel', 'b', 90_000)
+        journal.update('Channel', 'c', 25_000)
+        journal.flush()
+        reloaded = ResumeJournal(path).load()
+        assert (reloaded.episode, reloaded.position) == ('c', 25_000), reloaded.episode
+        assert reloaded.positions == {'b': 90_000, 'c': 25_000}, reloaded.positions
+        print("Resume journal reloads correctly")
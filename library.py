@@ -0,0 +1,424 @@
+######################################################################################
+# library.py
+# Purpose:   Persistent index of the video library so startup doesn't rescan the video tree.
+#
+#            The index records every channel (sub-directory of the videos root) and the video
+#            files in it with their size and modification time.  It is saved as JSON next to
+#            the videos root (~/simpsonstv/library.json) and loaded at startup, so playback can
+#            start straight from the cached index.  reconcile() brings the index up to date by
+#            comparing directory modification times and only rescanning the directories that
+#            changed; it is normally run by watcher.py after playback has started and again
+#            whenever videos are added or removed.
+#            When there is no index yet, load(scan=False) leaves the scan to that background
+#            reconcile and find_first_video() finds something to play by scanning only as many
+#            channels as it takes to find a video.
+#
+#            If transcode.py has made a Pi friendly copy of a video (in the channel's ".pi"
+#            sub-directory) the index records it and get_playable_path() returns the copy.
+#            Lighter copies for when the Pi can't keep up can sit next to it with a label
+#            between the name and the extension (".pi/S01E01.240p.mp4"); get_renditions()
+#            lists them, smallest file last, for governor.py.
+#
+#            VideoSelector (used by player-alt.py) flattens the index into one playlist ordered
+#            by channel and keeps a channel -> (start, end) table into it, so channel switching
+#            and "which channel is this video in" don't have to scan the playlist.  It is a
+#            compact catalog: only the file names are stored, back to back in one NameTable
+#            (with tens of thousands of videos a list of full path strings repeats the root and
+#            channel for every file), and paths are built when asked for.
+###########################################################################################
+
+import array
+import bisect
+import json
+import logging
+import os
+import threading
+from collections.abc import Sequence
+
+log = logging.getLogger(__name__)
+
+INDEX_VERSION = 3
+RENDITIONS_DIRECTORY = '.pi' # Sub-directory of a channel holding the transcoded copies of its videos
+
+# Normalise a video file extension, or a tuple of them, to a tuple of lower case extensions
+def normalise_extensions(videoFileExtension):
+    if (isinstance(videoFileExtension, str)):
+        videoFileExtension = (videoFileExtension,)
+    return tuple(extension.lower() for extension in videoFileExtension)
+
+# Modification time of a path in nanoseconds, or None if it doesn't exist
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+# Default location of the index file: next to the videos root
+def default_index_path(videoRoot):
+    return os.path.join(os.path.dirname(os.path.normpath(videoRoot)), 'library.json')
+
+# Writes a file atomically: a crash or power cut leaves either the old or the new file
+def write_file_atomic(path, data):
+    tempPath = path + '.tmp'
+    with open(tempPath, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tempPath, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class LibraryIndex:
+    def __init__(self, videoRoot, videoFileExtension, indexPath=None):
+        self._videoRoot = videoRoot
+        self._videoFileExtensions = normalise_extensions(videoFileExtension)
+        self._indexPath = indexPath or default_index_path(videoRoot)
+        self._rootMtime = None
+        self._channels = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    # Load the cached index.  If there is no usable index yet, scan the video tree now, or with
+    # scan=False leave it to reconcile() (see is_loaded()).
+    def load(self, scan=True):
+        try:
+            with open(self._indexPath, 'r') as file:
+                index = json.load(file)
+            if (index.get('version') != INDEX_VERSION or index.get('root') != self._videoRoot
+                    or index.get('extensions') != list(self._videoFileExtensions)):
+                raise ValueError('Library index does not match the video root')
+            self._rootMtime = index['rootMtime']
+            self._channels = index['channels']
+            self._loaded = True
+        except (OSError, ValueError, KeyError):
+            if (scan):
+                self.reconcile()
+        return self
+
+    def get_video_root(self):
+        return self._videoRoot
+
+    # True once the index covers the whole video tree (loaded from the file or reconciled)
+    def is_loaded(self):
+        return self._loaded
+
+    # (channel, video) of the first video in channel order, or None if there are no videos.
+    # Before the index is loaded only the channels up to the first one with a video are scanned.
+    def find_first_video(self):
+        channels = self.get_channels() if self._loaded else sorted(self._list_channels())
+        for channel in channels:
+            videos = self.get_videos(channel)
+            if (len(videos) > 0):
+                return channel, videos[0]
+        return None
+
+    def get_channels(self):
+        return sorted(self._channels)
+
+    # Sorted file names of the videos in a channel.  Channels missing from the index (e.g. a
+    # "Directories" entry created since the last reconcile) are scanned on demand.
+    def get_videos(self, channel):
+        entry = self._channels.get(channel)
+        if (entry is None):
+            entry = self._scan_channel(channel)
+            if (entry is None):
+                return []
+            with self._lock:
+                channels = dict(self._channels)
+                channels[channel] = entry
+                self._channels = channels
+        return sorted(entry['files'])
+
+    # Path of the file to play for a video: the Pi friendly copy made by transcode.py if there
+    # is one, otherwise the video itself
+    def get_playable_path(self, channel, video):
+        return self.get_renditions(channel, video)[0]
+
+    # Paths of the files a video can be played from, heaviest first: the one get_playable_path()
+    # returns, then any smaller copies in the ".pi" sub-directory
+    def get_renditions(self, channel, video):
+        channelPath = os.path.join(self._videoRoot, channel)
+        renditions = self._channels.get(channel, {}).get('renditions', {}).get(video)
+        if (not renditions):
+            return [os.path.join(channelPath, video)]
+        return [os.path.join(channelPath, RENDITIONS_DIRECTORY, name) for name, size in renditions]
+
+    # Size and modification time of a video, as recorded in the index
+    def get_video_info(self, channel, video):
+        size, mtime = self._channels[channel]['files'][video]
+        return size, mtime
+
+    # Bring the index up to date with the video tree.  Only channels whose directory
+    # modification time changed are rescanned.  Returns True if anything changed.
+    def reconcile(self):
+        with self._lock:
+            try:
+                rootMtime = os.stat(self._videoRoot).st_mtime_ns
+            except OSError:
+                rootMtime = None
+            changed = (rootMtime != self._rootMtime)
+            if (changed):
+                names = self._list_channels()
+            else:
+                names = list(self._channels)
+
+            channels = {}
+            for channel in names:
+                entry = self._channels.get(channel)
+                channelPath = os.path.join(self._videoRoot, channel)
+                mtime = get_mtime(channelPath)
+                if (mtime is None):
+                    changed = True # Channel was removed
+                    continue
+                if (entry is None or entry['mtime'] != mtime
+                        or entry['renditionsMtime'] != get_mtime(os.path.join(channelPath, RENDITIONS_DIRECTORY))):
+                    entry = self._scan_channel(channel)
+                    if (entry is None):
+                        changed = True
+                        continue
+                    changed = True
+                channels[channel] = entry
+
+            if (changed):
+                self._rootMtime = rootMtime
+                self._channels = channels
+                self._save()
+            self._loaded = True
+            return changed
+
+    def _list_channels(self):
+        try:
+            with os.scandir(self._videoRoot) as entries:
+                return [entry.name for entry in entries if entry.is_dir() and not entry.name.startswith('.')]
+        except OSError:
+            return []
+
+    def _scan_channel(self, channel):
+        channelPath = os.path.join(self._videoRoot, channel)
+        try:
+            mtime = os.stat(channelPath).st_mtime_ns
+            files = {}
+            with os.scandir(channelPath) as entries:
+                for entry in entries:
+                    if (entry.name.lower().endswith(self._videoFileExtensions) and entry.is_file()):
+                        stat = entry.stat()
+                        files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            return None
+
+        # Pi friendly copies are matched to their video by file name without the extension, or
+        # without the extension and a label ("S01E01.240p.mp4")
+        renditionsPath = os.path.join(channelPath, RENDITIONS_DIRECTORY)
+        renditionsMtime = get_mtime(renditionsPath)
+        renditions = {}
+        if (renditionsMtime is not None):
+            stems = {os.path.splitext(file)[0]: file for file in files}
+            copies = {} # video -> [(labelled, size, copy name)]
+            try:
+                with os.scandir(renditionsPath) as entries:
+                    for entry in entries:
+                        if (entry.name.lower().endswith(self._videoFileExtensions) and entry.is_file()):
+                            stem = os.path.splitext(entry.name)[0]
+                            labelled = stem not in stems
+                            video = stems.get(os.path.splitext(stem)[0] if labelled else stem)
+                            if (video is not None):
+                                copies.setdefault(video, []).append((labelled, entry.stat().st_size, entry.name))
+            except OSError:
+                pass
+            # The unlabelled copy (or else the largest) is played normally; only smaller copies
+            # are kept after it, largest first
+            for video, found in copies.items():
+                found.sort(key=lambda copy: (copy[0], -copy[1]))
+                default = found[0]
+                lighter = sorted((copy for copy in found[1:] if copy[1] < default[1]), key=lambda copy: -copy[1])
+                renditions[video] = [[name, size] for labelled, size, name in [default] + lighter]
+        return {'mtime': mtime, 'files': files, 'renditionsMtime': renditionsMtime, 'renditions': renditions}
+
+    def _save(self):
+        index = {
+            'version': INDEX_VERSION,
+            'root': self._videoRoot,
+            'extensions': list(self._videoFileExtensions),
+            'rootMtime': self._rootMtime,
+            'channels': self._channels,
+        }
+        try:
+            write_file_atomic(self._indexPath, json.dumps(index, separators=(',', ':')).encode('utf-8'))
+        except OSError as e:
+            log.warning("Unable to save the library index '%s': %s", self._indexPath, e)
+
+
+# A list of strings stored back to back as UTF-8 in one buffer with an array of their end
+# offsets: about the length of the string per entry instead of the 50+ bytes of overhead of
+# every str object.  Strings are decoded again when they are read.
+class NameTable(Sequence):
+    def __init__(self, names=()):
+        self._data = bytearray()
+        self._ends = array.array('I')
+        for name in names:
+            self.append(name)
+
+    def append(self, name):
+        self._data += name.encode('utf-8', 'surrogateescape') # File names needn't be valid UTF-8
+        self._ends.append(len(self._data))
+
+    def __len__(self):
+        return len(self._ends)
+
+    def __getitem__(self, index):
+        if (isinstance(index, slice)):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if (index < 0):
+            index += len(self._ends)
+        start = self._ends[index - 1] if index > 0 else 0 # Raises IndexError when out of range
+        return self._data[start:self._ends[index]].decode('utf-8', 'surrogateescape')
+
+    # Bytes used by the table, for comparison with a list of str
+    def size(self):
+        return len(self._data) + self._ends.itemsize * len(self._ends)
+
+
+# Read only list of a VideoSelector's video paths (or the paths of the files to play), built
+# when they are read.  Looking up the index of a path is a bisect, not a scan.
+class _VideoPaths(Sequence):
+    def __init__(self, selector, playable):
+        self._selector = selector
+        self._playable = playable
+
+    def __len__(self):
+        return len(self._selector)
+
+    def __getitem__(self, index):
+        if (isinstance(index, slice)):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if (index < 0):
+            index += len(self)
+        if (self._playable):
+            return self._selector.get_playable_video(index)
+        return self._selector.get_video(index)
+
+    def __contains__(self, path):
+        return self._selector.find(path) >= 0
+
+    def index(self, path, *args):
+        index = self._selector.find(path) if not self._playable else -1
+        if (index < 0):
+            return super().index(path, *args)
+        return index
+
+
+class VideoSelector:
+    def __init__(self, videoRoot, videoFileExtension, library=None):
+        self._videoRoot = videoRoot
+        self._videoFileExtensions = normalise_extensions(videoFileExtension)
+        self._currentChannelIndex = 0
+        self._currentVideoIndex = 0
+
+        # Start from the cached library index; it is reconciled with the video tree in the background
+        self._library = library or LibraryIndex(self._videoRoot, self._videoFileExtensions).load()
+        self._channels = self._library.get_channels()
+        if (len(self._channels) <= 0):
+            print(f"Directory '{videoRoot}' does not contain any sub-directories to be used as a 'channel'.")
+            quit()
+
+        # Videos are grouped by channel, so each channel is one contiguous (start, end) range of
+        # file names, sorted within the channel
+        self._names = NameTable()
+        self._channelRanges = []
+        for channel in self._channels:
+            start = len(self._names)
+            for file in self._library.get_videos(channel):
+                self._names.append(file)
+            self._channelRanges.append((start, len(self._names)))
+        self._channelStarts = [start for start, end in self._channelRanges]
+        if (len(self._names) <= 0):
+            print(f"The directories within '{videoRoot}' do not contain any files with extension {'/'.join(self._videoFileExtensions)} to play.")
+            quit()
+
+    def get_current_channel(self):
+        return self._channels[self._currentChannelIndex]
+
+    def get_channels(self):
+        return self._channels
+
+    # (start, end) indices of a channel's videos in get_videos()
+    def get_channel_range(self, channelIndex):
+        return self._channelRanges[channelIndex]
+
+    # Index of the channel containing the video at videoIndex
+    def channel_of(self, videoIndex):
+        # Empty channels share their start with the next channel, so take the last match
+        return bisect.bisect_right(self._channelStarts, videoIndex) - 1
+
+    # Select a channel by index and return the index of its first video, or -1 if it is empty
+    def select_channel(self, channelIndex):
+        self._currentChannelIndex = channelIndex % len(self._channels)
+        start, end = self._channelRanges[self._currentChannelIndex]
+        return start if start < end else -1
+
+    # Advance to the next channel with videos and return the index of its first video.
+    # If videoIndex is given the current channel is taken from it (playback may have moved
+    # on to another channel since the last switch).
+    def next_channel(self, videoIndex=-1):
+        return self._step_channel(1, videoIndex)
+
+    def previous_channel(self, videoIndex=-1):
+        return self._step_channel(-1, videoIndex)
+
+    def _step_channel(self, step, videoIndex):
+        if (0 <= videoIndex < len(self._names)):
+            self._currentChannelIndex = self.channel_of(videoIndex)
+        for _ in range(len(self._channels)):
+            videoIndex = self.select_channel(self._currentChannelIndex + step)
+            if (videoIndex >= 0):
+                return videoIndex
+        return -1
+
+    # Number of videos
+    def __len__(self):
+        return len(self._names)
+
+    # Path of the video at videoIndex
+    def get_video(self, videoIndex):
+        return os.path.join(self._videoRoot, self._channels[self.channel_of(videoIndex)], self._names[videoIndex])
+
+    # Path of the file to play for the video at videoIndex (see get_playable_path())
+    def get_playable_video(self, videoIndex):
+        return self._library.get_playable_path(self._channels[self.channel_of(videoIndex)], self._names[videoIndex])
+
+    # Paths of the files the video at videoIndex can be played from, heaviest first (see
+    # get_renditions())
+    def get_renditions(self, videoIndex):
+        return self._library.get_renditions(self._channels[self.channel_of(videoIndex)], self._names[videoIndex])
+
+    # Index of the video with this path, or -1
+    def find(self, path):
+        channelPath, file = os.path.split(str(path))
+        if (os.path.normpath(os.path.dirname(channelPath)) != os.path.normpath(self._videoRoot)):
+            return -1
+        channelIndex = bisect.bisect_left(self._channels, os.path.basename(channelPath))
+        if (channelIndex >= len(self._channels) or self._channels[channelIndex] != os.path.basename(channelPath)):
+            return -1
+        start, end = self._channelRanges[channelIndex]
+        index = bisect.bisect_left(self._names, file, start, end)
+        return index if index < end and self._names[index] == file else -1
+
+    # Path of every video (a read only sequence, built as it is read)
+    def get_videos(self):
+        return _VideoPaths(self, False)
+
+    # Same order as get_videos(), but with the files to actually play (see get_playable_path())
+    def get_playable_videos(self):
+        return _VideoPaths(self, True)
+
+    # (path, modification time) of each video in a channel, in playlist order
+    def get_channel_entries(self, channelIndex):
+        channel = self._channels[channelIndex]
+        channelPath = os.path.join(self._videoRoot, channel)
+        start, end = self._channelRanges[channelIndex]
+        return [(os.path.join(channelPath, file), self._library.get_video_info(channel, file)[1])
+                for file in self._names[start:end]]
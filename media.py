@@ -0,0 +1,158 @@
+######################################################################################
+# media.py
+# Purpose:   Cut the gap between videos.
+#
+#            MediaPool creates the VLC Media for the video that is likely to play next while the
+#            current one is still playing, and asks VLC's preparser to open and probe it in the
+#            background.  When that video is selected the already parsed Media is handed to the
+#            player instead of a cold one.  The pool owns every Media it creates: the one playing
+#            and at most POOL_SIZE - 1 prepared ones.  Each is released as soon as it is no longer
+#            needed (the playing one when the next is taken), so a player that runs for weeks
+#            holds the same handful of Media as one that has just started.
+#
+#            SwitchLatency measures the time from the end of a video (or the button release
+#            that selected a new one) to VLC's first video output event for the new video, and
+#            the time to the very first frame after the process started.
+#
+#            create_instance_in_background() creates the VLC instance (which loads all of VLC's
+#            plugins) on another thread so it overlaps loading the library at startup.
+###########################################################################################
+
+import collections
+import logging
+import threading
+import time as time_ # Don't override time
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import vlc
+
+log = logging.getLogger(__name__)
+
+PARSE_TIMEOUT = 5_000 # milliseconds
+POOL_SIZE = 2 # Media held by a MediaPool: the one playing and the one expected next
+STARTUP = 'startup' # SwitchLatency reason for the first video after the process started
+
+# Start creating a vlc.Instance(*args) on a background thread.  Returns a Future; its
+# result() is the instance.
+def create_instance_in_background(*args):
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='vlc-instance')
+    future = executor.submit(vlc.Instance, *args)
+    executor.shutdown(wait=False)
+    return future
+
+
+# Not thread safe: call from one thread (player.py's input engine thread)
+class MediaPool:
+    def __init__(self, instance, size=POOL_SIZE):
+        self._instance = instance
+        self._size = size
+        self._prepared = collections.OrderedDict() # path -> Media not played yet, least recently wanted first
+        self._playing = None # The Media last handed out by take()
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.released = 0
+
+    # Number of Media the pool holds a reference to
+    def __len__(self):
+        return len(self._prepared) + (1 if self._playing is not None else 0)
+
+    # Create and start parsing the Media for the video expected to play next
+    def prefetch(self, path):
+        path = str(path)
+        if (path in self._prepared):
+            self._prepared.move_to_end(path)
+            return
+        media = self._create(path)
+        try:
+            media.parse_with_options(vlc.MediaParseFlag.local, PARSE_TIMEOUT)
+        except Exception as e:
+            log.warning("Unable to pre-parse '%s': %s", path, e)
+        self._prepared[path] = media
+        while (len(self._prepared) > max(0, self._size - 1)):
+            self._release(self._prepared.popitem(last=False)[1])
+
+    # A Media for path to hand to the player: the prefetched one if there is one, otherwise a new
+    # one.  The pool keeps the reference, and releases the Media it handed out before (the
+    # player holds its own reference to it for as long as it is still playing it).  A Media is
+    # never handed out twice: options like :start-time stay with it.
+    def take(self, path):
+        path = str(path)
+        media = self._prepared.pop(path, None)
+        if (media is not None):
+            self.hits += 1
+        else:
+            self.misses += 1
+            media = self._create(path)
+        if (self._playing is not None):
+            self._release(self._playing)
+        self._playing = media
+        return media
+
+    # Release the prefetched Media that are no longer wanted (all of them with path None)
+    def discard(self, path=None):
+        for prepared in ([str(path)] if path is not None else list(self._prepared)):
+            media = self._prepared.pop(prepared, None)
+            if (media is not None):
+                self._release(media)
+
+    # Release everything, e.g. before the player exits
+    def close(self):
+        self.discard()
+        if (self._playing is not None):
+            self._release(self._playing)
+            self._playing = None
+
+    def _create(self, path):
+        self.created += 1
+        return self._instance.media_new_path(path)
+
+    def _release(self, media):
+        self.released += 1
+        media.release()
+
+
+class SwitchLatency:
+    def __init__(self, history=50):
+        self._lock = threading.Lock()
+        self._startTime = None
+        self._reason = None
+        self._history = history
+        self.samples = []
+
+    # Attach to a VLC media player's event manager
+    def attach(self, player):
+        player.event_manager().event_attach(vlc.EventType.MediaPlayerVout, self._on_vout)
+
+    # Start timing a switch (end of media, button release...) now, or from startTime (a
+    # time.monotonic() timestamp).  The latest mark wins.
+    def mark(self, reason, startTime=None):
+        with self._lock:
+            self._startTime = startTime if startTime is not None else time_.monotonic()
+            self._reason = reason
+
+    def _on_vout(self, event):
+        if (event.u.new_count <= 0):
+            return
+        with self._lock:
+            if (self._startTime is None):
+                return
+            latency = (time_.monotonic() - self._startTime) * 1_000
+            reason = self._reason
+            self._startTime = None
+            self.samples.append((reason, latency))
+            del self.samples[:-self._history]
+        if (reason == STARTUP):
+            log.info("Time to first frame: %.0f ms from process start", latency)
+        else:
+            log.info("Switch latency (%s): %.0f ms", reason, latency)
+
+    # Mean and worst latency in milliseconds for each reason
+    def summary(self):
+        with self._lock:
+            samples = list(self.samples)
+        result = {}
+        for reason in set(reason for reason, latency in samples):
+            latencies = [latency for r, latency in samples if r == reason]
+            result[reason] = (sum(latencies) / len(latencies), max(latencies))
+        return result
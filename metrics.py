@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+######################################################################################
+# metrics.py
+# Purpose:   Trace each button press through to the picture changing, cheaply enough to leave
+#            on all the time.
+#
+#            Tracer keeps the last TRACE_SIZE events (GPIO edge, debounce decision, player
+#            action, set_media, first video output, VLC's per-media stats...) in a fixed-size
+#            ring buffer in memory.  Recording an event only appends a tuple to the buffer;
+#            nothing is formatted or written until the trace is dumped:
+#
+#            - on SIGUSR1, to ~/simpsonstv/trace.jsonl:    kill -USR1 <player pid>
+#            - to anything connecting to the unix socket ~/simpsonstv/trace.sock:
+#                python3 metrics.py [~/simpsonstv/trace.sock]
+#
+#            Each event is one JSON line: {"t": <monotonic milliseconds>, "event": <name>, ...}.
+###########################################################################################
+
+import collections
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time as time_ # Don't override time
+
+from backends import vlc
+from library import write_file_atomic
+
+log = logging.getLogger(__name__)
+
+TRACE_SIZE = 2_048 # events
+
+# Default locations of the trace dump and the trace socket: next to the videos root
+def default_trace_path(videoRoot):
+    return os.path.join(os.path.dirname(os.path.normpath(videoRoot)), 'trace.jsonl')
+
+def default_socket_path(videoRoot):
+    return os.path.join(os.path.dirname(os.path.normpath(videoRoot)), 'trace.sock')
+
+# time.monotonic() timestamp of when this process started (before the interpreter loaded), from
+# the start time in /proc/self/stat.  Falls back to now if it can't be read.
+def process_start_time():
+    try:
+        with open('/proc/self/stat', 'r') as file:
+            stat = file.read()
+        startTicks = int(stat[stat.rindex(')') + 2:].split()[19]) # Field 22, counting from 1
+        uptime = time_.clock_gettime(time_.CLOCK_BOOTTIME) - startTicks / os.sysconf('SC_CLK_TCK')
+        return time_.monotonic() - uptime
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time_.monotonic()
+
+# VLC's statistics for a Media: {'decoded': ..., 'lost': ...}, or None if VLC has none
+def media_stats(media):
+    if (media is None):
+        return None
+    stats = vlc.MediaStats()
+    try:
+        if (not media.get_stats(stats)):
+            return None
+    except Exception:
+        return None
+    return {
+        'decoded': stats.decoded_video,
+        'displayed': stats.displayed_pictures,
+        'lost': stats.lost_pictures,
+        'demux_kbps': round(stats.demux_bitrate * 8_000, 1), # VLC reports bytes per microsecond
+        'demux_corrupted': stats.demux_corrupted,
+    }
+
+
+class Tracer:
+    def __init__(self, size=TRACE_SIZE):
+        self._events = collections.deque(maxlen=size)
+        self._media = None
+        self._mediaLock = threading.Lock()
+
+    # Record an event.  Safe to call from any thread (deque.append is atomic).
+    def trace(self, event, **fields):
+        self._events.append((time_.monotonic(), event, fields))
+
+    # Trace the first video output and the end of every media played by a VLC media player
+    def attach(self, player):
+        events = player.event_manager()
+        events.event_attach(vlc.EventType.MediaPlayerVout, self._on_vout)
+        events.event_attach(vlc.EventType.MediaPlayerEndReached, self._on_end_reached)
+
+    # A new media was handed to the player: record the outgoing media's stats and the switch.
+    # The tracer keeps its own reference to the media until the next one, so the caller may
+    # release theirs (or remove it from a media list) at any time.
+    def set_media(self, media, path=None):
+        if (media is not None):
+            media.retain()
+        with self._mediaLock:
+            previous = self._media
+            self._media = media
+            stats = media_stats(previous)
+            if (previous is not None):
+                previous.release()
+        if (stats is not None):
+            self.trace('stats', **stats)
+        self.trace('set_media', path=str(path) if path is not None else None)
+
+    def _on_vout(self, event):
+        if (event.u.new_count > 0):
+            self.trace('vout', count=event.u.new_count)
+
+    def _on_end_reached(self, event):
+        self.trace('end_reached')
+
+    # The buffered events (oldest first) as JSON lines, then the stats of the playing media so far
+    def lines(self):
+        events = list(self._events)
+        with self._mediaLock:
+            stats = media_stats(self._media)
+        if (stats is not None):
+            events.append((time_.monotonic(), 'stats', dict(playing=True, **stats)))
+        return [json.dumps(dict(t=round(at * 1_000, 1), event=event, **fields), separators=(',', ':')) + '\n'
+                for at, event, fields in events]
+
+    def dump(self, path):
+        try:
+            write_file_atomic(path, ''.join(self.lines()).encode('utf-8'))
+            log.info("Trace written to '%s'", path)
+        except OSError as e:
+            log.warning("Unable to write the trace '%s': %s", path, e)
+
+    # Dump to path whenever the process receives signum.  Must be called from the main thread.
+    # The handler only wakes a dump thread: it runs on the main thread wherever it was
+    # interrupted, maybe inside set_media() holding the lock lines() needs.
+    def dump_on_signal(self, path, signum=signal.SIGUSR1):
+        requested = threading.Event()
+        def dump_when_requested():
+            while (True):
+                requested.wait()
+                requested.clear()
+                self.dump(path)
+        threading.Thread(target=dump_when_requested, name='trace-dump', daemon=True).start()
+        signal.signal(signum, lambda sig, frame: requested.set())
+
+    # Send the trace to every client that connects to a unix socket at path
+    def serve(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(path)
+            server.listen(1)
+        except OSError as e:
+            log.warning("Unable to open the trace socket '%s': %s", path, e)
+            server.close()
+            return
+        threading.Thread(target=self._serve, args=(server,), name='trace-socket', daemon=True).start()
+
+    def _serve(self, server):
+        while (True):
+            connection, address = server.accept()
+            with connection:
+                try:
+                    connection.sendall(''.join(self.lines()).encode('utf-8'))
+                except OSError:
+                    pass
+
+
+# Read a trace from a player's trace socket
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.expanduser('~/simpsonstv/trace.sock')
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    with client:
+        while (True):
+            data = client.recv(65_536)
+            if (not data):
+                break
+            sys.stdout.buffer.write(data)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+######################################################################################
+# osd.py
+# Purpose:   On screen display of the channel and video title, drawn from inside the player
+#            process: no "clear" command (a shell and a process for every selection) and no
+#            flicker from clearing the screen and printing line by line.
+#
+#            FramebufferOSD draws straight into the framebuffer (/dev/fb0) with a small built-in
+#            5x7 font.  Every glyph is rendered once, at start up, to rows of pixels in the
+#            framebuffer's pixel format and scaled to the screen size, so showing a title is
+#            just copying rows of bytes.  It works just as well on an ordinary file, which is
+#            how it can be checked without a screen:  python3 osd.py
+#
+#            ConsoleOSD is the fallback when there is no usable framebuffer: it redraws the
+#            console with one write of ANSI escape codes and text.
+#
+#            open_osd() picks the framebuffer if it can be opened, otherwise the console.
+###########################################################################################
+
+import mmap
+import os
+import stat
+import struct
+import sys
+import textwrap
+
+FONT_WIDTH = 5
+FONT_HEIGHT = 7
+CELL_WIDTH = FONT_WIDTH + 1 # One pixel between characters
+CELL_HEIGHT = FONT_HEIGHT + 3 # Three pixels between lines
+COLUMNS = 26 # Characters per line the font is scaled to fit
+FOREGROUND = (255, 217, 15) # Simpsons yellow
+BACKGROUND = (0, 0, 0)
+
+# 5x7 glyphs, one string of 5 pixels per row.  Lower case letters are drawn in upper case and
+# anything else missing is drawn as '?'.
+FONT = {
+    ' ': '00000 00000 00000 00000 00000 00000 00000',
+    'A': '01110 10001 10001 11111 10001 10001 10001',
+    'B': '11110 10001 10001 11110 10001 10001 11110',
+    'C': '01110 10001 10000 10000 10000 10001 01110',
+    'D': '11110 10001 10001 10001 10001 10001 11110',
+    'E': '11111 10000 10000 11110 10000 10000 11111',
+    'F': '11111 10000 10000 11110 10000 10000 10000',
+    'G': '01110 10001 10000 10111 10001 10001 01111',
+    'H': '10001 10001 10001 11111 10001 10001 10001',
+    'I': '01110 00100 00100 00100 00100 00100 01110',
+    'J': '00111 00010 00010 00010 00010 10010 01100',
+    'K': '10001 10010 10100 11000 10100 10010 10001',
+    'L': '10000 10000 10000 10000 10000 10000 11111',
+    'M': '10001 11011 10101 10101 10001 10001 10001',
+    'N': '10001 10001 11001 10101 10011 10001 10001',
+    'O': '01110 10001 10001 10001 10001 10001 01110',
+    'P': '11110 10001 10001 11110 10000 10000 10000',
+    'Q': '01110 10001 10001 10001 10101 10010 01101',
+    'R': '11110 10001 10001 11110 10100 10010 10001',
+    'S': '01111 10000 10000 01110 00001 00001 11110',
+    'T': '11111 00100 00100 00100 00100 00100 00100',
+    'U': '10001 10001 10001 10001 10001 10001 01110',
+    'V': '10001 10001 10001 10001 10001 01010 00100',
+    'W': '10001 10001 10001 10101 10101 10101 01010',
+    'X': '10001 10001 01010 00100 01010 10001 10001',
+    'Y': '10001 10001 10001 01010 00100 00100 00100',
+    'Z': '11111 00001 00010 00100 01000 10000 11111',
+    '0': '01110 10001 10011 10101 11001 10001 01110',
+    '1': '00100 01100 00100 00100 00100 00100 01110',
+    '2': '01110 10001 00001 00010 00100 01000 11111',
+    '3': '11111 00010 00100 00010 00001 10001 01110',
+    '4': '00010 00110 01010 10010 11111 00010 00010',
+    '5': '11111 10000 11110 00001 00001 10001 01110',
+    '6': '00110 01000 10000 11110 10001 10001 01110',
+    '7': '11111 00001 00010 00100 01000 01000 01000',
+    '8': '01110 10001 10001 01110 10001 10001 01110',
+    '9': '01110 10001 10001 01111 00001 00010 01100',
+    '.': '00000 00000 00000 00000 00000 01100 01100',
+    ',': '00000 00000 00000 00000 01100 00100 01000',
+    ':': '00000 01100 01100 00000 01100 01100 00000',
+    ';': '00000 01100 01100 00000 01100 00100 01000',
+    '-': '00000 00000 00000 11111 00000 00000 00000',
+    '_': '00000 00000 00000 00000 00000 00000 11111',
+    "'": '01100 00100 01000 00000 00000 00000 00000',
+    '"': '01010 01010 01010 00000 00000 00000 00000',
+    '!': '00100 00100 00100 00100 00100 00000 00100',
+    '?': '01110 10001 00001 00010 00100 00000 00100',
+    '(': '00010 00100 01000 01000 01000 00100 00010',
+    ')': '01000 00100 00010 00010 00010 00100 01000',
+    '[': '01110 01000 01000 01000 01000 01000 01110',
+    ']': '01110 00010 00010 00010 00010 00010 01110',
+    '&': '01100 10010 10100 01000 10101 10010 01101',
+    '#': '01010 01010 11111 01010 11111 01010 01010',
+    '+': '00000 00100 00100 11111 00100 00100 00000',
+    '/': '00000 00001 00010 00100 01000 10000 00000',
+    '=': '00000 00000 11111 00000 11111 00000 00000',
+    '%': '11000 11001 00010 00100 01000 10011 00011',
+    '*': '00000 00100 10101 01110 10101 00100 00000',
+}
+
+# Pack an (r, g, b) colour as one pixel of the given depth (little endian, as on the Pi)
+def pack_pixel(colour, bitsPerPixel):
+    red, green, blue = colour
+    if (bitsPerPixel == 16):
+        return struct.pack('<H', (red >> 3) << 11 | (green >> 2) << 5 | blue >> 3)
+    if (bitsPerPixel == 24):
+        return bytes((blue, green, red))
+    if (bitsPerPixel == 32):
+        return bytes((blue, green, red, 255))
+    raise ValueError(f"Unsupported framebuffer depth: {bitsPerPixel} bits per pixel")
+
+def _read_sysfs(device, name):
+    with open(os.path.join('/sys/class/graphics', os.path.basename(device), name), 'r') as file:
+        return file.read().strip()
+
+
+class FramebufferOSD:
+    def __init__(self, path, width, height, bitsPerPixel=16, stride=None, scale=None):
+        self._width = width
+        self._height = height
+        self._bytesPerPixel = bitsPerPixel // 8
+        self._stride = stride or width * self._bytesPerPixel
+        self._scale = scale or max(1, width // (CELL_WIDTH * COLUMNS))
+        self._columns = width // (CELL_WIDTH * self._scale) - 2 # Leave a margin of one character
+        self._lineHeight = CELL_HEIGHT * self._scale
+
+        size = self._stride * height
+        self._file = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if (stat.S_ISREG(os.fstat(self._file).st_mode) and os.fstat(self._file).st_size < size):
+                os.ftruncate(self._file, size) # A file standing in for the framebuffer
+            self._map = mmap.mmap(self._file, size)
+        except (OSError, ValueError):
+            os.close(self._file)
+            raise
+
+        background = pack_pixel(BACKGROUND, bitsPerPixel)
+        foreground = pack_pixel(FOREGROUND, bitsPerPixel)
+        self._blank = (background * width).ljust(self._stride, b'\0') * height
+        self._glyphs = {character: self._render(rows, foreground, background) for character, rows in FONT.items()}
+
+    # Open a framebuffer device, e.g. /dev/fb0, with its geometry from sysfs
+    @classmethod
+    def from_device(cls, device):
+        # The visible mode (e.g. "U:480x320p-0"); the virtual size can be larger for panning
+        mode = _read_sysfs(device, 'modes').splitlines()[0]
+        width, height = (int(value) for value in mode.split(':')[1].split('p')[0].split('x'))
+        return cls(device, width, height, int(_read_sysfs(device, 'bits_per_pixel')),
+                   int(_read_sysfs(device, 'stride')))
+
+    # Pixel rows of a glyph cell, already scaled horizontally: CELL_HEIGHT rows of bytes
+    def _render(self, rows, foreground, background):
+        rows = [row + '0' for row in rows.split()] + ['0' * CELL_WIDTH] * (CELL_HEIGHT - FONT_HEIGHT)
+        return [b''.join((foreground if pixel == '1' else background) * self._scale for pixel in row)
+                for row in rows]
+
+    def clear(self):
+        self._map[:] = self._blank
+
+    # Clear the screen and draw lines of text, long lines wrapped, starting three lines down
+    def show(self, lines):
+        self.clear()
+        row = 3
+        for line in lines:
+            for text in textwrap.wrap(line, self._columns) or ['']:
+                if (row >= self._height // self._lineHeight):
+                    return
+                self._draw(text, CELL_WIDTH * self._scale, row * self._lineHeight)
+                row += 1
+
+    def _draw(self, text, x, y):
+        glyphs = [self._glyphs.get(character.upper(), self._glyphs['?']) for character in text]
+        offset = y * self._stride + x * self._bytesPerPixel
+        for cellRow in range(CELL_HEIGHT):
+            pixels = b''.join(glyph[cellRow] for glyph in glyphs)
+            for repeat in range(self._scale):
+                self._map[offset:offset + len(pixels)] = pixels
+                offset += self._stride
+
+    def close(self):
+        self._map.close()
+        os.close(self._file)
+
+
+class ConsoleOSD:
+    CLEAR = '\033[H\033[2J' # Cursor home, clear screen
+    HIDE_CURSOR = '\033[?25l'
+
+    def __init__(self, stream=None):
+        self._stream = stream or sys.stdout
+        self._write(self.HIDE_CURSOR)
+
+    def _write(self, text):
+        try:
+            self._stream.write(text)
+            self._stream.flush()
+        except (OSError, ValueError):
+            pass
+
+    def clear(self):
+        self._write(self.CLEAR)
+
+    # Clear the console and print lines of text three lines down, in a single write
+    def show(self, lines):
+        self._write(self.CLEAR + '\n\n\n' + ''.join('  ' + line + '\n' for line in lines))
+
+    def close(self):
+        pass
+
+
+# The framebuffer OSD on device if it can be used, otherwise the console
+def open_osd(device='/dev/fb0'):
+    if (device):
+        try:
+            return FramebufferOSD.from_device(device)
+        except (OSError, ValueError, IndexError):
+            pass
+    return ConsoleOSD()
+
+
+# Self check: draw into a file standing in for a 480x320 16 bit framebuffer, time it, and show
+# a preview of the result on the terminal
+if __name__ == '__main__':
+    import tempfile
+    import time as time_ # Don't override time
+
+    with tempfile.NamedTemporaryFile(suffix='.fb') as file:
+        width, height = 480, 320
+        osd = FramebufferOSD(file.name, width, height, 16)
+        lines = ["Channel: The Simpsons", "S01E01 - Simpsons Roasting on an Open Fire"]
+        start = time_.perf_counter()
+        for _ in range(100):
+            osd.show(lines)
+        elapsed = (time_.perf_counter() - start) / 100
+        osd.close()
+
+        data = open(file.name, 'rb').read()
+        background = pack_pixel(BACKGROUND, 16)
+        step = 3 # The font is scaled 3x at this width: print one character per glyph pixel
+        for y in range(0, height // 2, step):
+            offset = y * width * 2
+            print(''.join('#' if data[offset + x * 2:offset + x * 2 + 2] != background else ' '
+                          for x in range(0, width, step)).rstrip())
+        print(f"show(): {elapsed * 1_000:.2f} ms")
@@ -1,65 +1,383 @@
 #!/usr/bin/env python3
 
 import signal
+import logging
 import os
 import sys
-import RPi.GPIO as GPIO
-import vlc
+import threading
 import time as time_ # Don't override time
+from backends import GPIO, vlc # RPi.GPIO and python-vlc, or stand-ins when SIMPSONSTV_BACKEND=sim
+from library import LibraryIndex, VideoSelector
+from watcher import LibraryWatcher
+from broadcast import BroadcastSchedule, DurationCache, default_cache_path
+from journal import ResumeJournal, default_journal_path
+from media import STARTUP, SwitchLatency, create_instance_in_background
+from osd import open_osd
+from metrics import Tracer, default_socket_path, default_trace_path, process_start_time
+from scrub import KeyframeCache, Scrubber, SCRUB_INTERVAL, default_keyframes_path, media_path
+from governor import RenditionGovernor
+from commands import CommandQueue, LATEST, SUM, TOGGLE
+from supervisor import Blocklist, PlaybackSupervisor, default_blocklist_path, release_in_background
 
-class VideoSelector:
-    def __init__(self, videoRoot, videoFileExtension):
-        self._videoRoot = videoRoot
-        self._videoFileExtension = videoFileExtension
-        self._currentChannelIndex = 0
-        self._currentVideoIndex = 0
-
-        self._channels = []
-        self._videos = []
-        for videoRoot, channels, files in os.walk(self._videoRoot):
-            for channel in channels:
-                self._channels.append(channel)
-            for file in files:
-                filePath = os.path.join(videoRoot, file)
-                if (os.path.exists(filePath) and filePath.lower().endswith(self._videoFileExtension)):
-                    self._videos.append(filePath)
-        self._channels.sort()
-        if (len(self._channels) <= 0):
-            print(f"Directory '{videoRoot}' does not contain any sub-directories to be used as a 'channel'.")
-            quit()
-        self._videos.sort()
-        if (len(self._videos) <= 0):
-            print(f"The directories within '{videoRoot}' do not contain any files with extension {self._videoFileExtension} to play.")
-            quit()
-
-    def get_current_channel(self):
-        return self._channels[self._currentChannelIndex]
-    
-    def next_channel(self):
-        self._currentChannelIndex += 1
-        if (self._currentChannelIndex >= len(self._channels)):
-            self._currentChannelIndex = 0
-
-        # Find index of first video for the next channel
-        channel = self.get_current_channel()
-        channelPath = os.path.join(self._videoRoot, channel)
-        for videoIndex in range(len(self._videos)):
-            if (self._videos[videoIndex].startswith(channelPath)):
-                return videoIndex
-        
-        return -1
-    
-    def get_videos(self):
-        return self._videos
+log = logging.getLogger('player-alt')
+
+# Set BROADCAST_MODE to True to make every channel behave like a live TV channel: switching to a
+# channel joins the episode that is "airing" right now, part way through, instead of starting the
+# channel's first episode from the beginning.
+BROADCAST_MODE = False
+
+# The channel and title of a video selected with the right button are drawn on this framebuffer
+# (or printed on the console if it can't be opened) for OSD_SECONDS before the video plays.  Set
+# OSD_SECONDS to 0 to switch videos straight away without showing them.
+OSD_DEVICE = '/dev/fb0'
+OSD_SECONDS = 1.5
 
+# VLC's media list only holds the videos either side of the current one, not the whole library:
+# a ring of 2 * PLAYLIST_WINDOW + 1 items (fewer in a small library) that is refilled as playback
+# moves on, so VLC never holds more than that many Media objects.  Videos added or removed while
+# the script runs are swapped into the playlist without interrupting the current video.
+PLAYLIST_WINDOW = 10
 
 # Retrieves the number of milliseconds since power up
 def get_timestamp():
     return int(round(time_.time() * 1_000))
 
+# Item of VlcMediaList loaded in the media list player, or -1 if none
+def get_current_slot():
+    media = VlcMediaListPlayer.get_media_player().get_media()
+    if (media is None):
+        return -1
+    slot = VlcMediaList.index_of_item(media)
+    media.release() # get_media() returns a new reference
+    return slot if slot < len(Slots) else -1
+
+# Index (in Videos) of the video currently loaded in the media list player, or -1 if none
+def get_current_video_index():
+    slot = get_current_slot()
+    return Slots[slot] if slot >= 0 else -1
+
+# Play the video at video_index in Videos: from its item if it is already in the window,
+# otherwise from the item after the current one
+def play_video(video_index):
+    with WindowLock:
+        if (video_index in Slots):
+            slot = Slots.index(video_index)
+        else:
+            slot = (get_current_slot() + 1) % window_size()
+        fill_window(video_index, slot)
+        Commands.loading() # The next command waits for this video to start
+        VlcMediaListPlayer.play_item_at_index(slot)
+
+# Number of items in VlcMediaList once the library has loaded.  The ring never shrinks (that
+# would mean removing items in front of the current one), so after videos are removed it can
+# hold some videos twice.
+def window_size():
+    return max(len(Slots), min(2 * PLAYLIST_WINDOW + 1, len(Videos)))
+
+# Make VlcMediaList hold the videos either side of center, wrapping around the library (the
+# channel in broadcast mode), with
+# center in item center_slot and the following videos in the following items (wrapping round
+# the ring).  Moving on by one video replaces one item.  Items are replaced in place (removed
+# and inserted at the same index) because the media list player only remembers the current
+# item by its index, and the item that is playing is never replaced.  Call with WindowLock held.
+def fill_window(center, center_slot):
+    size = window_size()
+    half = size // 2 # PLAYLIST_WINDOW unless the library is small
+    playing = get_current_slot()
+    # The videos either side of center, stepping over the ones that keep failing to play
+    ahead, behind = [center], [center]
+    for offset in range(half):
+        ahead.append(next_playable(ahead[-1], 1, 1))
+        behind.append(next_playable(behind[-1], -1, 1))
+    VlcMediaList.lock()
+    try:
+        for slot in range(size):
+            # The one video of the window that belongs in this slot
+            offset = (slot - center_slot + half) % size - half
+            video_index = ahead[offset] if offset >= 0 else behind[-offset]
+            if (slot < len(Slots) and (Slots[slot] == video_index or slot == playing)):
+                continue
+            media = VlcInstance.media_new_path(Governor.choose(Videos.get_renditions(video_index)))
+            if (slot < len(Slots)):
+                VlcMediaList.remove_index(slot)
+                VlcMediaList.insert_media(media, slot)
+                Slots[slot] = video_index
+            else:
+                VlcMediaList.add_media(media)
+                Slots.append(video_index)
+            media.release() # The media list keeps its own reference
+    finally:
+        VlcMediaList.unlock()
+
+# The range of Videos that playback goes round from video_index: the whole library or, in
+# broadcast mode, its channel, which loops like the broadcast schedule (and player.py) does
+def ring_of(video_index):
+    if (BROADCAST_MODE and video_index >= 0):
+        return Videos.get_channel_range(Videos.channel_of(video_index))
+    return 0, len(Videos)
+
+# The first video skip or more videos on from video_index (backwards if step is -1, wrapping
+# around its ring) that isn't on the blocklist of videos that keep failing to play, or the one
+# skip videos on if they all are
+def next_playable(video_index, step=1, skip=0):
+    start, end = ring_of(video_index)
+    for count in range(skip, skip + end - start):
+        candidate = start + (video_index - start + count * step) % (end - start)
+        if (not Blocked.is_blocked(Governor.choose(Videos.get_renditions(candidate)))):
+            return candidate
+    return start + (video_index - start + skip * step) % (end - start)
+
+# Move the window along after the media list player moves on to the next video by itself.  A
+# command rather than straight from VLC's event thread, which shouldn't wait for the media list.
+def move_window(amount):
+    with WindowLock:
+        slot = get_current_slot()
+        if (Videos is not None and slot >= 0 and Slots[slot] >= 0):
+            fill_window(Slots[slot], slot)
+
+# The files the current video can be played from (heaviest first), for the rendition governor
+def current_renditions():
+    video_index = get_current_video_index()
+    if (Videos is None or video_index < 0):
+        return None
+    return Videos.get_renditions(video_index)
+
+# The rendition governor chose a lighter (or heavier) rendition.  The current video carries on
+# from the new file at the same position and the rest of the window is refilled, so the videos
+# after it play from the new rendition too.
+def switch_rendition(rendition):
+    global PendingStartTime
+
+    mediaPlayer = VlcMediaListPlayer.get_media_player()
+    with WindowLock:
+        slot = get_current_slot()
+        if (Videos is None or slot < 0 or Slots[slot] < 0 or mediaPlayer.get_state() != vlc.State.Playing):
+            return
+        video_index = Slots[slot]
+        path = Governor.choose(Videos.get_renditions(video_index))
+        media = mediaPlayer.get_media()
+        playing = media_path(media)
+        media.release() # get_media() returns a new reference
+        for other in range(len(Slots)):
+            if (other != slot):
+                Slots[other] = -1 # Refilled by fill_window()
+        if (path != playing):
+            Trace.trace('action', name='switch_rendition', rendition=rendition)
+            position = mediaPlayer.get_time()
+            media = VlcInstance.media_new_path(path)
+            VlcMediaList.lock()
+            try:
+                VlcMediaList.remove_index(slot)
+                VlcMediaList.insert_media(media, slot)
+            finally:
+                VlcMediaList.unlock()
+            media.release()
+        fill_window(video_index, slot)
+        if (path != playing):
+            PendingStartTime = (position, time_.time()) # Carry on from the same position
+            Commands.loading()
+            VlcMediaListPlayer.play_item_at_index(slot)
+
+# Index of the video selected with the right button and waiting to play, or else the current one
+def get_selected_video_index():
+    with SelectLock:
+        if (Selected is not None):
+            return Selected[0]
+    return get_current_video_index()
+
+# A video was selected with the right button: stop the current video, show the new channel and
+# title on the OSD and play it OSD_SECONDS later.  Another selection in the meantime restarts the
+# wait.  tune is True to join the video's channel "live" in broadcast mode.
+def select_video(video_index, tune=False):
+    global Selected, SelectTimer
+
+    if (OSD_SECONDS <= 0):
+        play_video(tune_in(video_index) if tune else video_index)
+        return
+    with SelectLock:
+        if (SelectTimer is not None):
+            SelectTimer.cancel()
+        else:
+            VlcMediaListPlayer.stop()
+        Selected = (video_index, tune)
+        SelectTimer = threading.Timer(OSD_SECONDS, Commands.call, (play_selected_video,))
+        SelectTimer.daemon = True
+        SelectTimer.start()
+    channel = Videos.get_channels()[Videos.channel_of(video_index)]
+    OSD.show(["Channel: " + channel, os.path.splitext(os.path.basename(Videos.get_video(video_index)))[0]])
+
+def play_selected_video():
+    global Selected, SelectTimer
+
+    with SelectLock:
+        if (Selected is None):
+            return
+        video_index, tune = Selected
+        Selected = None
+        SelectTimer = None
+    play_video(tune_in(video_index) if tune else video_index)
+
+# Path of the video at video_index in Videos, or None
+def get_video_path(video_index):
+    if (Videos is None):
+        return StartingVideo if video_index == 0 else None # Fast start: only the first video is known
+    if (0 <= video_index < len(Videos)):
+        return Videos.get_video(video_index)
+    return None
+
+# Broadcast mode: find the episode airing now on the channel containing video_index.  Returns
+# the index of that episode; the offset into it is applied once it starts playing.
+def tune_in(video_index):
+    global PendingStartTime
+
+    channelIndex = Videos.channel_of(video_index)
+    start, end = Videos.get_channel_range(channelIndex)
+    episode, offset = Broadcast.tune(Videos.get_channels()[channelIndex], Videos.get_channel_entries(channelIndex))
+    PendingStartTime = (offset, time_.time())
+    return start + episode
+
+# Returns (channel, video path, position) for the resume journal, or None if nothing is playing
+def sample_player():
+    path = get_video_path(get_current_video_index())
+    position = VlcMediaListPlayer.get_media_player().get_time()
+    if (path is None or position < 0):
+        return None
+    # Videos are always directly inside their channel's directory
+    return (os.path.basename(os.path.dirname(path)), path, position)
+
+# Record the position of the playing video (in memory, saved with the next journal flush)
+def remember_position():
+    state = sample_player()
+    if (state is not None):
+        Journal.update(*state)
+
+# A new video was loaded: continue it from where it was last stopped, unless a start time has
+# already been chosen (broadcast mode or startup resume)
+def next_item_set_callback(event):
+    global PendingStartTime
+
+    Commands.post('window')
+    path = get_video_path(get_current_video_index())
+    media = VlcMediaListPlayer.get_media_player().get_media()
+    Trace.set_media(media, path)
+    if (media is not None):
+        Keyframes.index_in_background(media_path(media)) # Ready for scrubbing
+        media.release()
+    if (BROADCAST_MODE or PendingStartTime is not None or path is None):
+        return
+    position = Journal.get_position(path)
+    if (position > 0):
+        PendingStartTime = (position, None)
+
+# A video's picture is shown: remember which video it is.  By the time it ends the media list
+# player may already have moved on to the next item.
+def vout_callback(event):
+    global ShownPath
+
+    if (event.u.new_count > 0):
+        ShownPath = get_video_path(get_current_video_index())
+
+# The video played to the end: start it from the beginning next time
+def end_reached_callback(event):
+    Latency.mark("end of media")
+    if (ShownPath is not None):
+        Journal.finished(ShownPath)
+
+# A video started playing: seek to its start time (ahead of any commands waiting for it to start)
+# and let the next command run
+def media_player_playing_callback(event):
+    if (PendingStartTime is not None):
+        Commands.call_next(seek_to_start_time)
+    Commands.loaded()
+
+# Seek to the start time chosen by tune_in() (allowing for the time taken to start playing) or
+# by the resume journal
+def seek_to_start_time():
+    global PendingStartTime
+
+    if (PendingStartTime is None):
+        return
+    offset, tuneTime = PendingStartTime
+    PendingStartTime = None
+    if (tuneTime is not None):
+        offset += (time_.time() - tuneTime) * 1_000
+    VlcMediaListPlayer.get_media_player().set_time(int(offset))
+
+# The supervisor (supervisor.py) found the playing video failed: VLC reported an error, it didn't
+# start or its picture froze.  The command waiting for it to start needn't wait any longer.
+def video_failed(reason):
+    Commands.loaded()
+    Commands.call(skip_video)
+
+# Play the video after the one that failed, unless another has been selected in the meantime.  A
+# new VLC instance starts loading in the background in case VLC itself turns out to be stuck.
+def skip_video():
+    global SpareInstance
+
+    if (SpareInstance is None):
+        SpareInstance = create_instance_in_background('--quiet')
+    with SelectLock:
+        if (Selected is not None):
+            return
+    if (Videos is None):
+        return # Still loading the library (fast start): nothing to skip to yet
+    Trace.trace('action', name='skip_video')
+    play_video(next_playable(max(get_current_video_index(), 0), 1, 1))
+
+# The video after a failed one failed too, so VLC itself is probably stuck: replace it
+def vlc_failed(reason):
+    Commands.loaded()
+    Commands.call(restart_vlc)
+
+# Replace the VLC instance, media list player and media list with new ones, without restarting
+# the script (the library, journal and trace are kept), and try the video that failed again on
+# them (only the video before it is blamed).  The old VLC is released in the background in case
+# it never returns.
+def restart_vlc():
+    global VlcInstance, SpareInstance
+
+    Trace.trace('action', name='restart_vlc')
+    started = time_.monotonic()
+    video_index = get_current_video_index()
+    old = (VlcMediaListPlayer, VlcMediaList, VlcInstance)
+    with WindowLock:
+        VlcInstance = (SpareInstance or create_instance_in_background('--quiet')).result() # Usually loaded while skipping
+        SpareInstance = None
+        create_player()
+        del Slots[:] # The new media list is empty
+    mediaPlayer = VlcMediaListPlayer.get_media_player()
+    for listener in (Trace, Latency, Scrub, Governor, Supervisor):
+        listener.attach(mediaPlayer)
+    Durations.set_instance(VlcInstance)
+    release_in_background(*old)
+    log.info("Restarted VLC in %.0f ms", (time_.monotonic() - started) * 1_000)
+    with SelectLock:
+        if (Selected is not None):
+            return # Played on the new player by SelectTimer
+    if (Videos is not None):
+        play_video(next_playable(max(video_index, 0)))
+
+# Create the media list player and its media list on VlcInstance and listen to their events
+def create_player():
+    global VlcMediaListPlayer, VlcMediaList
+
+    VlcMediaListPlayer = VlcInstance.media_list_player_new()
+    VlcMediaList = VlcInstance.media_list_new()
+    VlcMediaListPlayer.set_media_list(VlcMediaList)
+    if (Videos is not None):
+        VlcMediaListPlayer.set_playback_mode(vlc.PlaybackMode.loop) # Go round the ring of items
+    mediaPlayerEvents = VlcMediaListPlayer.get_media_player().event_manager()
+    mediaPlayerEvents.event_attach(vlc.EventType.MediaPlayerPlaying, media_player_playing_callback)
+    mediaPlayerEvents.event_attach(vlc.EventType.MediaPlayerVout, vout_callback)
+    mediaPlayerEvents.event_attach(vlc.EventType.MediaPlayerEndReached, end_reached_callback)
+    VlcMediaListPlayer.event_manager().event_attach(vlc.EventType.MediaListPlayerNextItemSet, next_item_set_callback)
+
 # Stops the VLC player
 def stop_vlc_player():
     global VlcMediaListPlayer
+    Supervisor.stop() # Don't restart VLC as it is stopped
+    Commands.stop()
+    Journal.close() # Save where we are
     VlcMediaListPlayer.stop()
     VlcMediaListPlayer.release()
 
@@ -75,10 +393,7 @@ def shutdown_signal_callback(channel):
         # TODO: This should work, but I haven't tested it as I haven't used the safe shutdown circuit
         stop_vlc_player()
         GPIO.cleanup()
-        os.system("clear")
-        print("")
-        print("")
-        print("Shutting Down...")
+        OSD.show(["Shutting Down..."])
         os.system("sudo shutdown -h now")
 
 # Right VCR button
@@ -89,6 +404,7 @@ def right_vcr_button_callback(channel):
     global VlcMediaListPlayer
     global Videos
 
+    Trace.trace('edge', pin=channel, level=GPIO.input(RIGHT_VCR_BUTTON_GPIO))
     if not GPIO.input(RIGHT_VCR_BUTTON_GPIO):
         # Start timer
         RightButtonPressedStartTime = get_timestamp()
@@ -97,31 +413,87 @@ def right_vcr_button_callback(channel):
         now = get_timestamp()
         if (now - RightButtonPressedStartTime >= 2_000):
             # Right button pressed and released for 2 seconds or more
-            video_index = Videos.next_channel()
-            VlcMediaListPlayer.play_item_at_index(video_index)
+            Trace.trace('action', name='next_channel')
+            Latency.mark("button release")
+            Commands.post('next_channel')
+        elif (Scrubbing):
+            Trace.trace('action', name='reverse')
+            Commands.post('reverse') # Switch between rewinding and fast forwarding
         else:
-            VlcMediaListPlayer.next()
+            Trace.trace('action', name='next')
+            Latency.mark("button release")
+            Commands.post('next')
+
+# Commands posted by the buttons and run one at a time by Commands (see commands.py).  amount is
+# the number of presses merged into the command.
+
+# Select the video amount videos after the selected one
+def next_video(amount):
+    if (Videos is None):
+        return # Still loading the library (fast start)
+    remember_position()
+    select_video(next_playable(get_selected_video_index(), 1, amount))
+
+# Select the first video of the channel amount channels after the selected one
+def next_channel(amount):
+    if (Videos is None):
+        return
+    remember_position()
+    video_index = get_selected_video_index()
+    for channel in range(amount):
+        video_index = Videos.next_channel(video_index)
+    select_video(next_playable(video_index), tune=BROADCAST_MODE)
+
+# Pause/resume playback (presses that cancel out never get here)
+def toggle_pause(amount):
+    VlcMediaListPlayer.pause()
+
+# Rewind (or fast forward) by amount jumps, starting to rewind if this is the first
+def scrub(amount):
+    if (not Scrub.is_active()):
+        Trace.trace('action', name='rewind')
+        Scrub.begin(-1)
+    Scrub.step(amount)
 
 # Left VCR button
-# Long press (1 seconds or more) rewind current video 10s
+# Long press (1 seconds or more) rewinds the current video until the button is released, faster
+# the longer it is held; a short press of the right button meanwhile switches to fast forward
 # Short press (less than 1 second) pause/resume playback
 def left_vcr_button_callback(channel):
     global LeftButtonPressedStartTime
     global VlcMediaListPlayer
+    global ScrubTimer, Scrubbing
 
+    Trace.trace('edge', pin=channel, level=GPIO.input(LEFT_VCR_BUTTON_GPIO))
     if not GPIO.input(LEFT_VCR_BUTTON_GPIO):
         # Start timer
         LeftButtonPressedStartTime = get_timestamp()
+        ScrubTimer = threading.Timer(1.0, scrub_tick)
+        ScrubTimer.daemon = True
+        ScrubTimer.start()
     else:
-        # Calculate time of left button release
-        now = get_timestamp()
-
-        if (now - LeftButtonPressedStartTime >= 1_000):
-            # Left button pressed and released for 1 seconds or more
-            mediaPlayer = VlcMediaListPlayer.get_media_player()
-            mediaPlayer.set_time(mediaPlayer.get_time() - 10_000) # Rewind 10s
+        if (ScrubTimer is not None):
+            ScrubTimer.cancel()
+            ScrubTimer = None
+        if (Scrubbing):
+            Scrubbing = False
+            Commands.post('scrub_end') # Carry on playing from where the scrub got to
         else:
-            VlcMediaListPlayer.pause() # Pause/Resume playback
+            Trace.trace('action', name='pause')
+            Commands.post('pause') # Pause/Resume playback
+
+# Called 1 second after the left button was pressed and then every SCRUB_INTERVAL milliseconds
+# until it is released: jump back (or forward) to a keyframe, further each time
+def scrub_tick():
+    global ScrubTimer, Scrubbing
+
+    if (ScrubTimer is None):
+        return # Released in the meantime
+    Scrubbing = True
+    Commands.post('scrub')
+    ScrubTimer = threading.Timer(SCRUB_INTERVAL / 1_000, scrub_tick)
+    ScrubTimer.daemon = True
+    ScrubTimer.start()
 
 SHUTDOWN_SIGNAL_GPIO  = 11
 RIGHT_VCR_BUTTON_GPIO = 25
@@ -129,14 +501,173 @@ LEFT_VCR_BUTTON_GPIO  = 26
 
 RightButtonPressedStartTime = 0
 LeftButtonPressedStartTime = 0
+PendingStartTime = None
+Videos = None
+StartingVideo = None # Path of the video played before the library has loaded (fast start)
+ShownPath = None # Path of the video the last picture was from
+Slots = [] # Index in Videos of the video in each item of VlcMediaList
+WindowLock = threading.Lock()
+Selected = None # (video index, tune) selected with the right button, waiting for SelectTimer
+ScrubTimer = None # Repeats scrub_tick() while the left button is held
+Scrubbing = False # The left button has been held long enough to rewind
+Watcher = None
+SpareInstance = None # Future of a new VLC instance loading in the background after a video failed
+SelectTimer = None
+SelectLock = threading.Lock()
 
-Videos = VideoSelector('/home/pi/simpsonstv/videos/', '.mkv')
-VlcInstance = vlc.Instance(['--quiet'])
-VlcMediaListPlayer = vlc.MediaListPlayer()
-VlcMediaList = VlcInstance.media_list_new(Videos.get_videos())
-VlcMediaListPlayer.set_media_list(VlcMediaList)
+VIDEO_ROOT = '/home/pi/simpsonstv/videos/'
+VIDEO_FILE_EXTENSIONS = ('.mkv', '.mp4')
+
+# The video to start with before the whole library is known: the one that was playing before
+# the last shutdown, if it's still there and playable, otherwise the first video of the first channel.
+# Returns (video path, path of the file to play, position to resume from) or None.
+def find_first_video(video_root):
+    if (Journal.episode is not None and os.path.isfile(Journal.episode)
+            and os.path.dirname(os.path.dirname(Journal.episode)) == os.path.normpath(video_root)):
+        channel, video = os.path.basename(os.path.dirname(Journal.episode)), os.path.basename(Journal.episode)
+        playablePath = Library.get_playable_path(channel, video)
+        if (not Blocked.is_blocked(playablePath)):
+            return Journal.episode, playablePath, Journal.position
+    first = Library.find_first_video()
+    if (first is None):
+        return None
+    channel, video = first
+    return os.path.join(video_root, channel, video), Library.get_playable_path(channel, video), 0
+
+# Build the playlist from the whole library (scanning the video tree if there is no index yet)
+# and fill VlcMediaList with the window around the playing video.  If a video is already
+# playing (fast start) it stays the first item and the rest of the window is appended after it
+# without interrupting it.
+def load_playlist(video_root, playing=None):
+    global Videos, Watcher
+
+    if (not Library.is_loaded()):
+        Library.reconcile()
+    videos = VideoSelector(video_root, VIDEO_FILE_EXTENSIONS, Library)
+    start = videos.find(playing) if playing is not None else -1
+    with WindowLock:
+        if (playing is not None):
+            Slots[0] = start # -1 if the video disappeared while the library loaded
+        Videos = videos
+        fill_window(max(start, 0), 0)
+    VlcMediaListPlayer.set_playback_mode(vlc.PlaybackMode.loop) # Go round the ring of items
+    if (playing is not None and start < 0):
+        Commands.call(play_video, 0)
+    log.info("Playlist loaded: %d videos in %d channels", len(videos), len(videos.get_channels()))
+    Watcher = LibraryWatcher(Library, reload_playlist).start() # Pick up videos added or removed from now on
+
+# Swap in a new playlist after videos were added or removed (called on the library watcher's
+# thread).  The playing video carries on undisturbed; the items around it are refilled from the
+# new playlist.  If the playing video itself was removed it plays to the end and is followed by
+# the first of the videos after it that is still there.
+def reload_playlist():
+    global Videos, Selected
+
+    if (Library.find_first_video() is None):
+        log.warning("The library has no videos left: keeping the old playlist")
+        return
+    videos = VideoSelector(Library.get_video_root(), VIDEO_FILE_EXTENSIONS, Library)
+    with WindowLock:
+        old_paths = [Videos.get_video(video_index) if video_index >= 0 else None for video_index in Slots]
+        for slot, path in enumerate(old_paths):
+            Slots[slot] = videos.find(path) if path is not None else -1
+        with SelectLock:
+            if (Selected is not None):
+                video_index = videos.find(Videos.get_video(Selected[0]))
+                Selected = (video_index if video_index >= 0 else min(Selected[0], len(videos) - 1), Selected[1])
+        Videos = videos
+        playing = get_current_slot()
+        if (playing >= 0):
+            # Centre the window on the playing video or, if it was removed, have the nearest video
+            # after it that is still there follow it (the playing item itself is never replaced)
+            if (Slots[playing] >= 0):
+                fill_window(Slots[playing], playing)
+            else:
+                following = [Slots[(playing + step) % len(Slots)] for step in range(1, len(Slots))]
+                fill_window(next((video_index for video_index in following if video_index >= 0), 0),
+                            (playing + 1) % window_size())
+    if (BROADCAST_MODE):
+        for channelIndex in range(len(videos.get_channels())):
+            Durations.probe_in_background(videos.get_channel_entries(channelIndex))
+    log.info("Playlist reloaded: %d videos in %d channels", len(videos), len(videos.get_channels()))
+
+# Set up the GPIO, the video library and VLC and start playing.  Nothing happens on import, so
+# bench.py can load this script against the simulated backends.
+def start(video_root=VIDEO_ROOT):
+    global Library, VlcInstance, VlcMediaListPlayer, VlcMediaList, Durations, Broadcast, Journal
+    global PendingStartTime, StartingVideo, Trace, Latency, OSD, Keyframes, Scrub, Governor, Commands
+    global Blocked, Supervisor
+
+    startTime = process_start_time()
+    instanceFuture = create_instance_in_background('--quiet') # Load VLC's plugins while the library loads
+    logging.basicConfig(filename=os.path.join(os.path.dirname(os.path.normpath(video_root)), 'player.log'),
+                        level=logging.INFO, format='%(asctime)s %(name)s: %(message)s') # The console is the screen
+
+    OSD = open_osd(OSD_DEVICE) # On screen display for the channel and title of a selected video
+    OSD.clear()
+
+    # Ring buffer of input and playback events: kill -USR1 <pid> writes it to
+    # ~/simpsonstv/trace.jsonl and "python3 metrics.py" reads it from ~/simpsonstv/trace.sock
+    Trace = Tracer()
+    Trace.dump_on_signal(default_trace_path(video_root))
+    Trace.serve(default_socket_path(video_root))
+
+    Journal = ResumeJournal(default_journal_path(video_root)).load()
+    Library = LibraryIndex(video_root, VIDEO_FILE_EXTENSIONS).load(scan=False)
+    Blocked = Blocklist(default_blocklist_path(video_root)).load() # Videos that keep failing to play are skipped
+    VlcInstance = instanceFuture.result()
+    create_player()
+    Durations = DurationCache(VlcInstance, default_cache_path(video_root)).load()
+    Broadcast = BroadcastSchedule(Durations)
+
+    Trace.attach(VlcMediaListPlayer.get_media_player())
+    Latency = SwitchLatency() # Logs the time to the first frame of each video to ~/simpsonstv/player.log
+    Latency.attach(VlcMediaListPlayer.get_media_player())
+    Latency.mark(STARTUP, startTime)
+    Keyframes = KeyframeCache(default_keyframes_path(video_root)) # Keyframe times of each video, for scrubbing
+    Scrub = Scrubber(VlcMediaListPlayer.get_media_player(), Keyframes, tracer=Trace)
+    # Lighter copies of the videos while the Pi drops frames (e.g. throttled when hot)
+    Governor = RenditionGovernor(VlcMediaListPlayer.get_media_player(), current_renditions,
+                                 lambda rendition: Commands.post('rendition', rendition), tracer=Trace)
+    # VLC is driven from one thread, by commands from the buttons, timers and VLC's events; bursts
+    # of presses are merged while a video loads
+    Commands = CommandQueue(tracer=Trace)
+    Commands.register('next', next_video, SUM)
+    Commands.register('next_channel', next_channel, SUM)
+    Commands.register('pause', toggle_pause, TOGGLE)
+    Commands.register('scrub', scrub, SUM)
+    Commands.register('reverse', lambda amount: Scrub.reverse(), TOGGLE)
+    Commands.register('scrub_end', lambda amount: Scrub.end())
+    Commands.register('rendition', switch_rendition, LATEST)
+    Commands.register('window', move_window, LATEST)
+    Commands.start()
+    # Skips videos that fail to play and restarts VLC if it is stuck
+    Supervisor = PlaybackSupervisor(VlcMediaListPlayer.get_media_player(), video_failed, vlc_failed, Blocked,
+                                    tracer=Trace)
+    first = None if BROADCAST_MODE else find_first_video(video_root)
+    if (first is not None):
+        # Fast start: play (or resume) the first video straight away and load the rest of the
+        # library into the playlist in the background
+        path, playablePath, position = first
+        StartingVideo = path
+        Slots.append(0) # Until the library has loaded and the video's real index is known
+        media = VlcInstance.media_new_path(playablePath)
+        VlcMediaList.add_media(media)
+        media.release()
+        if (position > 0):
+            PendingStartTime = (position, None)
+        VlcMediaListPlayer.play_item_at_index(0)
+        threading.Thread(target=load_playlist, args=(video_root, path), name='playlist-load', daemon=True).start()
+    else:
+        load_playlist(video_root)
+        if (BROADCAST_MODE):
+            # Probe any new videos once, in the background, then join the first channel "live"
+            for channelIndex in range(len(Videos.get_channels())):
+                Durations.probe_in_background(Videos.get_channel_entries(channelIndex))
+            play_video(tune_in(0))
+        else:
+            VlcMediaListPlayer.play()
 
-if __name__ == '__main__':
     GPIO.setmode(GPIO.BCM)
 
     # Setup shutdown button callback
@@ -154,7 +685,12 @@ if __name__ == '__main__':
     GPIO.add_event_detect(LEFT_VCR_BUTTON_GPIO, GPIO.BOTH, 
             callback=left_vcr_button_callback, bouncetime=30)
 
-    VlcMediaListPlayer.play()
+    Journal.start(sample_player) # Save the playing position every couple of minutes
+    Governor.start() # Sample dropped frames, CPU frequency and temperature every few seconds
+    Supervisor.start() # Check every half second that the video is playing
+
+if __name__ == '__main__':
+    start()
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.pause()
\ No newline at end of file
@@ -1,6 +1,6 @@
 ######################################################################################
 # player.py
-# Version:   1.1
+# Version:   1.2
 # Author:    D. Mratovich
 # Original author:
 #            D.J. Hatfield
@@ -21,9 +21,10 @@
 #                  are specified in the "Directories" string array)
 #             Left Button (GPIO 26):
 #                -Quckly tap the button to pause or play the current video
-#                -Press and hold the button for > 1 second to rewind current video by 10 seconds
-#                 (continue holding to keep rewinding additional 10 seconds every second the button
-#                  is pressed)
+#                -Press and hold the button for > 1 second to rewind the current video, faster the longer
+#                 the button is held.  Tap the Right button while rewinding to fast forward instead (and
+#                 again to go back to rewinding).  Every jump lands on a keyframe (see scrub.py) so the
+#                 picture keeps up.
 #             Press and hold BOTH the Right and Left buttons for > 5 seconds to stop the
 #             VLC player and exit this Python script and return to a command prompt.  NOTE: once
 #             this Python script is terminated, the safe shutdown functionality will not work.
@@ -33,50 +34,267 @@
 #
 #             Additionally, this script monitors the Shutdown input (GPIO 11).  If this pin
 #             is asserted (active LOW) for > 50ms, the Pi will be Shut down.
+#
+#             The list of videos in each channel comes from a library index cached in
+#             ~/simpsonstv/library.json (see library.py) so the video directories aren't rescanned
+#             at every boot.  Videos added or removed while the script runs are picked up in the
+#             background (see watcher.py) without interrupting the video that is playing.
+#
+#             While a video plays, the next video in the channel is opened and parsed in the background
+#             (see media.py) so it starts quickly.  When a video finishes the next one starts straight
+#             away; the time from the end of a video (or the button release) to the first frame of the
+#             next one is logged to ~/simpsonstv/player.log.  The VLC Media objects belong to a small
+#             pool that releases each one as soon as it is done with, so memory doesn't creep up over
+#             weeks of playing.
+#
+#             The channel, video and position are saved every couple of minutes and at shutdown (see
+#             journal.py), and playback resumes from there at the next startup.
+#
+#             If transcode.py has made a Pi friendly copy of a video, the copy is played instead.  If the
+#             Pi starts dropping frames (e.g. throttled when it gets hot) and there are lighter copies, the
+#             video carries on from a lighter one until the Pi keeps up again (see governor.py).
+#
+#             In BROADCAST_MODE each channel plays like a live TV channel anchored to the time of day.
+#             Video durations are probed once in the background and cached in
+#             ~/simpsonstv/durations.json (see broadcast.py).
+#
+#             Every button edge, debounce decision, player action and video switch (with VLC's decoded
+#             and lost picture counts) is kept in a small in-memory trace (see metrics.py).  Send the
+#             script SIGUSR1 to write it to ~/simpsonstv/trace.jsonl, or run "python3 metrics.py".
+#
+#             The channel and video title are drawn straight on the framebuffer by osd.py (or on the console if
+#             there is no framebuffer), without running "clear" in a shell for every selection.
+#
+#             If a video can't be played (VLC reports an error, it never starts or its picture freezes) the
+#             next one is played instead, and if VLC itself is stuck a new VLC is started in this script
+#             without rescanning the library (see supervisor.py).  Videos that keep failing are skipped,
+#             listed in ~/simpsonstv/blocklist.json.
+#
+#             The GPIO and VLC modules come from backends.py.  Run with SIMPSONSTV_BACKEND=sim to use the
+#             simulated hardware from simulation.py instead (see bench.py).
+#
+#             The buttons are handled by the event driven input engine in vcr_input.py (copy it
+#             next to this script).  The script sleeps until a GPIO edge or a debounce/hold timer
+#             is due instead of polling the inputs in a tight loop.
 ###########################################################################################
 
-import vlc
 from pathlib import Path
+import bisect
 import os
-import RPi.GPIO as GPIO
+import logging
 #import time as time_ - makes sure we don't override time
 import time as time_
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(26, GPIO.IN, pull_up_down=GPIO.PUD_UP) #Set GPIO 26 as input with pull-up
-GPIO.setup(25, GPIO.IN, pull_up_down=GPIO.PUD_UP) #Set GPIO 25 as input with pull-up
-GPIO.setup(11, GPIO.IN, pull_up_down=GPIO.PUD_UP) #Set GPIO 11 as input with pull-up
+from backends import GPIO, vlc   #RPi.GPIO and python-vlc (or stand-ins when SIMPSONSTV_BACKEND=sim)
+from vcr_input import InputEngine, VcrButton, ButtonCombo, Hold
+from library import LibraryIndex
+from watcher import LibraryWatcher
+from media import MediaPool, SwitchLatency, STARTUP, create_instance_in_background
+from broadcast import BroadcastSchedule, DurationCache, default_cache_path
+from journal import ResumeJournal, default_journal_path
+from osd import open_osd
+from metrics import Tracer, default_socket_path, default_trace_path, process_start_time
+from scrub import KeyframeCache, Scrubber, SCRUB_INTERVAL, default_keyframes_path, media_path
+from governor import RenditionGovernor
+from supervisor import Blocklist, PlaybackSupervisor, default_blocklist_path, release_in_background
+
+log = logging.getLogger('player')
 
 # Add/change your video subdirectories in the Directories string array
 # These are the "Channels"
 Directories = ["The Simpsons"]
+Root_Path = "/home/pi/simpsonstv/videos/"  #Path to this application's video channels(subdirectories)
+OSD_DEVICE = "/dev/fb0"  #Framebuffer the channel and video title are drawn on ("" to print them on the console)
+
+# Set BROADCAST_MODE to True to make every channel behave like a live TV channel: switching to a channel
+# joins the episode that is "airing" right now (based on the time of day) part way through, instead of
+# starting the first episode from the beginning.
+BROADCAST_MODE = False
 
 #     <<<ROUTINES>>>
 #-----------------------------------------------------------------------------------------------------------------
-# millis(): Returns the number of milliseconds elapsed since power up.
-def millis():
-    return int(round(time_.time() * 1000))
-#-----------------------------------------------------------------------------------------------------------------
-# displayDirectoryVideo():  Displays the currently selected Video and Channel on the LCD
+# displayDirectoryVideo():  Displays the currently selected Video and Channel on the LCD and plays it after
+#                           playDelay milliseconds
 #                           Returns nothing
-def displayDirectoryVideo():
+def displayDirectoryVideo(playDelay=1500):
     #Must specify "global" variables - otherwise, the routine would create its own unique copy
     # of these variables when they are used.
     global Root_Path
     global Current_Directory
     global Current_Video
     global VIDEO_PATH
-    global PlayTimer
-    global playNew
-    os.system("clear")  #clear the LCD screen
+    global Video_Pointer
+    global Start_Time
+    pointer = playableVideo(Video_Pointer)  #Step over videos that keep failing to play
+    if (pointer != Video_Pointer):
+      Video_Pointer = pointer
+      Start_Time = None    #The start time was for the video stepped over
     Current_Video = videos[Video_Pointer]  #Set current video to that specified by the Video_Pointer
     VIDEO_PATH = Path(Root_Path + Current_Directory + "/" + Current_Video)
-    print("")
-    print("")
-    print("")
-    print("  Channel: " + Current_Directory)  #Print the "Channel" (directory) on the LCD screen
-    print("  " + Current_Video[0:len(Current_Video)-4])  #Print the video selected on the LCD screen
-    PlayTimer = millis()
-    playNew = True  #Trigger starting the play of the new video in 1.5 seconds
+    OSD.show(["Channel: " + Current_Directory,         #Draw the "Channel" (directory) and the video selected
+              Current_Video[0:len(Current_Video)-4]])  # on the LCD screen
+    schedulePlay(playDelay)  #Trigger starting the play of the new video in 1.5 seconds
+#-----------------------------------------------------------------------------------------------------------------
+# schedulePlay(): Play the selected video 1.5 seconds (or delay milliseconds) from now.  This allows enough time
+#                 for a user to read the channel (directory) and new video selected on the screen.  Calling it
+#                 again restarts the delay.  While the right button is held the delay only starts once it is
+#                 released.
+#                 Returns nothing
+def schedulePlay(delay=1500):
+    global PlayTimer
+    global playNew
+    if (PlayTimer is not None):
+      PlayTimer.cancel()   #Cancel any previously scheduled play
+      PlayTimer = None
+    playNew = True
+    if (RightButton.is_pressed()):
+      return
+    if (delay <= 0):
+      playSelected()       #Automatic advance - no need to wait for the user to read the screen
+    else:
+      PlayTimer = Input.call_later(delay, playSelected)
+#-----------------------------------------------------------------------------------------------------------------
+# playSelected(): Start playing the video specified by the video path.  Called by the PlayTimer.
+#                 Returns nothing
+def playSelected():
+    global media
+    global playNew
+    global manualSelect
+    global PlayTimer
+    media = Pool.take(playablePath(Current_Video))  #Use the pre-parsed media if this video was prefetched.  The pool
+                                                    # owns it and releases the previous one (no Media is leaked)
+    resumeVideo()
+    applyStartTime(media)
+    Trace.set_media(media, VIDEO_PATH)
+    player.set_media(media)
+    player.play()
+    Keyframes.index_in_background(playablePath(Current_Video))  #For scrubbing
+    PlayTimer = None
+    playNew = False                #Reset the playNew flag
+    manualSelect = False           #Reset the manualSelect flag (indicates automatic play unless changed by user)
+    prefetchNextVideo()
+#-----------------------------------------------------------------------------------------------------------------
+# prefetchNextVideo(): Have VLC open and parse the next video in the current channel while this one plays, so
+#                      it starts quickly when it is selected or the current video ends.
+#                      Returns nothing
+def prefetchNextVideo():
+    nextPointer = Video_Pointer + 1
+    if(nextPointer > (len(videos)-1)):
+      nextPointer = 0
+    nextPointer = playableVideo(nextPointer)
+    Pool.prefetch(playablePath(videos[nextPointer]))
+#-----------------------------------------------------------------------------------------------------------------
+# playablePath(): The file to play for a video in the current channel: its Pi friendly copy if there is one, or a
+#                 lighter copy while the rendition governor (governor.py) finds the Pi can't keep up
+#                 Returns the path
+def playablePath(video):
+    return Governor.choose(Library.get_renditions(Current_Directory, video))
+#-----------------------------------------------------------------------------------------------------------------
+# playableVideo(): The first video from pointer on (looping around) that isn't on the blocklist of videos that
+#                  keep failing to play (supervisor.py).  If every video is, pointer itself.
+#                  Returns the video pointer
+def playableVideo(pointer):
+    for step in range(len(videos)):
+      candidate = (pointer + step) % len(videos)
+      if (not Blocked.is_blocked(playablePath(videos[candidate]))):
+        return candidate
+    return pointer % len(videos)
+#-----------------------------------------------------------------------------------------------------------------
+# currentRenditions(): The files the current video can be played from, for the rendition governor
+#                      Returns the list of paths, heaviest first
+def currentRenditions():
+    return Library.get_renditions(Current_Directory, Current_Video)
+#-----------------------------------------------------------------------------------------------------------------
+# renditionChanged(): Called by the rendition governor (on its own thread) when the Pi can't keep up with the
+#                     video playing, or can again.  The switch is made on the input engine thread.
+#                     Returns nothing
+def renditionChanged(rendition):
+    Input.call_soon(switchRendition)
+#-----------------------------------------------------------------------------------------------------------------
+# switchRendition(): Carry on playing the current video, from the same position, from the file the rendition
+#                    governor now chooses.  A selection waiting to play will use it anyway.
+#                    Returns nothing
+def switchRendition():
+    global media
+    global Start_Time
+    global Tune_Time
+    path = playablePath(Current_Video)
+    if (playNew == True or player.get_state() != vlc.State.Playing or media_path(media) == path):
+      return
+    Trace.trace('action', name='switchRendition')
+    Start_Time = player.get_time()  #Same position in the new file
+    Tune_Time = time_.time()
+    media = Pool.take(path)
+    applyStartTime(media)
+    Trace.set_media(media, VIDEO_PATH)
+    player.set_media(media)
+    player.play()
+    Keyframes.index_in_background(path)
+    prefetchNextVideo()   #The next video at the new rendition too
+#-----------------------------------------------------------------------------------------------------------------
+# videoFailed(): Called by the playback supervisor (on its own thread) when the video playing failed: VLC reported
+#                an error, it didn't start or its picture froze.  The next video is played on the input engine thread.
+#                Returns nothing
+def videoFailed(reason):
+    Input.call_soon(skipVideo)
+#-----------------------------------------------------------------------------------------------------------------
+# skipVideo(): Play the next video straight away in place of the one that failed (unless the user has already
+#              selected another).  A new VLC instance starts loading in the background in case VLC itself is
+#              stuck and has to be restarted.
+#              Returns nothing
+def skipVideo():
+    global Video_Pointer
+    global Spare_Instance
+    if (Spare_Instance is None):
+      Spare_Instance = create_instance_in_background()
+    if (playNew == True):
+      return
+    Trace.trace('action', name='skipVideo')
+    Video_Pointer += 1
+    if(Video_Pointer > (len(videos)-1)):
+      Video_Pointer = 0
+    displayDirectoryVideo(0)
+#-----------------------------------------------------------------------------------------------------------------
+# vlcFailed(): Called by the playback supervisor (on its own thread) when playing the next video failed too, so
+#              VLC itself is probably stuck.  VLC is restarted on the input engine thread.
+#              Returns nothing
+def vlcFailed(reason):
+    Input.call_soon(restartVlc)
+#-----------------------------------------------------------------------------------------------------------------
+# restartVlc(): Replace the VLC instance and media player with new ones, without restarting this script (the
+#               library, journal and trace are kept), and try the video that failed again on them.  The old VLC is
+#               released in the background in case it never returns.
+#               Returns nothing
+def restartVlc():
+    global instance
+    global player
+    global Pool
+    global Spare_Instance
+    global Video_Pointer
+    Trace.trace('action', name='restartVlc')
+    started = time_.monotonic()
+    oldInstance, oldPlayer, oldPool = instance, player, Pool
+    instance = (Spare_Instance or create_instance_in_background()).result()  #Usually loaded while skipping
+    Spare_Instance = None
+    player = instance.media_player_new()
+    Pool = MediaPool(instance)
+    attachPlayer()
+    Durations.set_instance(instance)
+    release_in_background(oldPool, oldPlayer, oldInstance)
+    log.info("Restarted VLC in %.0f ms", (time_.monotonic() - started) * 1000)
+    if (playNew == True):
+      return               #The PlayTimer will play the selection on the new player
+    Video_Pointer = currentVideoPointer()  #Video_Pointer is one before the insertion point if it was removed
+    displayDirectoryVideo(0) #Only the video before it is blamed: it may well play on the new VLC
+#-----------------------------------------------------------------------------------------------------------------
+# attachPlayer(): Listen to the VLC media player's events: the first one, or a new one after VLC was restarted
+#                 Returns nothing
+def attachPlayer():
+    player.event_manager().event_attach(vlc.EventType.MediaPlayerEndReached, autoPlayNext)
+    Trace.attach(player)
+    Latency.attach(player)
+    Scrub.attach(player)
+    Governor.attach(player)
+    Supervisor.attach(player)
 #-----------------------------------------------------------------------------------------------------------------
 # nextVideo(): Select the next video by incrementing the Video_Pointer;  Loops around once the end is reached
 #              Returns nothing
@@ -87,7 +305,9 @@ def nextVideo():
     global videos
     global manualSelect
     global player
+    Trace.trace('action', name='nextVideo')
     manualSelect = True  #Set the flag to indicate the next video was manually selected
+    rememberPosition()   #So this video can be resumed later
     player.stop()        #Stop the currently playing video
     Video_Pointer += 1   # Increment Video_Pointer
     if(Video_Pointer > (len(videos)-1)):
@@ -96,18 +316,47 @@ def nextVideo():
 
 #-----------------------------------------------------------------------------------------------------------------
 # getVideos(): Update the videos string array with a list of videos in the currently selected channel (directory)
+#              The list comes from the library index (library.py) so the directory isn't rescanned on every
+#              channel switch.
 #              Returns nothing
 def getVideos():
     #Must specify "global" variables - otherwise, the routine would create its own unique copy
     # of these variables when they are used.
     global videos
     global Current_Directory
-    global Root_Path
-    videos = []  #Clear out the videos string array
-    for file in os.listdir(Root_Path + Current_Directory):  #Cycle through all files in the current directory and
-        if file.lower().endswith('.mkv'):                   #add to videos string array if it is an mkv video file
-            videos.append(file)
-    videos.sort() #Rearrange the videos in the videos array in alpha-numerical order
+    videos = Library.get_videos(Current_Directory)  #Sorted (alpha-numerical order) list of mkv/mp4 video files
+
+#-----------------------------------------------------------------------------------------------------------------
+# libraryChanged(): Called by the library watcher (on its own thread) after videos were added or removed.  The
+#                   videos string array is refreshed on the input engine thread, like every other player command.
+#                   Returns nothing
+def libraryChanged():
+    Input.call_soon(refreshVideos)
+
+#-----------------------------------------------------------------------------------------------------------------
+# refreshVideos(): Re-read the videos in the current channel and keep Video_Pointer on the current video, so the
+#                  video playing carries on undisturbed and the next one is the right one.
+#                  Returns nothing
+def refreshVideos():
+    global Video_Pointer
+    global videos
+    newVideos = Library.get_videos(Current_Directory)
+    if (len(newVideos) == 0):
+      return             #The channel was emptied or removed - keep the old list so there is still something to select
+    videos = newVideos
+    Video_Pointer = bisect.bisect_left(videos, Current_Video)  #Where the current video is, or would be if removed
+    if (Video_Pointer >= len(videos) or videos[Video_Pointer] != Current_Video):
+      Video_Pointer -= 1 #The current video was removed - the next video is the one after where it was (-1 if it
+                         # was the first: use currentVideoPointer() to play the current video itself)
+    prefetchNextVideo()  #The next video may have changed
+
+#-----------------------------------------------------------------------------------------------------------------
+# currentVideoPointer(): The pointer of the current video in the videos string array or, if it has been removed,
+#                        of the video that was after it (looping around)
+#                        Returns the video pointer
+def currentVideoPointer():
+    pointer = bisect.bisect_left(videos, Current_Video)  #The insertion point if it was removed
+    return pointer % len(videos)
 
 #-----------------------------------------------------------------------------------------------------------------
 # switchDirectory(): Select the next channel (directory) in the Directories string array - also point to the first
@@ -124,7 +373,9 @@ def switchDirectory():
     global instance
     global media
     global player
+    Trace.trace('action', name='switchDirectory')
     manualSelect=True   #Set the flag to indicate the next video was manually selected
+    rememberPosition()  #So this video can be resumed later
     player.stop()       #Stop the currently playing video
     Video_Pointer = 0   #Set video pointer to the first video in the newly specified channel
     Directory_Pointer +=1 #Increment the Channel Pointer
@@ -132,15 +383,84 @@ def switchDirectory():
       Directory_Pointer = 0  #Loop the Channel pointer back around once end of channels is reached
     Current_Directory = Directories[Directory_Pointer]  #Set current channel specified by the Directory_Pointer
     getVideos()         #Identify all videos in the newly specified channel (directory)
+    if (BROADCAST_MODE == True):
+      tuneIn()          #Join the episode "airing" now on this channel
     displayDirectoryVideo()  #Display Channel and Selected Video on the LCD screen
 #-----------------------------------------------------------------------------------------------------------------
+# channelEntries(): (path, modification time) of each video in the current channel, used to look up durations
+#                   Returns the list
+def channelEntries(directory=None):
+    directory = directory or Current_Directory
+    entries = []
+    for video in Library.get_videos(directory):
+      entries.append((Root_Path + directory + "/" + video, Library.get_video_info(directory, video)[1]))
+    return entries
+#-----------------------------------------------------------------------------------------------------------------
+# tuneIn(): Broadcast mode - point Video_Pointer at the episode airing now on the current channel and remember how
+#           far into it we are.  Start_Time is applied when the video is played.
+#           Returns nothing
+def tuneIn():
+    global Video_Pointer
+    global Start_Time
+    global Tune_Time
+    Video_Pointer, Start_Time = Broadcast.tune(Current_Directory, channelEntries())
+    Tune_Time = time_.time()
+#-----------------------------------------------------------------------------------------------------------------
+# resumeVideo(): Continue the selected video from where it was last stopped (unless in broadcast mode, where the
+#                channel's "live" position is used instead).  The position is applied by applyStartTime().
+#                Returns nothing
+def resumeVideo():
+    global Start_Time
+    global Tune_Time
+    if (BROADCAST_MODE == True or Start_Time is not None):
+      return
+    position = Journal.get_position(str(VIDEO_PATH))
+    if (position > 0):
+      Start_Time = position
+      Tune_Time = time_.time()
+#-----------------------------------------------------------------------------------------------------------------
+# samplePlayer(): Called by the resume journal every couple of minutes (on its own thread)
+#                 Returns (channel, video path, position in mS), or None if no video is playing
+def samplePlayer():
+    position = player.get_time()
+    if (playNew == True or position < 0):
+      return None
+    return (Current_Directory, str(VIDEO_PATH), position)
+#-----------------------------------------------------------------------------------------------------------------
+# rememberPosition(): Record the position of the playing video in the resume journal (in memory only - it is
+#                     written to the SD card with the next periodic flush)
+#                     Returns nothing
+def rememberPosition():
+    state = samplePlayer()
+    if (state is not None):
+      Journal.update(*state)
+#-----------------------------------------------------------------------------------------------------------------
+# applyStartTime(): Start the media at the offset found by tuneIn() (allowing for the time that passed while the
+#                   channel was displayed) or resumeVideo().
+#                   Returns nothing
+def applyStartTime(media):
+    global Start_Time
+    if (Start_Time is None):
+      return
+    offset = Start_Time + (time_.time() - Tune_Time) * 1000
+    media.add_option(":start-time=%.3f" % (offset / 1000))
+    Start_Time = None
+#-----------------------------------------------------------------------------------------------------------------
 # autoPlayNext(): A callback executed when the VLC media player reaches the end of a video. It automatically
 #                 starts playing the next video in the current channel if the last video played to completion.  It
 #                 will not try to play a video if VLC was shutdown by the user manually (i.e. selecting through
 #                 videos for the next video).
-#                 In the case of a manual video selection, the video will be played in the main loop.
+#                 In the case of a manual video selection, the video will be played by the PlayTimer.
+#                 VLC calls this from its own event thread, so the work is handed over to the input engine
+#                 thread where all other player commands run.  The next video is played straight away.
 #                 Returns nothing
 def autoPlayNext(code):
+   Trace.trace('action', name='autoPlayNext')
+   Latency.mark("end of media")
+   Journal.finished(str(VIDEO_PATH))  #Played to the end - start from the beginning next time
+   Input.call_soon(autoPlayNextVideo)
+
+def autoPlayNextVideo():
    #Must specify "global" variables - otherwise, the routine would create its own unique copy
    # of these variables when they are used.
    global Video_Pointer
@@ -149,154 +469,167 @@ def autoPlayNext(code):
    global Video_Pointer
    if (manualSelect == True):  #If this routine was entered by the user manually selecting the next video,
      manualSelect = False      # clear the manualSelect flag and,
-     return                    # return doing nothing else - the main loop will handle manual select operations
+     return                    # return doing nothing else - the PlayTimer will handle manual select operations
    Video_Pointer +=1 # If this routine was entered due to a video completing playback, increment the Video_Pointer
    if(Video_Pointer > (len(videos)-1)):  #Loop the video pointer back around once the end of videos is reached
      Video_Pointer = 0
-   displayDirectoryVideo()     #Display Channel and Selected Video on the LCD screen
+   displayDirectoryVideo(0)    #Display Channel and Selected Video on the LCD screen and play it now
+
+#-----------------------------------------------------------------------------------------------------------------
+#     <<<BUTTON HANDLERS>>>     Called by the input engine (vcr_input.py) on its thread
+#-----------------------------------------------------------------------------------------------------------------
+# rightButtonPressed(): Right button (GPIO 25) held active (LOW) for 100mS - select next video, or switch between
+#                      rewinding and fast forwarding while the left button is held
+def rightButtonPressed():
+    if (Scrub.is_active()):
+      Scrub.reverse()
+      return
+    nextVideo()
+#-----------------------------------------------------------------------------------------------------------------
+# rightButtonHeld(): Right button held for 2 seconds - select next channel (directory)
+def rightButtonHeld():
+    if (Scrub.is_active()):
+      return
+    switchDirectory()
+#-----------------------------------------------------------------------------------------------------------------
+# rightButtonReleased(): Right button released (HIGH for 50mS) - the new selection is played 1.5 seconds after
+#                        the button is released
+def rightButtonReleased(heldFor, holdsFired):
+    if (playNew == True):
+      Latency.mark("button release")
+      schedulePlay()
+#-----------------------------------------------------------------------------------------------------------------
+# leftButtonHeld(): Left button (GPIO 26) held for 1 second, then again every SCRUB_INTERVAL mS - jump back (or
+#                   forward) to a keyframe, further each time
+def leftButtonHeld():
+    try:                        #Implement exception handler (try: and except:) - prevents python script from
+                                # crashing if exception occurs during (try:) code
+      if (not Scrub.is_active()):
+        Trace.trace('action', name='rewind')
+        Scrub.begin(-1)         #Start rewinding
+      Scrub.step()
+    except Exception as e:      #Exception handler - executes if exception occurs during above try:
+      log.warning("Rewind failed: %s", e)  #  Exception code:logs it-just catches exception/prevents Python crash
+#-----------------------------------------------------------------------------------------------------------------
+# leftButtonReleased(): Left button released - toggle play/pause unless the press was a long (rewind) press
+def leftButtonReleased(heldFor, holdsFired):
+    if (holdsFired > 0):
+      Scrub.end()               #Carry on playing from where the rewind got to
+      return                    #Prevents executing a play/pause command after a long (rewind) press
+    Trace.trace('action', name='pause')
+    try:
+      player.pause()            #Toggle video play/pause
+    except Exception as e:
+      log.warning("Pause failed: %s", e)
+#-----------------------------------------------------------------------------------------------------------------
+# bothButtonsHeld(): BOTH VCR buttons pressed > 5 seconds - stop the VLC player and exit this Python script
+def bothButtonsHeld():
+    Journal.close()               #Save where we are
+    Supervisor.stop()             #Don't restart VLC as it is stopped
+    player.stop()                 #Stop down VLC player
+    Pool.close()                  #Release the VLC Media objects
+    print("Exiting Python script")
+    Input.stop()
+    quit()                        #Exit player.py Python script
+#-----------------------------------------------------------------------------------------------------------------
+# shutdownAsserted(): GPIO pin 11 active (LOW) for 50mS - safely shutdown the Pi
+def shutdownAsserted():
+    Journal.close()                 #Save where we are
+    OSD.show(["Shutting Down..."])  #Draw "Shutting Down..." message on the LCD screen
+    os.system("sudo shutdown -h now") #Shut down the Raspberry Pi - the safe shutdown circuit will monitor the
+                                      # status LED signal and remove power once activity ceases
 
 #--------------------------------------------------------------
-#     <<<INITIALIZATION>>>     Executed only once at script start
-os.system("clear")             #Clear the LCD screen
-Video_Pointer = 0              #Set Video Pointer to point to the first video file in the current channel
-oneShotNextVideo = False       #Controls incrementing video pointer only ONCE per right button press
-oneShotNextDirectory = False   #Controls incrementing directory pointer only ONCE per extended right button press
-manualSelect = False           #Indicates manual video select vs automatic selection of new video file
-PlayTimer = 0                  #Delays playing next video (allows user to read Channel/Video selection on LCD
-Root_Path = "/home/pi/simpsonstv/videos/"  #Path to this application's video channels(subdirectories)
-Directory_Pointer = 0          #Set Channel (directory) pointer to first entry
-Current_Directory = Directories[0] #Point current Channel to first directory in the Directories string array
-getVideos()                    #populate videos string array with all video files located in the current channel
-Current_Video = videos[0]      #Point current video to first video in the videos string array
-VIDEO_PATH = Path(Root_Path + Current_Directory + "/" + Current_Video) #Set video path
-instance = vlc.Instance()     #Create a new VLC instance
-media = instance.media_new_path(VIDEO_PATH)  #Start playing video specified by the video path
-player = instance.media_player_new()
-player.set_media(media)
-event_manager = player.event_manager()
-event_manager.event_attach(vlc.EventType.MediaPlayerEndReached, autoPlayNext)
-player.play()
-Button1Timer = millis()        #Used to debounce VCR right button for select next video indication
-Button2Timer = millis()        #Used to debounce VCR left button for select pause/play indication
-ShutDownTimer = millis()       #Used to debounce Shutdown signal from the safe shutdown circuit
-ExitPythonTimer = millis()     #Used to debounce the long press of BOTH left & right buttons to exit python script
-seekTimer = millis()           #Used to debounce left button rewind long press
-seekToggle = True              #Used to pulse a 10 second rewind for every second the left button is pressed
-playNew = False                #When true, triggers playing a new video 1.5 seconds after a new video selection.
-oneShotPlayPause = False       #Used to control executing a play or pause command only ONCE per left button press
-skipPause = False              #Prevents executing a play/pause command during long (rewind) press of left button
+#     <<<INITIALIZATION>>>     Executed only once at script start (nothing is done on import)
+def initialize():
+    global Video_Pointer, manualSelect, PlayTimer, playNew, Input, Directory_Pointer, Current_Directory
+    global Library, Journal, Start_Time, Tune_Time, instance, Durations, Broadcast, Current_Video, VIDEO_PATH
+    global media, player, Latency, Pool, RightButton, Trace, OSD, Watcher, Keyframes, Scrub, Governor
+    global Blocked, Supervisor, Spare_Instance
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(26, GPIO.IN, pull_up_down=GPIO.PUD_UP) #Set GPIO 26 as input with pull-up
+    GPIO.setup(25, GPIO.IN, pull_up_down=GPIO.PUD_UP) #Set GPIO 25 as input with pull-up
+    GPIO.setup(11, GPIO.IN, pull_up_down=GPIO.PUD_UP) #Set GPIO 11 as input with pull-up
+    OSD = open_osd(OSD_DEVICE)     #On screen display for the channel and video title
+    OSD.clear()                    #Clear the LCD screen
+    Video_Pointer = 0              #Set Video Pointer to point to the first video file in the current channel
+    manualSelect = False           #Indicates manual video select vs automatic selection of new video file
+    PlayTimer = None               #Delays playing next video (allows user to read Channel/Video selection on LCD
+    playNew = False                #True while a new video selection is waiting for the PlayTimer
+    Trace = Tracer()               #Ring buffer of input and playback events - dumped on SIGUSR1 or to the trace socket
+    Input = InputEngine(GPIO, tracer=Trace)  #Event driven input engine - sleeps until a GPIO edge or timer is due
+    logging.basicConfig(filename=os.path.join(os.path.dirname(os.path.normpath(Root_Path)), "player.log"), level=logging.INFO,
+                        format="%(asctime)s %(name)s: %(message)s")  #Log to a file - the console is the LCD screen
+    Directory_Pointer = 0          #Set Channel (directory) pointer to first entry
+    Current_Directory = Directories[0] #Point current Channel to first directory in the Directories string array
+    instanceFuture = create_instance_in_background()  #Load VLC's plugins while the library and journal load
+    Library = LibraryIndex(Root_Path, ('.mkv', '.mp4')).load(scan=False)  #Load the cached library index.  On first run
+                                   # only the channels that are played are scanned now; the rest are scanned in the background
+    Journal = ResumeJournal(default_journal_path(Root_Path)).load()  #What was playing before the last shutdown
+    if (Journal.channel in Directories):
+      Directory_Pointer = Directories.index(Journal.channel)  #Resume on the channel that was last playing
+      Current_Directory = Journal.channel
+    getVideos()                    #populate videos string array with all video files located in the current channel
+    Blocked = Blocklist(default_blocklist_path(Root_Path)).load()  #Videos that keep failing to play are skipped
+    Start_Time = None              #Offset (mS) into the selected video to start playing at (broadcast mode or resume)
+    Tune_Time = 0                  #When Start_Time was worked out
+    if (BROADCAST_MODE == False and Journal.episode is not None
+        and os.path.basename(Journal.episode) in videos and os.path.dirname(Journal.episode) == Root_Path + Current_Directory):
+      Video_Pointer = videos.index(os.path.basename(Journal.episode))  #Resume the video that was last playing
+      Start_Time = Journal.position
+      Tune_Time = time_.time()
+    instance = instanceFuture.result()  #The new VLC instance
+    Durations = DurationCache(instance, default_cache_path(Root_Path)).load()  #Cached durations of the videos
+    Broadcast = BroadcastSchedule(Durations)
+    if (BROADCAST_MODE == True):
+      for directory in Directories:
+        Durations.probe_in_background(channelEntries(directory))  #Probe any new videos once, in the background
+      tuneIn()
+    player = instance.media_player_new()
+    Spare_Instance = None          #A new VLC instance loading in the background after a video failed
+    Governor = RenditionGovernor(player, currentRenditions, renditionChanged, tracer=Trace)  #Lighter copies while
+                                   # the Pi drops frames (e.g. throttled when hot), back again once it keeps up
+    if (playableVideo(Video_Pointer) != Video_Pointer):
+      Video_Pointer = playableVideo(Video_Pointer)  #Step over videos that keep failing to play
+      Start_Time = None
+    Current_Video = videos[Video_Pointer]  #Point current video to the selected video in the videos string array
+    VIDEO_PATH = Path(Root_Path + Current_Directory + "/" + Current_Video) #Set video path
+    Pool = MediaPool(instance)     #Owns the Media playing and the next video's, opened and parsed in the background
+    media = Pool.take(playablePath(Current_Video))  #Start playing video
+    applyStartTime(media)
+    Trace.attach(player)
+    Trace.set_media(media, VIDEO_PATH)
+    player.set_media(media)
+    event_manager = player.event_manager()
+    event_manager.event_attach(vlc.EventType.MediaPlayerEndReached, autoPlayNext)
+    Latency = SwitchLatency()      #Logs the time from end of video/button release to the first frame of the next video
+    Latency.attach(player)
+    Keyframes = KeyframeCache(default_keyframes_path(Root_Path))  #Keyframe times of each video, cached in ~/simpsonstv/keyframes
+    Scrub = Scrubber(player, Keyframes, tracer=Trace)  #Rewind/fast forward by jumping from keyframe to keyframe
+    Supervisor = PlaybackSupervisor(player, videoFailed, vlcFailed, Blocked, tracer=Trace)  #Skips videos that fail
+                                   # to play, restarts VLC if it is stuck
+    Latency.mark(STARTUP, process_start_time())  #Logs the time from process start to the first frame
+    player.play()
+    Keyframes.index_in_background(playablePath(Current_Video))
+    prefetchNextVideo()
+    Governor.start()               #Sample dropped frames, CPU frequency and temperature every few seconds
+    Supervisor.start()             #Check every half second that the video is playing
+    Journal.start(samplePlayer)    #Save the playing position every couple of minutes
+    Trace.dump_on_signal(default_trace_path(Root_Path))  #kill -USR1 <pid> writes ~/simpsonstv/trace.jsonl
+    Trace.serve(default_socket_path(Root_Path))          #python3 metrics.py reads the trace from ~/simpsonstv/trace.sock
+    Watcher = LibraryWatcher(Library, libraryChanged).start()  #Pick up added or removed videos without delaying playback
+    #Right button: tap for next video, hold > 2 seconds for next channel
+    RightButton = Input.add_button(VcrButton(25, on_press=rightButtonPressed, on_release=rightButtonReleased,
+                                             holds=[Hold(2000, rightButtonHeld)]))
+    #Left button: tap to pause/play, hold > 1 second to rewind (jumps every SCRUB_INTERVAL mS while held)
+    Input.add_button(VcrButton(26, on_release=leftButtonReleased, holds=[Hold(1000, leftButtonHeld, repeat=SCRUB_INTERVAL)]))
+    #Shutdown signal: only debounced on assertion for 50mS
+    Input.add_button(VcrButton(11, on_press=shutdownAsserted, pressDebounce=50))
+    #Both VCR buttons held > 5 seconds exits this script
+    Input.add_combo(ButtonCombo((25, 26), 5000, bothButtonsHeld))
 
 #----------------------------------------------------------------------------------------------------------------
-#     <<<MAIN>>>     Main program loop - continuously executes
-while (True):
-
-   input1 = GPIO.input(25)  #Read VCR right button input
-   input2 = GPIO.input(26)  #Read VCR left button input
-   ShutItDown = GPIO.input(11)  #Read Shutdown signal input
-   #Check GPIO 25 and debounce high and low going pulses to see if
-   #commanded to switch to next video in the current directory
-   #or if commanded to go to the next channel (directory) if button pressed longer than 2 seconds
-   if((input1 == True) and (oneShotNextVideo == False)):
-     Button1Timer = millis()
-     oneShotNextDirectory = False
-   #Debounce right button (GPIO 25) going to the active state (LOW) for 100mS to select next video
-   if((input1 == False)):
-     temp = millis()
-     if((temp - Button1Timer) >= 100):
-        PlayTimer = millis()
-        if(oneShotNextVideo == False):
-          oneShotNextVideo = True
-          nextVideo()
-        oneShotCheckLow = True
-     #Continue checking for button press > 2 seconds for change channel (directory)
-     if((temp - Button1Timer) >= 2000):
-        if(oneShotNextDirectory == False):
-          switchDirectory()
-          oneShotNextDirectory = True
-
-   #Debounce right button (GPIO 25) going to the inactive state (HIGH) for 50mS
-   if((input1 == True) and (oneShotNextVideo == True) and (oneShotCheckLow == True)):
-      oneShotCheckLow = False
-      Button1Timer = millis()
-   if((input1 == True) and (oneShotNextVideo == True)):
-      temp = millis()
-      if((temp - Button1Timer) >= 50):
-        oneShotNextVideo = False
-   #-------------------------------------------------------------
-   #Check GPIO 26 and debounce high and low going pulses to see if
-   #commanded to switch to pause or rewind 10 seconds if pressed longer than 1 second
-   if((input2 == True) and (oneShotPlayPause == False)):
-     Button2Timer = millis()
-     skipPause = False
-   #Debounce left button (GPIO 26) going to the active state (LOW) for 100mS to toggle pause/play
-   if((input2 == False)):
-     temp = millis()
-     if((temp - Button2Timer) >= 100):
-       if((oneShotPlayPause == False) and (skipPause == False)):
-         oneShotPlayPause = True
-     #Continue checking for button press > 1 second for rewind
-     if((temp - Button2Timer) >= 1000):
-       if(seekToggle == True):
-         try:                        #Implement exception handler (try: and except:) - prevents python script from
-                                     # crashing if exception occurs during (try:) code
-           player.set_time(player.get_time() - 10000) #Rewind video 10 seconds
-           seekToggle = False
-           seekTimer = millis()
-           oneShotPlayPause = False
-           skipPause = True
-         except Exception as e:      #Exception handler - executes if exception occurs during above try:
-           Nothing = 0               #  Exception code:does nothing-just catches exception/prevents Python crash
-       #Continue rewinding 10 seconds for every 1 second the left button is pressed
-       if((temp - seekTimer) >= 1000):
-         seekToggle = True
-         seekTimer = millis()
-
-   #Debounce left button (GPIO 26) going to the inactive state (HIGH) for 50mS
-   if((input2 == True) and (oneShotPlayPause == True)):
-      temp = millis()
-      if((temp - Button2Timer) >= 50):
-        try:                         #Implement exception handler (try: and except:) - prevents python script from
-                                     # crashing if exception occurs during (try:) code
-          player.pause()             #Toggle video play/pause
-          oneShotPlayPause = False
-        except Exception as e:       #Exception handler - executes if exception occurs during above try:
-          Nothing = 0                #  Exception code:does nothing-just catches exception/prevents Python crash
-
-   #-------------------------------------------------------------
-   #Check for special case of both VCR buttons pressed > 5 seconds (command to exit player.py Python script)
-   if ((input1 == False) and (input2 == False)):
-     temp = millis()
-     if ((temp - ExitPythonTimer) >= 5000):
-       player.stop()                 #Stop down VLC player
-       print("Exiting Python script")
-       quit()                        #Exit player.py Python script
-   else:
-     ExitPythonTimer = millis()
-
-   #-------------------------------------------------------------
-   #Check GPIO pin 11 for signal to safetly shutdown Pi (active low)
-   #  this signal is only debounced on assertion for 50mS
-   temp = millis()
-   if ((ShutItDown == False) and ((temp - ShutDownTimer) >= 50)):
-     os.system("clear")              #Clear the LCD screen
-     print("")
-     print("")
-     print("  Shutting Down...")     #Print "Shutting Down..." message on the LCD screen
-     os.system("sudo shutdown -h now") #Shut down the Raspberry Pi - the safe shutdown circuit will monitor the
-                                       # status LED signal and remove power once activity ceases
-   if (ShutItDown == True):          #Reset ShutDown timer if ShutItDown signal deasserts before timer times out
-     ShutDownTimer = millis()
-
-   #-------------------------------------------------------------
-   #Play next selection 1.5 seconds after last command to change video or directory
-   #  This allows enough time for a user to read the channel (directory) and
-   #  new video selected on the screen
-   #  This is controlled by the playNew boolean variable.  When playNew is set, it
-   #  triggers playing the new video 1.5 seconds later
-   temp = millis()
-   if((temp - PlayTimer) >= 1500 and (playNew == True)):
-     media = instance.media_new_path(VIDEO_PATH)
-     player.set_media(media)
-     player.play()
-     playNew = False                #Reset the playNew flag
-     manualSelect = False           #Reset the manualSelect flag (indicates automatic play unless changed by user)
+#     <<<MAIN>>>     Wait for button edges, timers and VLC events - uses no CPU while idle
+if __name__ == "__main__":
+  initialize()
+  Input.run()
@@ -0,0 +1,571 @@
+######################################################################################
+# scrub.py
+# Purpose:   Fast rewind / fast forward that can get through a 22 minute episode quickly.
+#
+#            A seek to an arbitrary time makes VLC decode from the keyframe before it, which on
+#            videos with long keyframe intervals can take most of a second on the Pi.  Scrubber
+#            only ever seeks to keyframes, so each seek shows the keyframe straight away, and the
+#            size of each jump grows the longer the button is held.
+#
+#            The keyframe times of a video are read once from its container: the Cues of a
+#            Matroska (.mkv) file or the sync sample table of an MP4, both of which are small
+#            and near the start or end of the file.  Other files fall back to ffprobe (when it
+#            is installed).  The index is cached in ~/simpsonstv/keyframes/, one small file per
+#            video keyed by its path and modification time, so it is only read again when a
+#            file changes, and only the index of the playing video is held in memory.
+#
+#            The time from each seek to VLC reporting the new position is measured and logged
+#            with the video's frame interval for comparison.
+###########################################################################################
+
+import array
+import bisect
+import collections
+import hashlib
+import json
+import logging
+import os
+import statistics
+import struct
+import subprocess
+import threading
+import time as time_ # Don't override time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import vlc
+from library import get_mtime, write_file_atomic
+
+log = logging.getLogger(__name__)
+
+SCRUB_INTERVAL = 500 # milliseconds between jumps while the button is held
+SCRUB_STEP = 5_000 # milliseconds jumped at first (10x normal speed)
+SCRUB_RAMP = 4 # jumps between each doubling of the jump size
+SCRUB_MAX_DOUBLINGS = 4 # up to 16 x SCRUB_STEP per jump (160x normal speed)
+SEEK_TOLERANCE = 500 # milliseconds: how close to a seek's target VLC's new time must be to count
+PROBE_TIMEOUT = 60 # seconds
+MAX_ELEMENT_SIZE = 16 * 1_024 * 1_024 # bytes of Matroska/MP4 index data read at most
+
+# Default location of the keyframe cache: next to the videos root
+def default_keyframes_path(videoRoot):
+    return os.path.join(os.path.dirname(os.path.normpath(videoRoot)), 'keyframes')
+
+# Path of the file a VLC Media plays
+def media_path(media):
+    mrl = media.get_mrl()
+    if (mrl.startswith('file://')):
+        return urllib.parse.unquote(urllib.parse.urlparse(mrl).path)
+    return mrl
+
+
+# Keyframe times (milliseconds, ascending) of one video and its frame interval (milliseconds,
+# or None if unknown)
+class Keyframes:
+    def __init__(self, times, frameInterval=None):
+        self.times = array.array('I', times)
+        self.frameInterval = frameInterval
+
+    # The keyframe at or before time (direction < 0) or at or after it (direction > 0)
+    def snap(self, time, direction):
+        if (direction < 0):
+            index = bisect.bisect_right(self.times, time) - 1
+        else:
+            index = bisect.bisect_left(self.times, time)
+        return self.times[min(max(index, 0), len(self.times) - 1)]
+
+
+#-------------------------------------------------------------------------------------------
+# Matroska: the Cues element lists the time (and position) of the keyframes of the video track
+
+MKV_EBML = 0x1A45DFA3
+MKV_SEGMENT = 0x18538067
+MKV_SEEK_HEAD = 0x114D9B74
+MKV_SEEK = 0x4DBB
+MKV_SEEK_ID = 0x53AB
+MKV_SEEK_POSITION = 0x53AC
+MKV_INFO = 0x1549A966
+MKV_TIMECODE_SCALE = 0x2AD7B1
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_NUMBER = 0xD7
+MKV_TRACK_TYPE = 0x83
+MKV_DEFAULT_DURATION = 0x23E383
+MKV_CUES = 0x1C53BB6B
+MKV_CUE_POINT = 0xBB
+MKV_CUE_TIME = 0xB3
+MKV_CUE_TRACK_POSITIONS = 0xB7
+MKV_CUE_TRACK = 0xF7
+MKV_CLUSTER = 0x1F43B675
+MKV_VIDEO_TRACK = 1
+
+# Read an EBML variable length integer at offset.  IDs keep their length marker bits; sizes
+# don't, and a size with all its bits set means "unknown" (returned as None).
+def _read_vint(data, offset, isId=False):
+    first = data[offset]
+    length = 1
+    while (length <= 8 and not first & (0x80 >> (length - 1))):
+        length += 1
+    if (length > 8 or offset + length > len(data)):
+        raise ValueError('Invalid EBML integer')
+    value = first if isId else first & (0xFF >> length)
+    for byte in data[offset + 1:offset + length]:
+        value = value << 8 | byte
+    if (not isId and value == (1 << (7 * length)) - 1):
+        value = None
+    return value, offset + length
+
+# (id, data offset, data size) of each element in data[start:end]
+def _ebml_elements(data, start=0, end=None):
+    offset = start
+    end = len(data) if end is None else end
+    while (offset < end):
+        elementId, offset = _read_vint(data, offset, isId=True)
+        size, offset = _read_vint(data, offset)
+        size = end - offset if size is None else size
+        yield elementId, offset, size
+        offset += size
+
+def _ebml_uint(data, offset, size):
+    return int.from_bytes(data[offset:offset + size], 'big')
+
+# Header of the element at position in file: (id, data position, data size or None)
+def _read_element_header(file, position):
+    file.seek(position)
+    header = file.read(12)
+    if (len(header) < 2):
+        return None
+    elementId, offset = _read_vint(header, 0, isId=True)
+    size, offset = _read_vint(header, offset)
+    return elementId, position + offset, size
+
+def _read_body(file, position, size):
+    if (size is None or size > MAX_ELEMENT_SIZE):
+        raise ValueError('Matroska element too large')
+    file.seek(position)
+    return file.read(size)
+
+def mkv_keyframes(path):
+    with open(path, 'rb') as file:
+        header = _read_element_header(file, 0)
+        if (header is None or header[0] != MKV_EBML):
+            return None
+        segment = _read_element_header(file, header[1] + header[2])
+        if (segment is None or segment[0] != MKV_SEGMENT):
+            return None
+        segmentStart = segment[1]
+        segmentEnd = segmentStart + segment[2] if segment[2] is not None else os.fstat(file.fileno()).st_size
+
+        # Find Info, Tracks and Cues: directly, or from the SeekHead once the clusters start
+        bodies = {}
+        positions = {}
+        position = segmentStart
+        while (position < segmentEnd and MKV_CUES not in bodies):
+            header = _read_element_header(file, position)
+            if (header is None):
+                break
+            elementId, dataPosition, size = header
+            if (elementId in (MKV_SEEK_HEAD, MKV_INFO, MKV_TRACKS, MKV_CUES)):
+                bodies[elementId] = _read_body(file, dataPosition, size)
+                if (elementId == MKV_SEEK_HEAD):
+                    for seekId, offset, length in _ebml_elements(bodies[elementId]):
+                        if (seekId != MKV_SEEK):
+                            continue
+                        fields = {childId: (childOffset, childLength) for childId, childOffset, childLength
+                                  in _ebml_elements(bodies[elementId], offset, offset + length)}
+                        if (MKV_SEEK_ID in fields and MKV_SEEK_POSITION in fields):
+                            target = _ebml_uint(bodies[elementId], *fields[MKV_SEEK_ID])
+                            positions[target] = segmentStart + _ebml_uint(bodies[elementId], *fields[MKV_SEEK_POSITION])
+            if (elementId == MKV_CLUSTER and MKV_CUES in positions):
+                break # Skip the clusters: the SeekHead says where everything is
+            if (size is None):
+                break # A cluster of unknown size can't be skipped
+            position = dataPosition + size
+        for elementId in (MKV_INFO, MKV_TRACKS, MKV_CUES):
+            if (elementId not in bodies and elementId in positions):
+                header = _read_element_header(file, positions[elementId])
+                if (header is not None and header[0] == elementId):
+                    bodies[elementId] = _read_body(file, header[1], header[2])
+    if (MKV_CUES not in bodies):
+        return None
+
+    timecodeScale = 1_000_000 # nanoseconds per timecode
+    info = bodies.get(MKV_INFO, b'')
+    for elementId, offset, size in _ebml_elements(info):
+        if (elementId == MKV_TIMECODE_SCALE):
+            timecodeScale = _ebml_uint(info, offset, size)
+
+    videoTrack = None
+    frameInterval = None
+    tracks = bodies.get(MKV_TRACKS, b'')
+    for elementId, offset, size in _ebml_elements(tracks):
+        if (elementId != MKV_TRACK_ENTRY):
+            continue
+        fields = {childId: _ebml_uint(tracks, childOffset, childSize) for childId, childOffset, childSize
+                  in _ebml_elements(tracks, offset, offset + size)
+                  if childId in (MKV_TRACK_NUMBER, MKV_TRACK_TYPE, MKV_DEFAULT_DURATION)}
+        if (fields.get(MKV_TRACK_TYPE) == MKV_VIDEO_TRACK and videoTrack is None):
+            videoTrack = fields.get(MKV_TRACK_NUMBER)
+            if (MKV_DEFAULT_DURATION in fields):
+                frameInterval = fields[MKV_DEFAULT_DURATION] / 1_000_000
+
+    times = set()
+    cues = bodies[MKV_CUES]
+    for elementId, offset, size in _ebml_elements(cues):
+        if (elementId != MKV_CUE_POINT):
+            continue
+        time = None
+        tracks = set()
+        for childId, childOffset, childSize in _ebml_elements(cues, offset, offset + size):
+            if (childId == MKV_CUE_TIME):
+                time = _ebml_uint(cues, childOffset, childSize)
+            elif (childId == MKV_CUE_TRACK_POSITIONS):
+                for positionId, positionOffset, positionSize in _ebml_elements(cues, childOffset, childOffset + childSize):
+                    if (positionId == MKV_CUE_TRACK):
+                        tracks.add(_ebml_uint(cues, positionOffset, positionSize))
+        if (time is not None and (videoTrack is None or videoTrack in tracks)):
+            times.add(round(time * timecodeScale / 1_000_000))
+    return Keyframes(sorted(times), frameInterval) if times else None
+
+
+#-------------------------------------------------------------------------------------------
+# MP4: the sync sample table (stss) of the video track lists its keyframes by sample number,
+# and the time to sample table (stts) gives each sample's time
+
+MP4_CONTAINERS = (b'moov', b'trak', b'mdia', b'minf', b'stbl')
+
+# (type, data offset, data size) of each box in data[start:end]
+def _mp4_boxes(data, start=0, end=None):
+    offset = start
+    end = len(data) if end is None else end
+    while (offset + 8 <= end):
+        size, boxType = struct.unpack_from('>I4s', data, offset)
+        headerSize = 8
+        if (size == 1):
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            headerSize = 16
+        elif (size == 0):
+            size = end - offset
+        if (size < headerSize):
+            raise ValueError('Invalid MP4 box')
+        yield boxType, offset + headerSize, size - headerSize
+        offset += size
+
+# The moov box of an MP4 file, wherever it is in the file
+def _read_moov(file):
+    fileSize = os.fstat(file.fileno()).st_size
+    position = 0
+    while (position + 8 <= fileSize):
+        file.seek(position)
+        header = file.read(16)
+        size, boxType = struct.unpack_from('>I4s', header)
+        headerSize = 8
+        if (size == 1):
+            size = struct.unpack_from('>Q', header, 8)[0]
+            headerSize = 16
+        elif (size == 0):
+            size = fileSize - position
+        if (size < headerSize):
+            return None
+        if (boxType == b'moov'):
+            if (size > MAX_ELEMENT_SIZE):
+                return None
+            file.seek(position + headerSize)
+            return file.read(size - headerSize)
+        position += size
+    return None
+
+def _mp4_find(data, offset, size, boxTypes):
+    found = {}
+    for boxType, boxOffset, boxSize in _mp4_boxes(data, offset, offset + size):
+        if (boxType in boxTypes):
+            found[boxType] = (boxOffset, boxSize)
+    return found
+
+def mp4_keyframes(path):
+    with open(path, 'rb') as file:
+        moov = _read_moov(file)
+    if (moov is None):
+        return None
+    for boxType, offset, size in _mp4_boxes(moov):
+        if (boxType != b'trak'):
+            continue
+        mdia = _mp4_find(moov, offset, size, (b'mdia',)).get(b'mdia')
+        if (mdia is None):
+            continue
+        boxes = _mp4_find(moov, *mdia, (b'mdhd', b'hdlr', b'minf'))
+        if (b'hdlr' not in boxes or moov[boxes[b'hdlr'][0] + 8:boxes[b'hdlr'][0] + 12] != b'vide'):
+            continue # Not the video track
+        mdhd = boxes[b'mdhd'][0]
+        timescale = struct.unpack_from('>I', moov, mdhd + (20 if moov[mdhd] == 1 else 12))[0]
+        stbl = _mp4_find(moov, *boxes[b'minf'], (b'stbl',))[b'stbl']
+        tables = _mp4_find(moov, *stbl, (b'stts', b'stss'))
+        if (b'stss' not in tables or b'stts' not in tables or timescale <= 0):
+            return None # Every sample is a keyframe (or the table is missing): nothing to snap to
+        stssOffset = tables[b'stss'][0]
+        syncSamples = struct.unpack_from(f">{struct.unpack_from('>I', moov, stssOffset + 4)[0]}I", moov, stssOffset + 8)
+        sttsOffset = tables[b'stts'][0]
+        runs = struct.unpack_from(f">{2 * struct.unpack_from('>I', moov, sttsOffset + 4)[0]}I", moov, sttsOffset + 8)
+
+        # Walk the runs of (sample count, sample duration) alongside the sorted sync samples
+        times = []
+        sample = 1 # Sample numbers start at 1
+        decodeTime = 0
+        sync = iter(syncSamples)
+        target = next(sync, None)
+        for run in range(0, len(runs), 2):
+            count, delta = runs[run], runs[run + 1]
+            while (target is not None and target < sample + count):
+                times.append(round((decodeTime + (target - sample) * delta) * 1_000 / timescale))
+                target = next(sync, None)
+            sample += count
+            decodeTime += count * delta
+        frameInterval = runs[1] * 1_000 / timescale if runs else None
+        return Keyframes(times, frameInterval) if times else None
+    return None
+
+
+#-------------------------------------------------------------------------------------------
+# Anything else: ask ffprobe for the keyframe packets of the first video stream
+
+def ffprobe_keyframes(path):
+    try:
+        result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+                                 'packet=pts_time,flags', '-of', 'csv=p=0', path],
+                                capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if (result.returncode != 0):
+        return None
+    keyframes = []
+    packets = []
+    for line in result.stdout.splitlines():
+        fields = line.split(',')
+        try:
+            time = float(fields[0]) * 1_000
+        except (ValueError, IndexError):
+            continue
+        packets.append(time)
+        if ('K' in fields[1]):
+            keyframes.append(round(time))
+    intervals = sorted(b - a for a, b in zip(sorted(packets), sorted(packets)[1:]) if b > a)
+    frameInterval = statistics.median(intervals) if intervals else None
+    return Keyframes(sorted(set(keyframes)), frameInterval) if keyframes else None
+
+# Keyframes of a video, from its container if possible, or None
+def extract_keyframes(path):
+    try:
+        with open(path, 'rb') as file:
+            magic = file.read(12)
+        if (magic[:4] == b'\x1a\x45\xdf\xa3'):
+            keyframes = mkv_keyframes(path)
+        elif (magic[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide')):
+            keyframes = mp4_keyframes(path)
+        else:
+            keyframes = None
+    except (OSError, ValueError, KeyError, struct.error, IndexError) as e:
+        log.warning("Unable to read the keyframe index of '%s': %s", path, e)
+        keyframes = None
+    return keyframes if keyframes is not None else ffprobe_keyframes(path)
+
+
+class KeyframeCache:
+    def __init__(self, cacheDirectory, memory=4):
+        self._cacheDirectory = cacheDirectory
+        self._memory = memory
+        self._recent = collections.OrderedDict() # path -> (mtime, Keyframes or None), most recent last
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='keyframe-index')
+
+    def _cache_path(self, path):
+        return os.path.join(self._cacheDirectory, hashlib.sha1(os.fsencode(path)).hexdigest() + '.json')
+
+    # Keyframes of the video at path, or None if they aren't indexed (yet) or can't be
+    def get(self, path):
+        mtime = get_mtime(path)
+        with self._lock:
+            cached = self._recent.get(path)
+            if (cached is not None and cached[0] == mtime):
+                self._recent.move_to_end(path)
+                return cached[1]
+        entry = self._load(path, mtime)
+        return entry[1] if entry is not None else None
+
+    def _load(self, path, mtime):
+        try:
+            with open(self._cache_path(path), 'r') as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if (cached.get('path') != path or cached.get('mtime') != mtime):
+            return None
+        keyframes = None
+        if (cached.get('keyframes') is not None):
+            # Saved as the differences between keyframe times
+            times = [0]
+            for delta in cached['keyframes']:
+                times.append(times[-1] + delta)
+            keyframes = Keyframes(times[1:], cached.get('frameInterval'))
+        self._remember(path, mtime, keyframes)
+        return mtime, keyframes
+
+    def _remember(self, path, mtime, keyframes):
+        with self._lock:
+            self._recent[path] = (mtime, keyframes)
+            self._recent.move_to_end(path)
+            while (len(self._recent) > self._memory):
+                self._recent.popitem(last=False)
+
+    # Index the keyframes of path in the background, unless they are already cached
+    def index_in_background(self, path):
+        path = str(path)
+        mtime = get_mtime(path)
+        if (mtime is None):
+            return
+        with self._lock:
+            cached = self._recent.get(path)
+            if (path in self._pending or (cached is not None and cached[0] == mtime)):
+                return
+            self._pending.add(path)
+        self._executor.submit(self._index, path, mtime)
+
+    def _index(self, path, mtime):
+        try:
+            if (self._load(path, mtime) is not None):
+                return
+            start = time_.monotonic()
+            keyframes = extract_keyframes(path)
+            if (keyframes is not None):
+                log.info("Indexed %d keyframes of '%s' in %.0f ms", len(keyframes.times), path,
+                         (time_.monotonic() - start) * 1_000)
+            self._remember(path, mtime, keyframes)
+            self._save(path, mtime, keyframes) # Failures are saved too, so they aren't retried every time
+        except Exception as e:
+            log.warning("Unable to index the keyframes of '%s': %s", path, e)
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+
+    def _save(self, path, mtime, keyframes):
+        entry = {'path': path, 'mtime': mtime, 'frameInterval': None, 'keyframes': None}
+        if (keyframes is not None):
+            times = keyframes.times
+            entry['frameInterval'] = keyframes.frameInterval
+            entry['keyframes'] = [times[0]] + [b - a for a, b in zip(times, times[1:])]
+        try:
+            os.makedirs(self._cacheDirectory, exist_ok=True)
+            write_file_atomic(self._cache_path(path), json.dumps(entry, separators=(',', ':')).encode('utf-8'))
+        except OSError as e:
+            log.warning("Unable to save the keyframe index of '%s': %s", path, e)
+
+
+class Scrubber:
+    def __init__(self, player, keyframes, tracer=None, history=200):
+        self._player = None
+        self._keyframes = keyframes
+        self._tracer = tracer
+        self._lock = threading.Lock()
+        self._direction = 0
+        self._steps = 0
+        self._index = None
+        self._position = None
+        self._pending = None # (time.monotonic() of the seek, target) until VLC reports the new time
+        self._scrubSamples = [] # Seek latencies of the current scrub
+        self._history = history
+        self.samples = [] # Seek latencies in milliseconds
+        self.attach(player)
+
+    # Scrub with a VLC media player: the first one, or a new one after VLC was restarted
+    def attach(self, player):
+        with self._lock:
+            self._player = player
+            self._position = None
+            self._pending = None
+        player.event_manager().event_attach(vlc.EventType.MediaPlayerTimeChanged, self._on_time_changed)
+
+    def is_active(self):
+        return self._direction != 0
+
+    # Start scrubbing backwards (direction -1) or forwards (+1) through the playing video
+    def begin(self, direction):
+        media = self._player.get_media()
+        if (media is None):
+            return
+        path = media_path(media)
+        media.release() # get_media() returns a new reference
+        with self._lock:
+            self._direction = direction
+            self._steps = 0
+            self._index = self._keyframes.get(path)
+            self._position = None
+            self._scrubSamples = []
+        self._trace('scrub', direction=direction, keyframes=len(self._index.times) if self._index else 0)
+
+    # Switch between rewinding and fast forwarding, starting again at the slowest speed
+    def reverse(self):
+        with self._lock:
+            self._direction = -self._direction
+            self._steps = 0
+        self._trace('scrub', direction=self._direction)
+
+    # Jump once; called every SCRUB_INTERVAL milliseconds while scrubbing.  The jump doubles every
+    # SCRUB_RAMP jumps.  count jumps (e.g. ones that fell behind) are made as one longer jump.
+    def step(self, count=1):
+        with self._lock:
+            if (self._direction == 0):
+                return
+            stride = 0
+            for jump in range(count):
+                stride += SCRUB_STEP << min(self._steps // SCRUB_RAMP, SCRUB_MAX_DOUBLINGS)
+                self._steps += 1
+            # Jump on from the last target: VLC may not have reported the new time yet
+            position = self._position if self._position is not None else self._player.get_time()
+            if (position < 0):
+                return
+            length = self._player.get_length()
+            target = max(0, position + self._direction * stride)
+            if (length > 0):
+                target = min(target, length - 1_000)
+            if (self._index is not None):
+                keyframe = self._index.snap(target, self._direction)
+                if (keyframe == position and target != position):
+                    # Already on the keyframe: move to the next one in this direction
+                    keyframe = self._index.snap(position + self._direction, self._direction)
+                target = keyframe
+            self._position = target
+            self._pending = (time_.monotonic(), target)
+        self._player.set_time(int(target))
+        self._trace('seek', target=int(target), stride=stride, snapped=self._index is not None)
+
+    # Stop scrubbing; playback carries on from where it got to
+    def end(self):
+        with self._lock:
+            if (self._direction == 0):
+                return
+            self._direction = 0
+            index = self._index
+            samples = self._scrubSamples
+        if (samples):
+            frameInterval = f"{index.frameInterval:.1f} ms" if index is not None and index.frameInterval else "unknown"
+            log.info("Scrubbed: %d seeks%s, seek latency mean %.0f ms, max %.0f ms (frame interval %s)",
+                     len(samples), " to keyframes" if index is not None else "",
+                     sum(samples) / len(samples), max(samples), frameInterval)
+        self._trace('scrub', direction=0)
+
+    def _on_time_changed(self, event):
+        with self._lock:
+            if (self._pending is None):
+                return
+            start, target = self._pending
+            if (abs(event.u.new_time - target) > SEEK_TOLERANCE):
+                return # A time from before the seek
+            self._pending = None
+            latency = (time_.monotonic() - start) * 1_000
+            self.samples.append(latency)
+            del self.samples[:-self._history]
+            self._scrubSamples.append(latency)
+        self._trace('seek_done', latency=round(latency, 1))
+
+    def _trace(self, event, **fields):
+        if (self._tracer is not None):
+            self._tracer.trace(event, **fields)
@@ -0,0 +1,713 @@
+######################################################################################
+# simulation.py
+# Purpose:   Stand-ins for the hardware so the players can run (and be measured) on a normal
+#            Linux box.  They are selected by backends.py when SIMPSONSTV_BACKEND=sim.
+#
+#            SimulatedGPIO  behaves like the RPi.GPIO module.  Inputs idle HIGH (pull-up) and
+#                           set_input() delivers edge callbacks like RPi.GPIO's edge detection
+#                           thread.  replay_trace() plays back a scripted button-press trace.
+#            SimulatedVlc   behaves like the parts of the python-vlc module the players use.
+#                           Nothing is decoded: each media has a duration and the players move
+#                           along a simulated clock (optionally sped up), sending the usual
+#                           events (Playing, Vout, EndReached, NextItemSet...) from an event
+#                           thread like libvlc does.  Every player command is recorded with a
+#                           timestamp.  Media objects are reference counted like libvlc's
+#                           (set_media, get_media, media lists...) and live ones are counted.
+#                           Stopping a media (or playing another) can be made to block the
+#                           caller for a while (stopTime), like libvlc closing a video.
+#                           Files can be made to fail (faults): VLC can't decode them, their
+#                           picture freezes, or they leave the whole VLC instance unable to
+#                           play anything until a new one is created.
+#                           A seek reports the new time (TimeChanged) once the frames from the
+#                           keyframe before the target up to the target would have been decoded.
+#                           Pictures are lost (get_stats()) while a media's bitrate is above
+#                           what the simulated Pi can decode (decodeCapacity), e.g. when it is
+#                           throttled.
+###########################################################################################
+
+import collections
+import heapq
+import itertools
+import threading
+import time as time_ # Don't override time
+import types
+import urllib.parse
+
+
+class SimulatedGPIO:
+    BCM = 11
+    BOARD = 10
+    IN = 1
+    OUT = 0
+    PUD_UP = 22
+    PUD_DOWN = 21
+    HIGH = 1
+    LOW = 0
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self._levels = {}
+        self._callbacks = {}
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None):
+        self._levels[pin] = self.LOW if pull_up_down == self.PUD_DOWN else self.HIGH
+
+    def input(self, pin):
+        return self._levels.get(pin, self.HIGH)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self._callbacks[pin] = (edge, callback)
+
+    def add_event_callback(self, pin, callback):
+        self._callbacks[pin] = (self._callbacks.get(pin, (self.BOTH, None))[0], callback)
+
+    def remove_event_detect(self, pin):
+        self._callbacks.pop(pin, None)
+
+    def cleanup(self):
+        self._callbacks.clear()
+
+    def set_input(self, pin, level):
+        level = self.HIGH if level else self.LOW
+        if (self._levels.get(pin, self.HIGH) == level):
+            return
+        self._levels[pin] = level
+        edge, callback = self._callbacks.get(pin, (None, None))
+        if (callback and (edge == self.BOTH or edge == (self.RISING if level else self.FALLING))):
+            callback(pin)
+
+
+# Parse a button trace: one "<milliseconds> <pin> <level>" step per line, '#' starts a comment
+def parse_trace(text):
+    steps = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if (line):
+            at, pin, level = line.split()
+            steps.append((int(at), int(pin), int(level)))
+    return steps
+
+# Play a trace back in real time.  onStep(at, pin, level) is called just before each input change.
+def replay_trace(gpio, steps, onStep=None):
+    start = time_.monotonic()
+    for at, pin, level in steps:
+        delay = start + at / 1_000 - time_.monotonic()
+        if (delay > 0):
+            time_.sleep(delay)
+        if (onStep):
+            onStep(at, pin, level)
+        gpio.set_input(pin, level)
+
+# A trace of "count" short presses of a button, "interval" milliseconds apart
+def tap_trace(pin, count, interval=3_000, hold=200, start=1_000):
+    steps = []
+    for press in range(count):
+        at = start + press * interval
+        steps.append((at, pin, 0))
+        steps.append((at + hold, pin, 1))
+    return steps
+
+
+class SimulatedClock:
+    def __init__(self, speed=1.0):
+        self._origin = time_.monotonic()
+        self._offset = 0
+        self.speed = speed
+
+    # Simulated milliseconds since the clock was created
+    def now(self):
+        return self._offset + (time_.monotonic() - self._origin) * 1_000 * self.speed
+
+    def set_speed(self, speed):
+        self._offset = self.now()
+        self._origin = time_.monotonic()
+        self.speed = speed
+
+
+# Runs callbacks at simulated times on a single thread, like libvlc's event thread
+class _EventThread:
+    def __init__(self, clock):
+        self._clock = clock
+        self._timers = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def call_at(self, due, callback, *args):
+        timer = [callback, args]
+        with self._condition:
+            heapq.heappush(self._timers, (due, next(self._sequence), timer))
+            if (self._thread is None):
+                self._thread = threading.Thread(target=self._run, name='vlc-events', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return timer
+
+    def call_soon(self, callback, *args):
+        return self.call_at(self._clock.now(), callback, *args)
+
+    @staticmethod
+    def cancel(timer):
+        if (timer is not None):
+            timer[0] = None
+
+    def _run(self):
+        while (True):
+            with self._condition:
+                while (True):
+                    if (self._timers):
+                        wait = (self._timers[0][0] - self._clock.now()) / (1_000 * self._clock.speed)
+                        if (wait <= 0):
+                            break
+                        self._condition.wait(wait)
+                    else:
+                        self._condition.wait()
+                due, sequence, timer = heapq.heappop(self._timers)
+            callback, args = timer
+            if (callback is not None):
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(f"Exception in simulated VLC event callback: {e!r}")
+
+
+class EventType:
+    MediaParsedChanged = 3
+    MediaPlayerOpening = 258
+    MediaPlayerPlaying = 260
+    MediaPlayerPaused = 261
+    MediaPlayerStopped = 262
+    MediaPlayerEndReached = 265
+    MediaPlayerEncounteredError = 266
+    MediaPlayerTimeChanged = 267
+    MediaPlayerVout = 274
+    MediaListPlayerNextItemSet = 1025
+
+
+class State:
+    NothingSpecial = 0
+    Opening = 1
+    Buffering = 2
+    Playing = 3
+    Paused = 4
+    Stopped = 5
+    Ended = 6
+    Error = 7
+
+
+class PlaybackMode:
+    default = 0
+    loop = 1
+    repeat = 2
+
+
+class MediaParseFlag:
+    local = 0
+    network = 1
+
+
+class MediaParsedStatus:
+    skipped = 1
+    failed = 2
+    timeout = 3
+    done = 4
+
+
+class MediaStats:
+    def __init__(self):
+        self.read_bytes = 0
+        self.input_bitrate = 0.0
+        self.demux_read_bytes = 0
+        self.demux_bitrate = 0.0
+        self.demux_corrupted = 0
+        self.demux_discontinuity = 0
+        self.decoded_video = 0
+        self.decoded_audio = 0
+        self.displayed_pictures = 0
+        self.lost_pictures = 0
+
+
+class _EventManager:
+    def __init__(self, sim):
+        self._sim = sim
+        self._callbacks = collections.defaultdict(list)
+
+    def event_attach(self, eventType, callback, *args, **kwargs):
+        self._callbacks[eventType].append((callback, args, kwargs))
+        return 0
+
+    def event_detach(self, eventType):
+        self._callbacks.pop(eventType, None)
+
+    # Queue an event for delivery on the event thread
+    def send(self, eventType, **u):
+        self._sim._events.call_soon(self._deliver, eventType, u)
+
+    def _deliver(self, eventType, u):
+        event = types.SimpleNamespace(type=eventType, u=types.SimpleNamespace(**u))
+        for callback, args, kwargs in list(self._callbacks.get(eventType, ())):
+            callback(event, *args, **kwargs)
+
+
+class SimulatedMedia:
+    def __init__(self, sim, path):
+        self._sim = sim
+        self._path = str(path)
+        self._events = _EventManager(sim)
+        self._parsed = False
+        self._references = 1
+        self.options = []
+        self.duration = sim.duration_of(self._path)
+        self.player = None # The player playing this media, while it is the player's media
+        self.played = 0 # Simulated milliseconds played, for get_stats()
+        self._statsAt = 0 # Frames counted by get_stats() so far
+        self._lost = 0 # ... and how many of them were lost
+        with sim._lock:
+            sim.liveMedia += 1
+            sim.createdMedia += 1
+
+    def get_mrl(self):
+        return 'file://' + urllib.parse.quote(self._path)
+
+    def event_manager(self):
+        return self._events
+
+    def add_option(self, option):
+        self.options.append(option)
+
+    def start_time(self):
+        for option in self.options:
+            if (option.startswith(':start-time=')):
+                return float(option.split('=', 1)[1]) * 1_000
+        return 0
+
+    def parse_with_options(self, flags, timeout):
+        self._sim._events.call_at(self._sim.clock.now() + self._sim.parseTime, self._parse_done)
+        return 0
+
+    def _parse_done(self):
+        self._parsed = True
+        self._events._deliver(EventType.MediaParsedChanged, dict(new_status=MediaParsedStatus.done))
+
+    def get_parsed_status(self):
+        return MediaParsedStatus.done if self._parsed else 0
+
+    def get_duration(self):
+        return self.duration if self._parsed else -1
+
+    # Pretend to decode frameRate pictures a second at a constant bitrate.  The pictures since the
+    # last call are lost in proportion to how far the bitrate is over the decode capacity.
+    def get_stats(self, stats):
+        played = self.player.get_time() if self.player is not None else -1
+        played = played if played >= 0 else self.played
+        frames = int(max(0, played) * self._sim.frameRate / 1_000)
+        bitrate = self._sim.bitrate_of(self._path)
+        if (frames > self._statsAt):
+            self._lost += round((frames - self._statsAt) * self._sim.lost_fraction(bitrate))
+            self._statsAt = frames
+        stats.decoded_video = self._statsAt
+        stats.displayed_pictures = self._statsAt - self._lost
+        stats.lost_pictures = self._lost
+        stats.demux_bitrate = stats.input_bitrate = bitrate / 8_000 # bytes per microsecond
+        stats.demux_read_bytes = stats.read_bytes = int(max(0, played) * bitrate / 8)
+        return 1
+
+    def retain(self):
+        with self._sim._lock:
+            if (self._references <= 0):
+                raise RuntimeError(f"Media '{self._path}' retained after it was freed")
+            self._references += 1
+
+    def release(self):
+        with self._sim._lock:
+            if (self._references <= 0):
+                raise RuntimeError(f"Media '{self._path}' released after it was freed")
+            self._references -= 1
+            if (self._references == 0):
+                self._sim.liveMedia -= 1
+
+
+class SimulatedMediaPlayer:
+    def __init__(self, sim, instance=None):
+        self._sim = sim
+        self._instance = instance
+        self._events = _EventManager(sim)
+        self._media = None
+        self._state = State.NothingSpecial
+        self._position = 0
+        self._clockBase = 0
+        self._endTimer = None
+        self._seekTimer = None
+        self._frozen = None # The time the picture froze at (a 'stall' fault)
+
+    def event_manager(self):
+        return self._events
+
+    def set_media(self, media):
+        self._sim.record('set_media', media)
+        self.stop()
+        if (media is not None):
+            media.retain()
+            media.player = self
+        if (self._media is not None):
+            self._media.player = None
+            self._media.release()
+        self._media = media
+
+    # Like libvlc, the caller gets a new reference and must release it
+    def get_media(self):
+        if (self._media is not None):
+            self._media.retain()
+        return self._media
+
+    def get_state(self):
+        return self._state
+
+    def is_playing(self):
+        return 1 if self._state == State.Playing else 0
+
+    def get_length(self):
+        return self._media.duration if self._media is not None else -1
+
+    def get_time(self):
+        if (self._media is None or self._state in (State.NothingSpecial, State.Stopped, State.Error)):
+            return -1
+        if (self._frozen is not None):
+            return self._frozen
+        if (self._state == State.Playing):
+            return int(min(self._media.duration, self._position + self._sim.clock.now() - self._clockBase))
+        return int(self._position)
+
+    def set_time(self, time):
+        self._sim.record('set_time', time)
+        if (self._media is None):
+            return
+        self._position = max(0, min(time, self._media.duration))
+        self._clockBase = self._sim.clock.now()
+        if (self._state == State.Playing):
+            self._schedule_end()
+        self._sim._events.cancel(self._seekTimer)
+        self._seekTimer = self._sim._events.call_at(self._clockBase + self._sim.seek_time(self._position),
+                                                    self._seeked, self._media, int(self._position))
+
+    def _seeked(self, media, time):
+        if (media is self._media):
+            self._events._deliver(EventType.MediaPlayerTimeChanged, dict(new_time=time))
+
+    def play(self):
+        self._sim.record('play', self._media)
+        if (self._media is None):
+            return -1
+        if (self._state == State.Paused):
+            self.set_pause(0)
+            return 0
+        if (self._state == State.Playing):
+            return 0
+        self._state = State.Opening
+        self._position = self._media.start_time()
+        self._frozen = None
+        self._events.send(EventType.MediaPlayerOpening)
+        if (self._instance is not None and self._instance.wedged):
+            return 0 # Never opens
+        self._sim._events.call_at(self._sim.clock.now() + self._sim.openTime, self._opened, self._media)
+        return 0
+
+    def _opened(self, media):
+        if (media is not self._media or self._state != State.Opening):
+            return
+        fault = self._sim.faults.get(media._path)
+        if (fault in ('error', 'wedge')):
+            self._state = State.Error
+            if (fault == 'wedge' and self._instance is not None):
+                self._instance.wedged = True
+            self._events._deliver(EventType.MediaPlayerEncounteredError, {})
+            return
+        self._state = State.Playing
+        self._clockBase = self._sim.clock.now()
+        self._schedule_end()
+        self._events._deliver(EventType.MediaPlayerPlaying, {})
+        self._events._deliver(EventType.MediaPlayerVout, dict(new_count=1))
+        if (fault == 'stall'):
+            self._sim._events.call_at(self._clockBase + self._sim.stallAfter, self._stall, media)
+
+    def _stall(self, media):
+        if (media is self._media and self._state == State.Playing):
+            self._frozen = self.get_time()
+            self._sim._events.cancel(self._endTimer)
+
+    def _schedule_end(self):
+        self._sim._events.cancel(self._endTimer)
+        remaining = self._media.duration - self._position
+        self._endTimer = self._sim._events.call_at(self._clockBase + remaining, self._ended, self._media)
+
+    def _ended(self, media):
+        if (media is not self._media or self._state != State.Playing):
+            return
+        self._state = State.Ended
+        self._position = media.duration
+        self._events._deliver(EventType.MediaPlayerEndReached, {})
+
+    def pause(self):
+        self._sim.record('pause', None)
+        self.set_pause(1 if self._state == State.Playing else 0)
+
+    def set_pause(self, pause):
+        if (pause and self._state == State.Playing):
+            self._position = self.get_time()
+            self._state = State.Paused
+            self._sim._events.cancel(self._endTimer)
+            self._events.send(EventType.MediaPlayerPaused)
+        elif (not pause and self._state == State.Paused):
+            self._state = State.Playing
+            self._clockBase = self._sim.clock.now()
+            self._schedule_end()
+            self._events.send(EventType.MediaPlayerPlaying)
+
+    def stop(self):
+        if (self._state in (State.NothingSpecial, State.Stopped)):
+            return
+        self._sim.record('stop', None)
+        self._frozen = None
+        if (self._sim.stopTime):
+            time_.sleep(self._sim.stopTime / (1_000 * self._sim.clock.speed)) # Like libvlc, wait for the video to close
+        self._media.played = max(0, self.get_time())
+        self._sim._events.cancel(self._endTimer)
+        self._state = State.Stopped
+        self._events.send(EventType.MediaPlayerStopped)
+
+    def release(self):
+        self.stop()
+        if (self._media is not None):
+            self._media.player = None
+            self._media.release()
+            self._media = None
+
+
+class SimulatedMediaList:
+    def __init__(self, sim, items=()):
+        self._sim = sim
+        self._items = []
+        for item in items:
+            self.add_media(item)
+
+    # The list keeps its own reference to media (python-vlc creates the Media for a path)
+    def add_media(self, media):
+        if (isinstance(media, SimulatedMedia)):
+            media.retain()
+        else:
+            media = SimulatedMedia(self._sim, media)
+        self._items.append(media)
+        return 0
+
+    def insert_media(self, media, index):
+        media.retain()
+        self._items.insert(index, media)
+        return 0
+
+    def remove_index(self, index):
+        self._items.pop(index).release()
+        return 0
+
+    def count(self):
+        return len(self._items)
+
+    # Like libvlc, the caller gets a new reference and must release it
+    def item_at_index(self, index):
+        media = self._item(index)
+        if (media is not None):
+            media.retain()
+        return media
+
+    def _item(self, index):
+        return self._items[index] if 0 <= index < len(self._items) else None
+
+    def index_of_item(self, media):
+        for index, item in enumerate(self._items):
+            if (item is media):
+                return index
+        return -1
+
+    def lock(self):
+        pass
+
+    def unlock(self):
+        pass
+
+    def release(self):
+        for item in self._items:
+            item.release()
+        self._items = []
+
+
+class SimulatedMediaListPlayer:
+    def __init__(self, sim, instance=None):
+        self._sim = sim
+        self._events = _EventManager(sim)
+        self._mediaList = None
+        self._index = -1 # Like libvlc, the current item is only remembered by its index
+        self._mode = PlaybackMode.default
+        self._player = None
+        self.set_media_player(SimulatedMediaPlayer(sim, instance))
+
+    def event_manager(self):
+        return self._events
+
+    def set_media_player(self, player):
+        self._player = player
+        player.event_manager().event_attach(EventType.MediaPlayerEndReached, self._on_end_reached)
+
+    def get_media_player(self):
+        return self._player
+
+    def set_media_list(self, mediaList):
+        self._mediaList = mediaList
+
+    def set_playback_mode(self, mode):
+        self._mode = mode
+
+    def _on_end_reached(self, event):
+        self._play_at(self._next_index(1))
+
+    def _next_index(self, step):
+        index = self._index + step
+        if (self._mode == PlaybackMode.loop and self._mediaList and self._mediaList.count() > 0):
+            index %= self._mediaList.count()
+        return index
+
+    def _play_at(self, index):
+        media = self._mediaList._item(index) if self._mediaList else None
+        if (media is None):
+            return -1
+        self._index = index
+        self._player.set_media(media)
+        self._events._deliver(EventType.MediaListPlayerNextItemSet, dict(item=media))
+        self._player.play()
+        return 0
+
+    def play(self):
+        self._sim.record('list_play', None)
+        if (self._player.get_state() == State.Paused):
+            return self._player.play()
+        return self._play_at(max(self._index, 0))
+
+    def play_item_at_index(self, index):
+        self._sim.record('play_item_at_index', index)
+        return self._play_at(index)
+
+    def next(self):
+        self._sim.record('next', None)
+        return self._play_at(self._next_index(1))
+
+    def previous(self):
+        self._sim.record('previous', None)
+        return self._play_at(self._next_index(-1))
+
+    def pause(self):
+        self._player.pause()
+
+    def stop(self):
+        self._player.stop()
+
+    def release(self):
+        self._player.release()
+
+
+class SimulatedInstance:
+    def __init__(self, sim):
+        self._sim = sim
+        self.wedged = False # A 'wedge' fault happened: nothing opens any more
+        sim.createdInstances += 1
+
+    def media_new_path(self, path):
+        return SimulatedMedia(self._sim, path)
+
+    def media_new(self, mrl):
+        return SimulatedMedia(self._sim, urllib.parse.unquote(str(mrl).replace('file://', '', 1)))
+
+    def media_player_new(self):
+        return SimulatedMediaPlayer(self._sim, self)
+
+    def media_list_new(self, paths=()):
+        return SimulatedMediaList(self._sim, paths)
+
+    def media_list_player_new(self):
+        return SimulatedMediaListPlayer(self._sim, self)
+
+    def release(self):
+        pass
+
+
+# Looks like the python-vlc module: SimulatedVlc().Instance(), .MediaListPlayer(), .EventType...
+class SimulatedVlc:
+    EventType = EventType
+    State = State
+    MediaParseFlag = MediaParseFlag
+    MediaParsedStatus = MediaParsedStatus
+    MediaStats = MediaStats
+    PlaybackMode = PlaybackMode
+
+    def __init__(self, speed=1.0, duration=22 * 60 * 1_000, openTime=50, parseTime=20):
+        self.clock = SimulatedClock(speed)
+        self.openTime = openTime # simulated milliseconds from play() to the first frame
+        self.parseTime = parseTime
+        self.stopTime = 0 # simulated milliseconds stop() (and so playing another media) blocks the caller
+        self.duration = duration # default media duration in simulated milliseconds
+        self.durations = {} # path -> duration, overrides the default
+        self.frameRate = 24
+        self.bitrate = 1_200 # kbit/s
+        self.bitrates = {} # path -> bitrate, overrides the default
+        self.decodeCapacity = None # kbit/s that can be decoded without losing pictures (None: no limit)
+        self.keyframeInterval = 10_000 # milliseconds between keyframes (a long GOP)
+        self.seekTime = 15 # simulated milliseconds for a seek that lands on a keyframe
+        self.decodeTime = 4 # simulated milliseconds to decode each frame between the keyframe and a seek's target
+        # path -> 'error' (can't be decoded), 'stall' (the picture freezes stallAfter simulated
+        # milliseconds in) or 'wedge' (can't be decoded and nothing plays on the instance after it)
+        self.faults = {}
+        self.stallAfter = 1_000
+        self.createdInstances = 0
+        self.commands = collections.deque(maxlen=10_000)
+        self.liveMedia = 0
+        self.createdMedia = 0
+        self._lock = threading.Lock()
+        self._events = _EventThread(self.clock)
+
+    def duration_of(self, path):
+        return self.durations.get(path, self.duration)
+
+    def bitrate_of(self, path):
+        return self.bitrates.get(path, self.bitrate)
+
+    # Fraction of the pictures of a video at bitrate lost at the current decode capacity
+    def lost_fraction(self, bitrate):
+        if (self.decodeCapacity is None or bitrate <= self.decodeCapacity):
+            return 0
+        return 1 - self.decodeCapacity / bitrate
+
+    # Simulated milliseconds for a seek to time: decoding starts at the keyframe before it
+    def seek_time(self, time):
+        frames = (time % self.keyframeInterval) * self.frameRate // 1_000
+        return self.seekTime + frames * self.decodeTime
+
+    # Record a player command with the real (monotonic) time it was made.  Media are recorded by
+    # path, so the record doesn't keep released Media alive.
+    def record(self, command, argument):
+        if (isinstance(argument, SimulatedMedia)):
+            argument = argument._path
+        self.commands.append((time_.monotonic(), command, argument))
+
+    def Instance(self, *args):
+        return SimulatedInstance(self)
+
+    def MediaPlayer(self, *args):
+        return SimulatedMediaPlayer(self)
+
+    def MediaListPlayer(self, *args):
+        return SimulatedMediaListPlayer(self)
@@ -0,0 +1,327 @@
+######################################################################################
+# supervisor.py
+# Purpose:   Keep the TV playing when VLC can't play a video (a corrupt file, a decoder error, a
+#            picture that freezes) instead of showing a frozen or black screen until the Pi is
+#            power cycled.
+#
+#            PlaybackSupervisor listens for VLC's EncounteredError event and checks on the media
+#            player every HEARTBEAT_INTERVAL seconds: a video still opening after START_TIMEOUT
+#            seconds, or playing with its position stuck for STALL_TIME seconds, has failed too.
+#            Stopped and paused videos are left alone.
+#
+#            On a failure the player is told to skip to the next video (onSkip).  Until a picture
+#            is shown again the player is checked every RECOVERY_INTERVAL seconds, and the next
+#            video only has RETRY_TIMEOUT seconds to open.  If it doesn't open (or freezes) too,
+#            or ERROR_STREAK videos in a row report an error, VLC itself is probably stuck or
+#            broken, and the player is told to restart VLC (onRestart): create a new vlc.Instance and media player in the
+#            same process, keeping the library, playlist and journal it already has, and play on
+#            from the next video.
+#
+#            Failures are counted against the file in Blocklist, saved in
+#            ~/simpsonstv/blocklist.json keyed by path and modification time.  A file that fails
+#            BLOCK_FAILURES times is skipped from then on, until it is replaced.  A failure that
+#            leads to a restart is blamed on VLC rather than the file, as are the other errors of a
+#            streak of ERROR_STREAK and every failure after a restart until a picture is shown
+#            again.  A file that plays to the end is forgiven.
+#
+#            The time from each failure being noticed to the first picture after it is logged
+#            (it should be under RECOVERY_TARGET milliseconds) and recorded in the trace.
+###########################################################################################
+
+import json
+import logging
+import os
+import threading
+import time as time_ # Don't override time
+
+from backends import vlc
+from library import get_mtime, write_file_atomic
+from scrub import media_path
+
+log = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 0.5 # seconds between checks on the player
+STALL_TIME = 3.0 # seconds a playing video's position can stay still before it counts as frozen
+START_TIMEOUT = 5.0 # seconds a video can take to open before it counts as failed
+BLOCK_FAILURES = 3 # failures before a file is skipped for good
+ERROR_STREAK = 3 # videos in a row that VLC reports an error for before VLC itself is restarted
+RETRY_TIMEOUT = 0.5 # seconds the video after a failed one can take to open
+RECOVERY_INTERVAL = 0.1 # seconds between checks on the player until it recovers from a failure
+RECOVERY_TARGET = 1_000 # milliseconds from noticing a failure to the next picture
+
+# Default location of the blocklist: next to the videos root
+def default_blocklist_path(videoRoot):
+    return os.path.join(os.path.dirname(os.path.normpath(videoRoot)), 'blocklist.json')
+
+# Stop and release the objects of a VLC that has been replaced (media players, a MediaPool, the
+# instance last), in order, on another thread: if VLC is stuck, that may never return
+def release_in_background(*vlcObjects):
+    def release():
+        for vlcObject in vlcObjects:
+            try:
+                if (hasattr(vlcObject, 'close')):
+                    vlcObject.close()
+                    continue
+                if (hasattr(vlcObject, 'stop')):
+                    vlcObject.stop()
+                vlcObject.release()
+            except Exception as e:
+                log.warning("Unable to release the old VLC: %s", e)
+    threading.Thread(target=release, name='vlc-release', daemon=True).start()
+
+
+class Blocklist:
+    def __init__(self, path, failures=BLOCK_FAILURES):
+        self._path = path
+        self._failures = failures
+        self._entries = {} # file path -> [mtime, failures, last reason]
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self._path, 'r') as file:
+                self._entries = {path: list(entry) for path, entry in json.load(file).items()}
+        except (OSError, ValueError):
+            self._entries = {}
+        return self
+
+    # Number of files blocked
+    def __len__(self):
+        return sum(1 for entry in list(self._entries.values()) if entry[1] >= self._failures)
+
+    # True if the file at path has failed too often (and hasn't been replaced since)
+    def is_blocked(self, path):
+        entry = self._entries.get(str(path))
+        if (entry is None or entry[1] < self._failures):
+            return False
+        return entry[0] == get_mtime(str(path))
+
+    # Count a failure against the file at path.  Returns True if it is now blocked.
+    def failed(self, path, reason):
+        path = str(path)
+        mtime = get_mtime(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if (entry is None or entry[0] != mtime):
+                entry = [mtime, 0, reason] # New, or replaced since it last failed
+            entry[1] += 1
+            entry[2] = reason
+            self._entries[path] = entry
+            blocked = entry[1] >= self._failures
+        self._save()
+        if (blocked):
+            log.warning("'%s' has failed %d times (%s): skipping it from now on", path, entry[1], reason)
+        return blocked
+
+    # A failure counted against the file at path was VLC's fault after all: take it back
+    def forgive(self, path):
+        path = str(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if (entry is None):
+                return
+            entry[1] -= 1
+            if (entry[1] <= 0):
+                del self._entries[path]
+        self._save()
+
+    # The file at path played to the end: forget its failures
+    def played(self, path):
+        with self._lock:
+            forgotten = self._entries.pop(str(path), None)
+        if (forgotten is not None):
+            self._save()
+
+    def _save(self):
+        with self._lock:
+            data = json.dumps(self._entries, separators=(',', ':')).encode('utf-8')
+        try:
+            write_file_atomic(self._path, data)
+        except OSError as e:
+            log.warning("Unable to save the blocklist '%s': %s", self._path, e)
+
+
+class PlaybackSupervisor:
+    # player is the VLC media player to watch.  onSkip(reason) and onRestart(reason) are called on
+    # the supervisor's thread, and should hand the work over to the player's own thread.
+    def __init__(self, player, onSkip, onRestart, blocklist=None, tracer=None, history=50):
+        self._onSkip = onSkip
+        self._onRestart = onRestart
+        self._blocklist = blocklist
+        self._tracer = tracer
+        self._history = history
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._player = None
+        self._error = False # VLC reported an error that hasn't been handled yet
+        self._path = None # What the player was playing at the last check...
+        self._state = None
+        self._stateSince = 0 # ... in which state since when (time.monotonic())
+        self._position = None
+        self._progressAt = 0 # When the position last moved
+        self._reportedAt = None # When a failure of this path and state was last acted on
+        self._failedAt = None # When the first failure since the last picture was noticed
+        self._firstReason = None
+        self._streak = 0 # Failures since the last picture (or VLC restart)
+        self._blamed = [] # Files failures of the streak were counted against
+        self._restarted = False # VLC was restarted and hasn't shown a picture since
+        self._shownPath = None # The file the last picture was from
+        self.interval = HEARTBEAT_INTERVAL
+        self.stallTime = STALL_TIME
+        self.startTimeout = START_TIMEOUT
+        self.retryTimeout = RETRY_TIMEOUT
+        self.recoveryInterval = RECOVERY_INTERVAL
+        self.failures = [] # (path, reason, action) of the latest failures
+        self.recoveries = [] # (reason, milliseconds from the failure being noticed to the next picture)
+        self.attach(player)
+
+    # Watch a VLC media player: the first one, or a new one after VLC was restarted
+    def attach(self, player):
+        events = player.event_manager()
+        events.event_attach(vlc.EventType.MediaPlayerEncounteredError, self._on_error, player)
+        events.event_attach(vlc.EventType.MediaPlayerVout, self._on_vout, player)
+        events.event_attach(vlc.EventType.MediaPlayerEndReached, self._on_end_reached, player)
+        with self._lock:
+            self._player = player
+            self._error = False
+            self._path = None
+            self._state = None
+            self._reportedAt = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='playback-supervisor', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if (self._thread is not None):
+            self._thread.join()
+
+    def _run(self):
+        while (not self._stopped):
+            self._wake.wait(self.interval if self._failedAt is None else self.recoveryInterval)
+            self._wake.clear()
+            if (self._stopped):
+                break
+            try:
+                self.check()
+            except Exception:
+                log.exception("Unable to check on the player")
+
+    # One heartbeat: act on an error, or on the playing video having stopped making progress
+    def check(self):
+        now = time_.monotonic()
+        player = self._player
+        state = player.get_state()
+        media = player.get_media()
+        path = media_path(media) if media is not None else None
+        if (media is not None):
+            media.release() # get_media() returns a new reference
+        with self._lock:
+            error, self._error = self._error, False
+            if (player is not self._player):
+                return # VLC was restarted in the meantime
+            if (path != self._path or state != self._state):
+                if (path != self._path):
+                    self._position = None
+                self._path, self._state, self._stateSince = path, state, now
+                self._progressAt = now
+                self._reportedAt = None
+        reason = None
+        if (error or state == vlc.State.Error):
+            reason = 'error'
+        elif (state in (vlc.State.Opening, vlc.State.Buffering)):
+            timeout = self.startTimeout if self._failedAt is None else self.retryTimeout
+            if (now - self._stateSince >= timeout):
+                reason = 'not opening'
+        elif (state == vlc.State.Playing):
+            position = player.get_time()
+            if (position != self._position):
+                self._position = position
+                self._progressAt = now
+            elif (now - self._progressAt >= self.stallTime):
+                reason = 'frozen'
+        if (reason is None):
+            return None
+        if (self._reportedAt is not None and now - self._reportedAt < self.startTimeout):
+            return None # Already being dealt with
+        self._reportedAt = now
+        return self._fail(path, reason, now)
+
+    def _fail(self, path, reason, now):
+        with self._lock:
+            self._streak += 1
+            # VLC reporting an error is still answering, unless it reports one for every video:
+            # otherwise only blame VLC if it stops answering
+            if (reason == 'error'):
+                action = 'restart' if (self._streak >= ERROR_STREAK) else 'skip'
+            else:
+                action = 'restart' if (self._streak > 1) else 'skip'
+            if (self._failedAt is None):
+                self._failedAt = now
+                self._firstReason = reason
+            forgiven = []
+            if (action == 'restart'):
+                if (reason == 'error'):
+                    forgiven = self._blamed # The errors were VLC's, not the files'
+                self._streak = 0
+                self._blamed = []
+                self._restarted = True
+            blame = action == 'skip' and not self._restarted and path is not None and self._blocklist is not None
+            if (blame):
+                self._blamed.append(path)
+            self.failures.append((path, reason, action))
+            del self.failures[:-self._history]
+        for forgivenPath in forgiven:
+            self._blocklist.forgive(forgivenPath)
+        blocked = False
+        if (blame):
+            blocked = self._blocklist.failed(path, reason)
+        log.warning("Playback failed (%s) on '%s': %s", reason, path, "skipping it" if action == 'skip' else "restarting VLC")
+        if (self._tracer is not None):
+            self._tracer.trace('failure', path=path, reason=reason, action=action, blocked=blocked)
+        if (action == 'skip'):
+            self._onSkip(reason)
+        else:
+            self._onRestart(reason)
+        return action
+
+    def _on_error(self, event, player):
+        if (player is self._player):
+            self._error = True
+            self._wake.set() # Don't wait for the next heartbeat
+
+    def _on_vout(self, event, player):
+        if (event.u.new_count <= 0 or player is not self._player):
+            return
+        media = player.get_media()
+        if (media is not None):
+            self._shownPath = media_path(media)
+            media.release()
+        with self._lock:
+            failedAt, reason = self._failedAt, self._firstReason
+            self._failedAt = None
+            self._streak = 0
+            self._blamed = []
+            self._restarted = False
+            if (failedAt is None):
+                return
+            latency = (time_.monotonic() - failedAt) * 1_000
+            self.recoveries.append((reason, latency))
+            del self.recoveries[:-self._history]
+        if (latency > RECOVERY_TARGET):
+            log.warning("Recovered from the failure (%s) in %.0f ms", reason, latency)
+        else:
+            log.info("Recovered from the failure (%s) in %.0f ms", reason, latency)
+        if (self._tracer is not None):
+            self._tracer.trace('recovered', reason=reason, latency=round(latency, 1))
+
+    # The file that ended is the one the last picture was from: a media list player may already
+    # have moved on to the next file
+    def _on_end_reached(self, event, player):
+        if (self._blocklist is not None and player is self._player and self._shownPath is not None):
+            self._blocklist.played(self._shownPath)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+######################################################################################
+# transcode.py
+# Purpose:   Make Pi friendly copies of the video library.
+#
+#            The Raspberry Pi Zero 2 W struggles to decode 1080p HEVC or H.264 only to scale it
+#            down to a 3.5" screen.  This tool walks the same videos root as the players and uses
+#            ffmpeg to make a copy of every video as H.264 at the screen's resolution with a
+#            capped bitrate.  Each copy is saved in a ".pi" sub-directory of its channel (e.g.
+#            videos/The Simpsons/.pi/S01E01.mp4) and the players play the copy instead of the
+#            original whenever there is one.
+#
+#            A manifest (videos/.transcode-manifest.json) records the size and modification time
+#            of each original that has been converted, so running the tool again only converts
+#            new or changed videos.  Copies are written to a ".part" file and renamed once
+#            complete, so the tool can be interrupted (CTRL+C) and simply run again.
+#
+#            It can be run on the Pi, or much faster on a PC against a copy of the videos.
+#
+#            With --label it makes an extra copy next to the first one instead, e.g. a lighter
+#            one for when the Pi can't keep up (see governor.py):
+#                python3 transcode.py --label 240p --width 360 --height 240 --max-bitrate 500
+#            saves videos/The Simpsons/.pi/S01E01.240p.mp4.
+#
+#            python3 transcode.py [--root /home/pi/simpsonstv/videos/] [--width 480] [--height 320]
+#                                 [--max-bitrate 1200] [--label NAME] [--workers N] [--dry-run]
+###########################################################################################
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time as time_ # Don't override time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from library import RENDITIONS_DIRECTORY, normalise_extensions, write_file_atomic
+
+VIDEO_FILE_EXTENSIONS = ('.mkv', '.mp4', '.avi', '.m4v', '.mov')
+MANIFEST_NAME = '.transcode-manifest.json'
+
+# ffmpeg settings for a copy: H.264 (which the Pi decodes in hardware) scaled to fit the screen,
+# with a short keyframe interval so seeking and rewinding stay quick
+def ffmpeg_arguments(source, output, args):
+    return [
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', source,
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-vf', f"scale={args.width}:{args.height}:force_original_aspect_ratio=decrease:force_divisible_by=2",
+        '-c:v', 'libx264', '-preset', args.preset, '-profile:v', 'high', '-pix_fmt', 'yuv420p',
+        '-crf', str(args.crf), '-maxrate', f"{args.max_bitrate}k", '-bufsize', f"{args.max_bitrate * 2}k",
+        '-g', '48',
+        '-c:a', 'aac', '-b:a', '128k', '-ac', '2',
+        '-movflags', '+faststart',
+        '-f', 'mp4', output,
+    ]
+
+# Settings that, if changed, mean existing copies need to be made again
+def profile_name(args):
+    return f"h264 {args.width}x{args.height} crf{args.crf} max{args.max_bitrate}k"
+
+# Runs in a worker process: convert one video to output + '.part' and rename it when complete.
+# Returns (source, error message or None, seconds).
+def transcode(source, output, command):
+    start = time_.monotonic()
+    partPath = output + '.part'
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if (result.returncode != 0):
+        try:
+            os.remove(partPath)
+        except OSError:
+            pass
+        return source, result.stderr.decode('utf-8', 'replace').strip() or f"ffmpeg exit code {result.returncode}", 0
+    os.replace(partPath, output)
+    return source, None, time_.monotonic() - start
+
+# Every (channel, video file) under the videos root
+def find_videos(videoRoot, extensions):
+    videos = []
+    for channel in sorted(os.listdir(videoRoot)):
+        channelPath = os.path.join(videoRoot, channel)
+        if (channel.startswith('.') or not os.path.isdir(channelPath)):
+            continue
+        for file in sorted(os.listdir(channelPath)):
+            if (file.lower().endswith(extensions) and os.path.isfile(os.path.join(channelPath, file))):
+                videos.append((channel, file))
+    return videos
+
+def load_manifest(path):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(path, manifest):
+    write_file_atomic(path, json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+
+def main():
+    parser = argparse.ArgumentParser(description='Make Pi friendly copies of the Simpsons TV video library')
+    parser.add_argument('--root', default='/home/pi/simpsonstv/videos/', help='videos root directory')
+    parser.add_argument('--width', type=int, default=480, help='screen width in pixels')
+    parser.add_argument('--height', type=int, default=320, help='screen height in pixels')
+    parser.add_argument('--max-bitrate', type=int, default=1200, help='maximum video bitrate in kbit/s')
+    parser.add_argument('--crf', type=int, default=23, help='x264 quality (lower is better)')
+    parser.add_argument('--preset', default='medium', help='x264 preset (slower makes smaller files)')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help='number of videos to convert at once')
+    parser.add_argument('--label', help='make an extra copy named <video>.<label>.mp4, e.g. a lighter one')
+    parser.add_argument('--dry-run', action='store_true', help='list the videos that would be converted')
+    args = parser.parse_args()
+
+    if (not args.dry_run and shutil.which('ffmpeg') is None):
+        print("ffmpeg was not found. Install it with: sudo apt-get install ffmpeg")
+        sys.exit(1)
+
+    manifestPath = os.path.join(args.root, MANIFEST_NAME)
+    manifest = load_manifest(manifestPath)
+    profile = profile_name(args)
+
+    # Work out which videos need converting
+    jobs = []
+    for channel, file in find_videos(args.root, normalise_extensions(VIDEO_FILE_EXTENSIONS)):
+        source = os.path.join(args.root, channel, file)
+        name = os.path.splitext(file)[0] + (f".{args.label}" if args.label else '') + '.mp4'
+        output = os.path.join(args.root, channel, RENDITIONS_DIRECTORY, name)
+        stat = os.stat(source)
+        key = os.path.join(channel, file) + (f" [{args.label}]" if args.label else '')
+        entry = manifest.get(key)
+        if (entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns
+                and entry['profile'] == profile and os.path.exists(output)):
+            continue
+        jobs.append((key, source, output, stat))
+
+    print(f"{len(jobs)} video(s) to convert ({profile}).")
+    if (args.dry_run or len(jobs) <= 0):
+        for key, source, output, stat in jobs:
+            print(f"  {key}")
+        return
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(transcode, source, output, ffmpeg_arguments(source, output + '.part', args)):
+                   (key, output, stat) for key, source, output, stat in jobs}
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                key, output, stat = futures[future]
+                source, error, seconds = future.result()
+                if (error is not None):
+                    failures += 1
+                    print(f"[{done}/{len(jobs)}] FAILED {key}: {error}")
+                    continue
+                # Record each finished copy straight away so an interrupted run can carry on
+                manifest[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'profile': profile,
+                                 'output': os.path.relpath(output, args.root)}
+                save_manifest(manifestPath, manifest)
+                print(f"[{done}/{len(jobs)}] {key} ({seconds:.0f}s)")
+        except KeyboardInterrupt:
+            print("Interrupted - run again to carry on where this run stopped.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            sys.exit(130)
+
+    if (failures > 0):
+        print(f"{failures} video(s) could not be converted.")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
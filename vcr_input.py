@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+######################################################################################
+# vcr_input.py
+# Purpose:   Event driven input engine for the VCR buttons and the safe shutdown signal.
+#
+#            GPIO edges are delivered by RPi.GPIO's edge detection thread and queued to a
+#            single engine thread.  Each button runs its own small state machine
+#            (released -> pressing -> pressed -> releasing) and every debounce or hold time
+#            is a deadline in a timer heap.  The engine thread sleeps until the next edge or
+#            the next deadline, so an idle TV uses no CPU polling the buttons.
+#
+#            If given a metrics.Tracer, every edge and debounce decision is traced.  A callback
+#            that raises an exception is logged and the engine carries on, so one failed player
+#            command doesn't leave the buttons dead.
+#
+#            The engine can also be driven directly with feed() and advance() using a
+#            simulated clock, and simulation.SimulatedGPIO stands in for RPi.GPIO when there
+#            is no hardware attached.
+###########################################################################################
+
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time as time_ # Don't override time
+
+log = logging.getLogger(__name__)
+
+# Retrieves a monotonic timestamp in milliseconds
+def get_timestamp():
+    return int(time_.monotonic() * 1_000)
+
+
+# A pending call created by InputEngine.call_later()
+class Timer:
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+# A long press action.  Fires "after" milliseconds from the start of the press and, if
+# "repeat" is set, again every "repeat" milliseconds while the button stays pressed.
+class Hold:
+    def __init__(self, after, callback, repeat=None):
+        self.after = after
+        self.callback = callback
+        self.repeat = repeat
+
+
+# Per-button state machine
+#   RELEASED  -> PRESSING   input goes LOW, press debounce timer started
+#   PRESSING  -> RELEASED   input goes HIGH before the press debounce expires (a bounce)
+#   PRESSING  -> PRESSED    press debounce expires: on_press() and hold timers start
+#   PRESSED   -> RELEASING  input goes HIGH, release debounce timer started
+#   RELEASING -> PRESSED    input goes LOW again before the release debounce expires
+#   RELEASING -> RELEASED   release debounce expires: on_release(heldFor, holdsFired)
+class VcrButton:
+    RELEASED = 'released'
+    PRESSING = 'pressing'
+    PRESSED = 'pressed'
+    RELEASING = 'releasing'
+
+    def __init__(self, pin, on_press=None, on_release=None, holds=(), pressDebounce=100, releaseDebounce=50):
+        self.pin = pin
+        self.on_press = on_press
+        self.on_release = on_release
+        self.holds = list(holds)
+        self.pressDebounce = pressDebounce
+        self.releaseDebounce = releaseDebounce
+        self.state = self.RELEASED
+        self.pressStartTime = 0
+        self.holdsFired = 0
+        self._firedHolds = set()
+        self._engine = None
+        self._timer = None
+        self._holdTimers = []
+
+    def is_pressed(self):
+        return self.state in (self.PRESSED, self.RELEASING)
+
+    def _edge(self, level, now):
+        if not level:
+            if (self.state == self.RELEASED):
+                self.state = self.PRESSING
+                self.pressStartTime = now
+                self.holdsFired = 0
+                self._firedHolds = set()
+                self._timer = self._engine.call_later(self.pressDebounce, self._pressed)
+                self._engine.trace('debounce', pin=self.pin, decision='pressing')
+            elif (self.state == self.RELEASING):
+                self.state = self.PRESSED
+                self._timer.cancel()
+                self._start_holds(now)
+                self._engine.trace('debounce', pin=self.pin, decision='release bounce ignored')
+        else:
+            if (self.state == self.PRESSING):
+                self.state = self.RELEASED
+                self._timer.cancel()
+                self._engine.trace('debounce', pin=self.pin, decision='press bounce ignored')
+            elif (self.state == self.PRESSED):
+                self.state = self.RELEASING
+                self._cancel_holds()
+                self._timer = self._engine.call_later(self.releaseDebounce, self._released)
+                self._engine.trace('debounce', pin=self.pin, decision='releasing')
+
+    def _pressed(self):
+        self.state = self.PRESSED
+        self._engine.trace('pressed', pin=self.pin)
+        if (self.on_press):
+            self._engine.run_callback(self.on_press)
+        self._start_holds(self._engine.now)
+
+    def _released(self):
+        self.state = self.RELEASED
+        self._engine.trace('released', pin=self.pin, heldFor=self._engine.now - self.pressStartTime)
+        if (self.on_release):
+            self._engine.run_callback(self.on_release, self._engine.now - self.pressStartTime, self.holdsFired)
+
+    # (Re)start the hold timers that are still due, measured from the start of the press
+    def _start_holds(self, now):
+        self._cancel_holds()
+        for hold in self.holds:
+            deadline = self.pressStartTime + hold.after
+            if (hold in self._firedHolds):
+                if (hold.repeat is None):
+                    continue # One-shot holds only fire once per press
+                deadline += -(-(now - deadline) // hold.repeat) * hold.repeat
+            deadline = max(deadline, now)
+            self._holdTimers.append(self._engine.call_at(deadline, self._hold, hold))
+
+    def _cancel_holds(self):
+        for timer in self._holdTimers:
+            timer.cancel()
+        self._holdTimers = []
+
+    def _hold(self, hold):
+        self.holdsFired += 1
+        self._firedHolds.add(hold)
+        self._engine.trace('held', pin=self.pin, after=hold.after, count=self.holdsFired)
+        self._engine.run_callback(hold.callback)
+        if (hold.repeat is not None and self.state == self.PRESSED):
+            self._holdTimers.append(self._engine.call_later(hold.repeat, self._hold, hold))
+
+
+# Fires a callback once all the given pins have been held LOW for holdTime milliseconds.
+# This works on the raw input levels, like the original "both buttons" exit check.
+class ButtonCombo:
+    def __init__(self, pins, holdTime, callback):
+        self.pins = tuple(pins)
+        self.holdTime = holdTime
+        self.callback = callback
+        self._timer = None
+
+    def _update(self, engine):
+        allLow = all(not engine.level(pin) for pin in self.pins)
+        if (allLow and self._timer is None):
+            self._timer = engine.call_later(self.holdTime, self._fire)
+        elif (not allLow and self._timer is not None):
+            self._timer.cancel()
+            self._timer = None
+
+    def _fire(self):
+        self._timer = None
+        self.callback()
+
+
+class InputEngine:
+    def __init__(self, gpio, clock=get_timestamp, tracer=None):
+        self._gpio = gpio
+        self._clock = clock
+        self._tracer = tracer
+        self._buttons = {}
+        self._combos = []
+        self._levels = {}
+        self._timers = []
+        self._sequence = itertools.count()
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self.now = clock()
+
+    def add_button(self, button):
+        button._engine = self
+        self._buttons[button.pin] = button
+        self._levels[button.pin] = True
+        return button
+
+    def add_combo(self, combo):
+        self._combos.append(combo)
+        return combo
+
+    def trace(self, event, **fields):
+        if (self._tracer is not None):
+            self._tracer.trace(event, **fields)
+
+    def level(self, pin):
+        return self._levels.get(pin, True)
+
+    # Schedule callback(*args) at an absolute engine time
+    def call_at(self, deadline, callback, *args):
+        timer = Timer(deadline, (lambda: callback(*args)) if args else callback)
+        with self._lock:
+            heapq.heappush(self._timers, (deadline, next(self._sequence), timer))
+        if (self._is_foreign_thread()):
+            self._events.put(None) # Wake the engine so it sees the new deadline
+        return timer
+
+    # Schedule callback(*args) "delay" milliseconds from now
+    def call_later(self, delay, callback, *args):
+        now = self._clock() if self._is_foreign_thread() else self.now
+        return self.call_at(now + delay, callback, *args)
+
+    # Run callback(*args) on the engine thread as soon as possible.  Safe to call from any
+    # thread (GPIO callbacks, VLC events...)
+    def call_soon(self, callback, *args):
+        self._events.put((callback, args))
+
+    # Configure edge detection for every button and pick up the current input levels
+    def start(self):
+        self.now = self._clock()
+        for pin in self._buttons:
+            self._gpio.add_event_detect(pin, self._gpio.BOTH, callback=self._gpio_callback)
+        for pin in self._buttons:
+            self.feed(pin, self._gpio.input(pin), self.now)
+
+    # Process edges and timers until stop() is called.  Blocks between events.
+    def run(self):
+        self._thread = threading.current_thread()
+        self.start()
+        self._running = True
+        while (self._running):
+            timeout = None
+            with self._lock:
+                if (self._timers):
+                    timeout = max(0, self._timers[0][0] - self._clock()) / 1_000
+            try:
+                event = self._events.get(timeout=timeout)
+            except queue.Empty:
+                event = None
+            now = self._clock()
+            while (event is not None or not self._events.empty()):
+                if (event is None):
+                    event = self._events.get_nowait()
+                self._dispatch(event, now)
+                event = None
+            self.advance(now)
+
+    def _is_foreign_thread(self):
+        return self._running and threading.current_thread() is not self._thread
+
+    def stop(self):
+        self._running = False
+        self._events.put(None)
+
+    # Runs on RPi.GPIO's edge detection thread
+    def _gpio_callback(self, channel):
+        level = self._gpio.input(channel)
+        self.trace('edge', pin=channel, level=level)
+        self._events.put(('edge', channel, level))
+
+    def _dispatch(self, event, now):
+        if (event is None):
+            return
+        if (event[0] == 'edge'):
+            self.feed(event[1], event[2], now)
+        else:
+            callback, args = event
+            self.now = now
+            self.run_callback(callback, *args)
+
+    # Run callback(*args), logging any exception instead of letting it end run()
+    def run_callback(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            log.exception("Input callback '%s' failed", getattr(callback, '__name__', callback))
+
+    # Deliver an input level change at time "now" (simulated or real)
+    def feed(self, pin, level, now):
+        self.advance(now)
+        level = bool(level)
+        if (self._levels.get(pin) == level):
+            return
+        self._levels[pin] = level
+        self._buttons[pin]._edge(level, now)
+        for combo in self._combos:
+            if (pin in combo.pins):
+                combo._update(self)
+
+    # Fire every timer due at or before "now" (simulated or real)
+    def advance(self, now):
+        while (True):
+            with self._lock:
+                if (not self._timers or self._timers[0][0] > now):
+                    break
+                deadline, _, timer = heapq.heappop(self._timers)
+            if (timer.cancelled):
+                continue
+            self.now = deadline
+            self.run_callback(timer.callback)
+        self.now = now
+
+    # Milliseconds until the next pending timer, or None when idle
+    def next_deadline(self):
+        with self._lock:
+            while (self._timers and self._timers[0][2].cancelled):
+                heapq.heappop(self._timers)
+            return self._timers[0][0] if self._timers else None
+
+
+# Self check: idle CPU and gesture handling without any hardware attached
+if __name__ == '__main__':
+    from simulation import SimulatedGPIO
+    gpio = SimulatedGPIO()
+    gpio.setup(25, gpio.IN, pull_up_down=gpio.PUD_UP)
+    engine = InputEngine(gpio)
+    engine.add_button(VcrButton(25,
+            on_press=lambda: print("Right: next video"),
+            holds=[Hold(2_000, lambda: print("Right: next channel"))]))
+    thread = threading.Thread(target=engine.run, daemon=True)
+    thread.start()
+
+    cpuStart = time_.process_time()
+    wallStart = time_.monotonic()
+    time_.sleep(3)
+    idleCpu = (time_.process_time() - cpuStart) / (time_.monotonic() - wallStart)
+    print(f"Idle CPU: {idleCpu * 100:.2f}%")
+
+    gpio.set_input(25, False)
+    time_.sleep(2.2)
+    gpio.set_input(25, True)
+    time_.sleep(0.2)
+    engine.stop()
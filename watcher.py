@@ -0,0 +1,228 @@
+######################################################################################
+# watcher.py
+# Purpose:   Pick up videos and channels that are added or removed while the players run.
+#
+#            LibraryWatcher watches the videos root, every channel directory and every ".pi"
+#            directory of Pi friendly copies with inotify (through ctypes, no extra packages).
+#            Where inotify isn't available it polls the modification times of those directories,
+#            and the sizes and modification times of the files in them, every POLL_INTERVAL
+#            seconds instead.
+#
+#            Changes are debounced: the library is only reconciled (see LibraryIndex.reconcile(),
+#            which rescans just the directories that changed) once nothing has changed for
+#            SETTLE_TIME seconds, so copying hundreds of files is one rebuild, not one per file,
+#            and a file isn't picked up half copied.  onChanged() is then called on the
+#            watcher's thread, never on the playback thread, for the player to swap in the new
+#            list of videos.
+###########################################################################################
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time as time_ # Don't override time
+
+from library import RENDITIONS_DIRECTORY
+
+log = logging.getLogger(__name__)
+
+SETTLE_TIME = 3.0 # seconds without a change before the library is reconciled
+POLL_INTERVAL = 30.0 # seconds between checks when inotify isn't available
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len (followed by len bytes of name)
+
+
+# The Linux inotify API through ctypes
+class Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if (self.fd < 0):
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._watches = {} # path -> watch descriptor
+
+    # Watch a directory (again, if it was replaced).  Returns False if it can't be watched.
+    def watch(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if (wd < 0):
+            return False
+        self._watches[path] = wd
+        return True
+
+    def is_watched(self, path):
+        return path in self._watches
+
+    # Wait up to timeout seconds (None is forever) for events.  Returns a list of (mask, name)
+    # and forgets the watches of directories that have gone.
+    def read(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if (not readable):
+            return []
+        try:
+            data = os.read(self.fd, 65_536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while (offset + EVENT_HEADER.size <= len(data)):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if (mask & IN_IGNORED):
+                self._watches = {path: watch for path, watch in self._watches.items() if watch != wd}
+            events.append((mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LibraryWatcher:
+    def __init__(self, library, onChanged=None, settle=SETTLE_TIME, pollInterval=POLL_INTERVAL):
+        self._library = library
+        self._videoRoot = os.path.normpath(library.get_video_root())
+        self._onChanged = onChanged
+        self._settle = settle
+        self._pollInterval = pollInterval
+        self._stopped = threading.Event()
+        self._thread = None
+        self.mode = None # 'inotify' or 'polling' once started
+        self.rebuilds = 0 # Number of times the library changed and onChanged() was called
+
+    # Start watching on a background thread.  The library is reconciled straight away to pick
+    # up anything that changed while the player wasn't running.
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='library-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if (self._thread is not None):
+            self._thread.join()
+
+    def _run(self):
+        try:
+            inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            log.info("inotify isn't available (%s): checking the library every %.0f seconds", e, self._pollInterval)
+            inotify = None
+        try:
+            if (inotify is not None):
+                self.mode = 'inotify'
+                self._watch_tree(inotify) # Before reconciling, so nothing is missed in between
+                self._reconcile()
+                self._watch_tree(inotify)
+                self._run_inotify(inotify)
+            else:
+                self.mode = 'polling'
+                self._reconcile()
+                self._run_polling()
+        finally:
+            if (inotify is not None):
+                inotify.close()
+
+    def _run_inotify(self, inotify):
+        due = None # When to reconcile, once events stop arriving
+        while (not self._stopped.is_set()):
+            # Wake up at least once a second to notice stop()
+            timeout = 1.0 if due is None else min(1.0, max(0, due - time_.monotonic()))
+            events = inotify.read(timeout)
+            if (events):
+                due = time_.monotonic() + self._settle
+                if (any(mask & (IN_CREATE | IN_MOVED_TO | IN_Q_OVERFLOW) for mask, name in events)):
+                    self._watch_tree(inotify) # A new channel or ".pi" directory may have appeared
+            elif (due is not None and time_.monotonic() >= due):
+                due = None
+                self._reconcile()
+                self._watch_tree(inotify)
+
+    def _run_polling(self):
+        snapshot = self._snapshot()
+        changed = False
+        while (not self._stopped.wait(self._pollInterval)):
+            current = self._snapshot()
+            if (current != snapshot):
+                snapshot = current
+                changed = True # Wait until a whole interval passes without changes
+            elif (changed):
+                changed = False
+                self._reconcile()
+
+    # The videos root, its channel directories and their ".pi" directories
+    def _directories(self):
+        directories = [self._videoRoot]
+        try:
+            with os.scandir(self._videoRoot) as entries:
+                channels = [entry.path for entry in entries if entry.is_dir() and not entry.name.startswith('.')]
+        except OSError:
+            channels = []
+        for channel in channels:
+            directories.append(channel)
+            renditions = os.path.join(channel, RENDITIONS_DIRECTORY)
+            if (os.path.isdir(renditions)):
+                directories.append(renditions)
+        return directories
+
+    def _watch_tree(self, inotify):
+        for directory in self._directories():
+            if (not inotify.is_watched(directory)):
+                inotify.watch(directory)
+
+    # The modification time of each directory and the size and modification time of each file in
+    # it: a file being copied doesn't change its directory's modification time
+    def _snapshot(self):
+        snapshot = {}
+        for directory in self._directories():
+            try:
+                files = {}
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if (entry.is_file()):
+                            stat = entry.stat()
+                            files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                snapshot[directory] = (os.stat(directory).st_mtime_ns, files)
+            except OSError:
+                pass
+        return snapshot
+
+    def _reconcile(self):
+        try:
+            changed = self._library.reconcile()
+        except OSError as e:
+            log.warning("Unable to update the library index: %s", e)
+            return
+        if (not changed):
+            return
+        self.rebuilds += 1
+        log.info("Library changed: %d channels", len(self._library.get_channels()))
+        if (self._onChanged is not None):
+            try:
+                self._onChanged()
+            except Exception:
+                log.exception("Unable to apply the library changes")